@@ -0,0 +1,33 @@
+#! /opt/stack/bin/python3
+#
+# @copyright@
+# Copyright (c) 2006 - 2019 Teradata
+# All rights reserved. Stacki(r) v5.x stacki.com
+# https://github.com/Teradata/stacki/blob/master/LICENSE.txt
+# @copyright@
+
+import sys
+import os
+import daemon
+import lockfile.pidlockfile
+import signal
+import stack.stackd
+
+
+def Handler(signal, frame):
+	sys.exit(0)
+
+
+if 'STACKDEBUG' not in os.environ:
+	lock = lockfile.pidlockfile.PIDLockFile('/var/run/%s/%s.pid' % 
+						('stackd', 'stackd'))
+	daemon.DaemonContext(pidfile=lock).open()
+
+signal.signal(signal.SIGINT, Handler)
+signal.signal(signal.SIGTERM, Handler)
+
+server = stack.stackd.Server()
+try:
+	server.serve_forever()
+finally:
+	server.server_close()
@@ -20,6 +20,7 @@ import getopt
 import traceback
 import signal
 import stack
+import stack.stackd
 from stack.exception import CommandError
 
 
@@ -105,6 +106,7 @@ def run_command(args, debug=False):
 
 	try:
 		command = getattr(module, 'Command')(db, debug=debug)
+		command.stream = sys.stdout
 		rc = command.runWrapper(name, args[i:])
 	except CommandError as e:
 		sys.stderr.write('%s\n' % e)
@@ -138,6 +140,14 @@ def run_command(args, debug=False):
 
 
 
+# Let the stackd server run the command if it is up, it already has the
+# command tree loaded.
+
+rc = stack.stackd.Call(sys.argv)
+if rc is not None:
+	sys.exit(rc)
+
+
 # attach a prettier interrupt handler to SIGINT (ctrl-c)
 signal.signal(signal.SIGINT, sigint_handler)
 
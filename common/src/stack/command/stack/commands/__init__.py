@@ -10,6 +10,7 @@
 # https://github.com/Teradata/stacki/blob/master/LICENSE-ROCKS.txt
 # @rocks@
 
+import builtins
 import os
 import time
 import socket
@@ -36,7 +37,7 @@ import threading
 
 import stack.graph
 import stack
-from stack.cond import EvalCondExpr
+from stack.cond import EvalCondExpr, CompileCondExpr, CreateCondEnv
 from stack.exception import (
 	CommandError, ParamRequired, ArgNotFound, ArgRequired, ArgUnique, ParamError
 )
@@ -304,7 +305,7 @@ class SwitchArgumentProcessor:
 
 	def delSwitchEntries(self, args=None):
 		"""
-		Delete foreign key references from switchports
+		Delete foreign key references from switchports and switchmacs
 		"""
 
 		if not args:
@@ -315,6 +316,10 @@ class SwitchArgumentProcessor:
 				delete from switchports
 				where switch=(select id from nodes where name=%s)
 			""", (arg,))
+			self.db.execute("""
+				delete from switchmacs
+				where switch=(select id from nodes where name=%s)
+			""", (arg,))
 
 	def getSwitchNetwork(self, switch):
 		"""
@@ -486,6 +491,21 @@ class HostArgumentProcessor:
 	An Interface class to add the ability to process host arguments.
 	"""
 
+	# Scoped host names (e.g. 'a:backend') and the query that selects
+	# their hosts. The names are compared as binary strings since the
+	# scopes have always been matched case sensitive.
+	hostScopes = {
+		'a': 'n.name from nodes n, appliances a where n.appliance=a.id and a.name=binary %s',
+		'e': 'n.name from nodes n, environments e where n.environment=e.id and e.name=binary %s',
+		'o': 'n.name from nodes n, boxes b, oses o where n.box=b.id and b.os=o.id and o.name=binary %s',
+		'b': 'n.name from nodes n, boxes b where n.box=b.id and b.name=binary %s',
+		'g': """
+			n.name from nodes n, memberships m, groups g
+			where m.nodeid=n.id and m.groupid=g.id and g.name=binary %s
+			""",
+		'r': 'name from nodes where rack=binary %s',
+	}
+
 	def sortHosts(self, hosts):
 		def racksort(a):
 			try:
@@ -545,7 +565,6 @@ class HostArgumentProcessor:
 		host_filter = lambda self, host: self.db.getHostOS(host) == 'redhat'
 		"""
 
-		adhoc	 = False
 		hostList = []
 		hostDict = {}
 
@@ -595,34 +614,35 @@ class HostArgumentProcessor:
 			else:
 				hostDict[host] = self.db.getNodeName(host, subnet)
 
-		l = []
+		# The scoped names (e.g. 'a:backend') are resolved with a
+		# single query each, ad-hoc 'where' groups are compiled once
+		# and evaluated against each host's attributes.
+
+		selectors = []
+		adhoc	  = False
 		if names:
 			for host in names:
 				tokens = host.split(':', 1)
 				if len(tokens) == 2:
 					scope, target = tokens
-					if scope == 'a':
-						l.append('where appliance == "%s"' % target)
-					elif scope == 'e':
-						l.append('where environment == "%s"' % target)
-					elif scope == 'o':
-						l.append('where os == "%s"' % target)
-					elif scope == 'b':
-						l.append('where box == "%s"' % target)
-					elif scope == 'g':
-						l.append('where group.%s == True' % target)
-					elif scope == 'r':
-						l.append('where rack == "%s"' % target)
-					adhoc = True
+					if scope in self.hostScopes:
+						selectors.append((scope, target))
 					continue
 
 				if host.find('where') == 0:
-					l.append(host)
+					# An expression that doesn't compile is
+					# left as a string, EvalCondExpr treats
+					# it as False for every host.
+					exp = host[5:]
+					try:
+						exp = CompileCondExpr(exp)
+					except SyntaxError:
+						pass
+					selectors.append(('where', exp))
 					adhoc = True
 					continue
 
-				l.append(host.lower())
-		names = l
+				selectors.append(('name', host.lower()))
 
 		# If we have any Ad-Hoc groupings we need to load the attributes
 		# for every host in the nodes tables.  Since this is a lot of
@@ -632,35 +652,42 @@ class HostArgumentProcessor:
 		# Also load the attributes if the managed_only argument is true
 		# since we need to looked the managed attribute.
 
-		hostAttrs  = {}
-		for host in hostList:
-			hostAttrs[host] = {}
+		hostAttrs = {}
+		hostEnvs  = {}
 		if adhoc or managed_only:
-			for row in self.call('list.host.attr', hostList):
-				h = row['host']
-				a = row['attr']
-				v = row['value']
-				hostAttrs[h][a] = v
+			from stack.commands.list.attr import AttrResolver
+
+			resolved = AttrResolver(self).resolve(hostList)
+			for host in hostList:
+				hostAttrs[host] = { a: v for (a, (v, t, s)) in resolved[host].items() }
+				if adhoc:
+					hostEnvs[host] = CreateCondEnv(hostAttrs[host])
+
+		def nodename(host):
+			if subnet:
+				return self.db.getHostname(host, subnet)
+			return host
 
 		# Finally iterate over all the host/groups
-		list	 = []
 		explicit = {}
-		for name in names:
+		lowered  = None
+		for (kind, name) in selectors:
+			# Scoped group (appliance, environment, os, box, group, rack)
+			if kind in self.hostScopes:
+				for host in flatten(self.db.select(self.hostScopes[kind], (name,))):
+					if host not in hostDict:
+						continue
+					hostDict[host] = nodename(host)
+					if host not in explicit:
+						explicit[host] = False
+
 			# Ad-hoc group
-			if name.find('where') == 0:
+			elif kind == 'where':
 				for host in hostList:
-					exp = name[5:]
-					try:
-						res = EvalCondExpr(exp, hostAttrs[host])
-					except SyntaxError:
-						raise CommandError(self, 'group syntax "%s"' % exp)
-					if res:
-						s = self.db.getHostname(host, subnet)
-						hostDict[host] = s
+					if EvalCondExpr(name, hostEnvs[host]):
+						hostDict[host] = nodename(host)
 						if host not in explicit:
 							explicit[host] = False
-					# Debug('group %s is %s for %s' %
-					# 	(exp, res, host))
 
 			# Glob regex hostname
 			#
@@ -668,9 +695,11 @@ class HostArgumentProcessor:
 			# people that use uppercase hostname (don't be that
 			# guy).
 			elif '*' in name or '?' in name or '[' in name:
-				for lower in fnmatch.filter([h.lower() for h in hostList], name):
-					host = self.db.getHostname(lower) # fix case
-					hostDict[host] = self.db.getHostname(host, subnet)
+				if lowered is None:
+					lowered = { h.lower(): h for h in hostList }
+				for lower in fnmatch.filter(lowered.keys(), name):
+					host = lowered[lower] # fix case
+					hostDict[host] = nodename(host)
 					if host not in explicit:
 						explicit[host] = False
 
@@ -1069,6 +1098,99 @@ class DocStringHandler(handler.ContentHandler,
 		self.text += s
 
 
+class QueryCache:
+	"""
+	LRU cache of select results for a single database.
+
+	Importing the stack.commands.set and stack.commands.list packages
+	rebinds the set and list names of this module, so the builtins are
+	always called through builtins.
+
+	Every entry is tagged with the tables the select reads, so a write
+	only throws away the entries for the tables it touches. Entries
+	tagged with '*' (the tables could not be determined) are thrown away
+	on any write.
+	"""
+
+	def __init__(self, size):
+		self.size    = size
+		self.lock    = threading.Lock()
+		self.entries = OrderedDict() # key -> (value, tables)
+		self.readers = {}	     # table -> set of keys
+		self.stats   = {
+			'hits'	       : 0,
+			'misses'       : 0,
+			'evictions'    : 0,
+			'invalidations': 0,
+		}
+
+	def __len__(self):
+		return len(self.entries)
+
+	def _remove(self, key):
+		value, tables = self.entries.pop(key)
+		for table in tables:
+			keys = self.readers.get(table)
+			if keys:
+				keys.discard(key)
+				if not keys:
+					del self.readers[table]
+
+	def get(self, key):
+		"""
+		Returns the cached value for KEY, or None on a miss.
+		"""
+
+		with self.lock:
+			entry = self.entries.get(key)
+			if entry is None:
+				self.stats['misses'] += 1
+				return None
+
+			self.entries.move_to_end(key)
+			self.stats['hits'] += 1
+			return entry[0]
+
+	def put(self, key, value, tables):
+		with self.lock:
+			if key in self.entries:
+				self._remove(key)
+
+			if not tables:
+				tables = {'*'}
+
+			self.entries[key] = (value, tables)
+			for table in tables:
+				self.readers.setdefault(table, builtins.set()).add(key)
+
+			while len(self.entries) > self.size:
+				self._remove(next(iter(self.entries)))
+				self.stats['evictions'] += 1
+
+	def invalidate(self, tables):
+		"""
+		Drops every entry that reads any of the TABLES. Returns the
+		number of entries dropped.
+		"""
+
+		with self.lock:
+			keys = builtins.set()
+			for table in builtins.set(tables) | {'*'}:
+				keys.update(self.readers.get(table, ()))
+
+			for key in keys:
+				self._remove(key)
+
+			self.stats['invalidations'] += len(keys)
+			return len(keys)
+
+	def clear(self):
+		with self.lock:
+			self.stats['invalidations'] += len(self.entries)
+			self.entries.clear()
+			self.readers.clear()
+
+
 class DatabaseConnection:
 	"""
 	Wrapper class for all database access.  The methods are based on
@@ -1077,7 +1199,39 @@ class DatabaseConnection:
 	this object (self.db).
 	"""
 
-	cache = {}
+	cache  = {} # database name -> QueryCache
+	tables = {} # database name -> set of table names
+
+	# Maximum number of cached selects per database, the environment
+	# variable STACKCACHESIZE can be used to override this.
+	cacheSize = 2048
+
+	# Tables the host index (see getHostIndex) is built from
+	hostTables = { 'nodes', 'boxes', 'oses', 'appliances', 'environments' }
+
+	# Table -> tables with rows that reference it (see database-schema.xml),
+	# deleting from a table can cascade to the tables that reference it.
+	references = {
+		'appliances'	: { 'nodes', 'scope_map' },
+		'bootactions'	: { 'nodes' },
+		'bootnames'	: { 'bootactions' },
+		'boxes'		: { 'cart_stacks', 'nodes', 'stacks' },
+		'carts'		: { 'cart_stacks' },
+		'environments'	: { 'nodes', 'scope_map' },
+		'ib_partitions'	: { 'ib_memberships' },
+		'networks'	: { 'aliases', 'ib_memberships', 'switchports' },
+		'nodes'		: { 'boot', 'ib_memberships', 'ib_partitions',
+				    'networks', 'partitions', 'public_keys',
+				    'scope_map', 'switchmacs', 'switchports' },
+		'oses'		: { 'bootactions', 'boxes', 'scope_map' },
+		'rolls'		: { 'stacks' },
+		'scope_map'	: { 'firewall_rules', 'routes', 'storage_controller' },
+		'subnets'	: { 'firewall_rules', 'networks', 'routes' },
+	}
+
+	Host = namedtuple('Host', [
+		'id', 'name', 'os', 'appliance', 'environment', 'box', 'rack', 'rank'
+	])
 
 	def __init__(self, db, *, caching=True):
 		# self.database : object returned from orginal connect call
@@ -1102,8 +1256,18 @@ class DatabaseConnection:
 		# that may change (thought about it for the shadow database)
 		# hence the code.
 
+		#
+		# Cached selects are tagged with the tables they read and
+		# writes only invalidate the selects for the tables they
+		# touch (see invalidate).
+
 		if self.name not in DatabaseConnection.cache:
-			DatabaseConnection.cache[self.name] = {}
+			size = os.environ.get('STACKCACHESIZE')
+			if size:
+				size = int(size)
+			else:
+				size = DatabaseConnection.cacheSize
+			DatabaseConnection.cache[self.name] = QueryCache(size)
 
 		if os.environ.get('STACKCACHE'):
 			self.caching = str2bool(os.environ.get('STACKCACHE'))
@@ -1119,7 +1283,95 @@ class DatabaseConnection:
 
 	def clearCache(self):
 		Debug('clearing cache of %d selects' % len(DatabaseConnection.cache[self.name]))
-		DatabaseConnection.cache[self.name] = {}
+		DatabaseConnection.cache[self.name].clear()
+
+	def cacheStats(self):
+		"""
+		Returns a dictionary of the hits, misses, evictions, and
+		invalidations of the select cache along with its current
+		and maximum size.
+		"""
+
+		cache = DatabaseConnection.cache[self.name]
+
+		stats = dict(cache.stats)
+		stats['size']	 = len(cache)
+		stats['maxsize'] = cache.size
+		return stats
+
+	def getTableNames(self):
+		"""
+		Returns the set of table names in the database.
+		"""
+
+		if self.name not in DatabaseConnection.tables:
+			names = builtins.set()
+			if self.link:
+				try:
+					self.link.execute('show tables')
+					names = builtins.set(flatten(self.link.fetchall()))
+				except (OperationalError, ProgrammingError):
+					pass
+
+			DatabaseConnection.tables[self.name] = names
+
+		return DatabaseConnection.tables[self.name]
+
+	def getTables(self, command):
+		"""
+		Returns the set of tables referenced in the SQL command. This
+		errs on the side of too many tables (any word that is also a
+		table name counts).
+		"""
+
+		words = builtins.set(re.findall(r'[A-Za-z_][A-Za-z0-9_$]*', command))
+		return words & self.getTableNames()
+
+	def getReferences(self, tables):
+		"""
+		Returns TABLES along with every table that references any of
+		them, directly or through another table.
+		"""
+
+		result = builtins.set(tables)
+		pending = builtins.list(tables)
+		while pending:
+			for table in DatabaseConnection.references.get(pending.pop(), ()):
+				if table not in result:
+					result.add(table)
+					pending.append(table)
+
+		return result
+
+	def invalidate(self, command):
+		"""
+		Drops the cached selects that read any table written by the
+		SQL command. Deletes (and replaces, which delete the old row)
+		also drop the selects of the tables the delete can cascade to.
+		Anything other than a plain insert, update, replace, or delete
+		(DDL, locks, ...) clears the entire cache. Read only statements
+		leave the cache alone.
+		"""
+
+		tokens = command.split(None, 1)
+		if tokens and tokens[0].lower() in [ 'checksum', 'show', 'describe', 'explain' ]:
+			return
+		if tokens and tokens[0].lower() in [ 'insert', 'update', 'replace', 'delete' ]:
+			tables = self.getTables(command)
+			if tables and tokens[0].lower() in [ 'replace', 'delete' ]:
+				tables = self.getReferences(tables)
+		else:
+			tables = None
+
+			# DDL can add or drop tables
+			DatabaseConnection.tables.pop(self.name, None)
+
+		if not tables:
+			self.clearCache()
+			return
+
+		n = DatabaseConnection.cache[self.name].invalidate(tables)
+		Debug('invalidated %d selects of %s' % (n, ' '.join(sorted(tables))))
 
 	def count(self, command, args=None ):
 		"""
@@ -1154,9 +1406,11 @@ class DatabaseConnection:
 			m.update(' '.join(str(arg) for arg in args).encode('utf-8'))
 		k = m.hexdigest()
 
-		if k in DatabaseConnection.cache[self.name]:
+		cache = DatabaseConnection.cache[self.name]
+		rows  = cache.get(k)
+
+		if rows is not None:
 			Debug('select %s' % k)
-			rows = DatabaseConnection.cache[self.name][k]
 		else:
 			try:
 				self.execute('select %s' % command, args)
@@ -1168,7 +1422,7 @@ class DatabaseConnection:
 				rows = []
 
 			if self.caching:
-				DatabaseConnection.cache[self.name][k] = rows
+				cache.put(k, rows, self.getTables(command))
 		return rows
 
 	def execute(self, command, args=None, many=False):
@@ -1179,7 +1433,7 @@ class DatabaseConnection:
 		command = command.strip()
 
 		if not command.lower().startswith('select'):
-			self.clearCache()
+			self.invalidate(command)
 
 		if self.link:
 			# pick the executor to use
@@ -1228,17 +1482,61 @@ class DatabaseConnection:
 			return rows
 		return None
 
+	def getHostIndex(self):
+		"""
+		Returns a tuple of two dictionaries built from a single query
+		of the nodes table. The first maps each host name to a Host
+		namedtuple (id, name, os, appliance, environment, box, rack,
+		rank), the second maps the lowercase host name to the host
+		name.
+
+		The index lives in the select cache so it is shared by all
+		connections to the database and is rebuilt after the next
+		write to any of the tables it is built from.
+		"""
+
+		cache = DatabaseConnection.cache[self.name]
+
+		index = cache.get('hostindex')
+		if index is not None:
+			return index
+
+		hosts = {}
+		names = {}
+		for row in self.select("""
+			n.id, n.name, o.name, a.name, e.name, b.name, n.rack, n.rank
+			from nodes n
+			left join boxes b on n.box=b.id
+			left join oses o on b.os=o.id
+			left join appliances a on n.appliance=a.id
+			left join environments e on n.environment=e.id
+		"""):
+			host = DatabaseConnection.Host(*row)
+			hosts[host.name] = host
+			names[host.name.lower()] = host.name
+
+		index = (hosts, names)
+		if self.caching:
+			cache.put('hostindex', index, DatabaseConnection.hostTables)
+
+		return index
+
+	def getHost(self, host):
+		"""
+		Returns the Host namedtuple for the given host, or None.
+		"""
+
+		hosts, names = self.getHostIndex()
+		return hosts.get(host)
+
 	def getHostOS(self, host):
 		"""
 		Return the OS name for the given host.
 		"""
 
-		for (name, osname) in self.select("""
-			n.name, o.name from boxes b, nodes n, oses o
-			where n.box=b.id and b.os=o.id
-		"""):
-			if name == host:
-				return osname
+		h = self.getHost(host)
+		if h:
+			return h.os
 		return None
 
 	def getHostAppliance(self, host):
@@ -1246,12 +1544,9 @@ class DatabaseConnection:
 		Returns the appliance for a given host.
 		"""
 
-		for (name, appliance) in self.select("""
-			n.name, a.name from nodes n, appliances a
-			where n.appliance=a.id
-		"""):
-			if name == host:
-				return appliance
+		h = self.getHost(host)
+		if h:
+			return h.appliance
 		return None
 
 	def getHostEnvironment(self, host):
@@ -1259,19 +1554,24 @@ class DatabaseConnection:
 		Returns the environment for a given host.
 		"""
 
-		for (name, environment) in self.select("""
-			n.name, e.name from nodes n, environments e
-			where n.environment=e.id
-		"""):
-			if name == host:
-				return environment
+		h = self.getHost(host)
+		if h:
+			return h.environment
 		return None
 
 	def getNodeName(self, hostname, subnet=None):
 		if not subnet:
-			rows = self.select('name from nodes where name like %s', (hostname,))
-			if rows:
-				(hostname, ) = rows[0]
+			# The index only has exact (case insensitive) names,
+			# that is the same as a 'like' match for anything but
+			# an SQL pattern. Patterns still go to the database.
+			hosts, names = self.getHostIndex()
+			if hostname and hostname.lower() in names:
+				return names[hostname.lower()]
+
+			if hostname and ('%' in hostname or '_' in hostname):
+				rows = self.select('name from nodes where name like %s', (hostname,))
+				if rows:
+					(hostname, ) = rows[0]
 			return hostname
 
 		result = None
@@ -1313,6 +1613,10 @@ class DatabaseConnection:
 		# table. This should speed up the installer w/ the restore pallet.
 
 		if hostname and self.link:
+			hosts, names = self.getHostIndex()
+			if hostname.lower() in names:
+				return self.getNodeName(names[hostname.lower()], subnet)
+
 			rows = self.link.execute(
 				'select * from nodes where name like %s', (hostname,)
 			)
@@ -1517,6 +1821,16 @@ class Command:
 
 		self.output = []
 
+		# When called through call() the output stays as a list of
+		# dictionary rows instead of being formatted as text.
+		self._native = False
+		self._rows   = None
+
+		# Commands that can write their output as it is produced
+		# (e.g. dump) write it to this file instead of the output text
+		# buffer, when it is set.  Only the stack script sets it.
+		self.stream = None
+
 		self.arch = os.uname()[4]
 		if self.arch in ['i386', 'i486', 'i586', 'i686']:
 			self.arch = 'i386'
@@ -1634,24 +1948,56 @@ class Command:
 
 	def call(self, command, args=[]):
 		"""
-		Similar to the command method but uses the output-format=binary
-		to run a command and return a list of dictionary rows.
+		Similar to the command method but returns a list of dictionary
+		rows. The rows are handed back in-process from the output buffer
+		of the called command, no text formatting or serialization is
+		done.
 		"""
-		# Do a copy of the args list
-		a = args[:]
-		a.append('output-format=binary')
-		s = self.command(command, a)
-		if s:
-			return marshal.loads(s)
+
+		o = self.loadCommand(command)
+		if not o:
+			return []
+
+		o._native = True
+		self.runCommand(o, command, args[:])
+
+		if o._rows:
+			return o._rows
 
 		return []
 
 	def notify(self, message):
 		print(f'{_logPrefix}{message}', file = sys.stderr, flush = True)
 
-	def command(self, command, args=[]):
+	def command(self, command, args=[], passthrough=False):
 		"""
 		Import and run a Stack command. Returns and output string.
+
+		Set PASSTHROUGH when the output is handed back as our own
+		(e.g. list host attr -> list attr).  When we were run by
+		call() the command then hands back rows that become our rows,
+		any other command always runs as text so it can be parsed.
+		"""
+
+		o = self.loadCommand(command)
+		if not o:
+			return ''
+
+		o._native = passthrough and self._native
+		self.runCommand(o, command, args)
+
+		if o._native and o._rows is not None:
+			if self._rows is None:
+				self._rows = []
+			self._rows.extend(o._rows)
+
+		return o.getText()
+
+	def loadCommand(self, command):
+		"""
+		Import a Stack command and return a Command object for it
+		that shares our database connection. Returns None if the
+		module does not define a Command.
 		"""
 
 		modpath = 'stack.commands.%s' % command
@@ -1659,14 +2005,21 @@ class Command:
 		mod = eval(modpath)
 
 		try:
-			o = getattr(mod, 'Command')(self.db.database)
-			name = ' '.join(command.split('.'))
+			return getattr(mod, 'Command')(self.db.database)
 		except AttributeError:
-			return ''
+			return None
+
+	def runCommand(self, o, command, args):
+		"""
+		Run a Command object loaded with loadCommand() as a sub-command
+		of this one.
+		"""
+
+		name = ' '.join(command.split('.'))
 
 		# Call the command and store the return code in the
 		# class member self.rc so the caller can check
-		# the return code.  The actual text is what we return.
+		# the return code.
 
 		try:
 			self.rc = o.runWrapper(name, args, self.level + 1)
@@ -1676,8 +2029,6 @@ class Command:
 			e.cmd = self
 			raise e
 
-		return o.getText()
-
 	def loadPlugins(self):
 		dict	= {}
 		graph	= stack.graph.Graph()
@@ -2018,6 +2369,9 @@ class Command:
 		# python	- text python
 		# binary	- marshalled python
 		# text		- default (for humans)
+		#
+		# Commands run by call() keep their rows as python
+		# dictionaries instead, this is not a user format.
 
 		format = self._params.get('output-format')
 		if not format:
@@ -2031,7 +2385,7 @@ class Command:
 			format	    = tokens[0]
 			format_args = tokens[1].lower()
 
-		if format in ['col', 'shell', 'json', 'python', 'binary']:
+		if self._native or format in ['col', 'shell', 'json', 'python', 'binary']:
 			if not header: # need to build a generic header
 				if len(self.output) > 0:
 					rows = len(self.output[0])
@@ -2058,7 +2412,11 @@ class Command:
 							dict[key] = val
 				list.append(dict)
 
-			if format == 'col':
+			if self._native:
+				if self._rows is None:
+					self._rows = []
+				self._rows.extend(list)
+			elif format == 'col':
 				for row in list:
 					try:
 						self.addText('%s\n' % row[format_args])
@@ -2388,6 +2746,11 @@ class Command:
 
 				rc = self.run(self._params, self._args)
 
+				if self.level == 0:
+					Debug('select cache %s' % ' '.join(
+						'%s=%d' % item for item in sorted(self.db.cacheStats().items())
+					))
+
 				# if a command does not explicitly return
 				# assume it succeeded, otherwise use the
 				# actual return code.
@@ -8,6 +8,7 @@ from collections import OrderedDict
 from stack.exception import ArgNotAllowed
 import stack.commands
 import json
+import types
 
 
 class command(stack.commands.Command):
@@ -44,15 +45,17 @@ class command(stack.commands.Command):
 		for row in self.call('list.attr', [f'scope={scope}',
 						   'resolve=false',
 						   'const=false'] + arg):
-			if row['type'] == 'var':
-				dump.append(OrderedDict(name  = row['attr'],
-							value = row['value']))
-			else:
-				dump.append(OrderedDict(name   = row['attr'],
-							value  = row['value'],
-							shadow = True))
+			dump.append(self._attr_row(row))
 		return dump
 
+	def _attr_row(self, row):
+		if row['type'] == 'var':
+			return OrderedDict(name  = row['attr'],
+					   value = row['value'])
+		return OrderedDict(name   = row['attr'],
+				   value  = row['value'],
+				   shadow = True)
+
 
 	def dump_firewall(self, name=None):
 		dump  = []
@@ -76,19 +79,22 @@ class command(stack.commands.Command):
 		for row in self.call('list.firewall', [f'scope={scope}'] + arg):
 			if row['type'] != 'var' or row['source'] != source:
 				continue
-			dump.append(OrderedDict(
-				service        = row['service'],
-				network        = row['network'],
-				output_network = row['output-network'],
-				chain          = row['chain'],
-				action         = row['action'],
-				protocol       = row['protocol'],
-				flags          = row['flags'],
-				comment        = row['comment'],
-				table          = row['table'],
-				name           = row['name']))
+			dump.append(self._firewall_row(row))
 		return dump
 
+	def _firewall_row(self, row):
+		return OrderedDict(
+			service        = row['service'],
+			network        = row['network'],
+			output_network = row['output-network'],
+			chain          = row['chain'],
+			action         = row['action'],
+			protocol       = row['protocol'],
+			flags          = row['flags'],
+			comment        = row['comment'],
+			table          = row['table'],
+			name           = row['name'])
+
 	def dump_route(self, name=None):
 		dump  = []
 		scope = self.get_scope()
@@ -106,14 +112,17 @@ class command(stack.commands.Command):
 		for row in data:
 			if not check_source(row):
 				continue
-			dump.append(OrderedDict(
-				address   = row['network'],
-				gateway   = row['gateway'],
-				subnet    = row['subnet'],
-				netmask   = row['netmask'],
-				interface = row['interface']))
+			dump.append(self._route_row(row))
 		return dump
 
+	def _route_row(self, row):
+		return OrderedDict(
+			address   = row['network'],
+			gateway   = row['gateway'],
+			subnet    = row['subnet'],
+			netmask   = row['netmask'],
+			interface = row['interface'])
+
 
 	def dump_controller(self, name=None):
 		dump  = []
@@ -125,15 +134,18 @@ class command(stack.commands.Command):
 			data = self.call(f'list.{scope}.storage.controller', [name])
 
 		for row in data:
-			dump.append(OrderedDict(
-				enclosure = row['enclosure'],
-				adapter   = row['adapter'],
-				slot      = row['slot'],
-				raidlevel = row['raidlevel'],
-				arrayid   = row['arrayid'],
-				options   = row['options']))
+			dump.append(self._controller_row(row))
 		return dump
 
+	def _controller_row(self, row):
+		return OrderedDict(
+			enclosure = row['enclosure'],
+			adapter   = row['adapter'],
+			slot      = row['slot'],
+			raidlevel = row['raidlevel'],
+			arrayid   = row['arrayid'],
+			options   = row['options'])
+
 
 	def dump_partition(self, name=None):
 		dump  = []
@@ -145,17 +157,185 @@ class command(stack.commands.Command):
 			data = self.call('list.storage.partition', [name])
 
 		for row in data:
-			dump.append(OrderedDict(
-				device     = row['device'],
-				partid     = row['partid'],
-				mountpoint = row['mountpoint'],
-				size       = row['size'],
-				fstype     = row['fstype'],
-				options    = row['options']))
+			dump.append(self._partition_row(row))
 		return dump
 
+	def _partition_row(self, row):
+		return OrderedDict(
+			device     = row['device'],
+			partid     = row['partid'],
+			mountpoint = row['mountpoint'],
+			size       = row['size'],
+			fstype     = row['fstype'],
+			options    = row['options'])
+
+
+	# The dump_*s() methods below return {name: dump_*(name)} for all
+	# the NAMES in the current scope, fetching the section for every
+	# name at once rather than running a list command per name.
 
+	def dump_attrs(self, names):
+		scope = self.get_scope()
+		dump  = { name: [] for name in names }
+		if not names:
+			return dump
+
+		for row in self.call('list.attr', [f'scope={scope}',
+						   'resolve=false',
+						   'const=false'] + names):
+			if row[scope] in dump:
+				dump[row[scope]].append(self._attr_row(row))
+		return dump
 
+	def dump_firewalls(self, names):
+		scope  = self.get_scope()
+		source = scope[0].upper()
+		dump   = { name: [] for name in names }
+		if not names:
+			return dump
+
+		for row in self.call('list.firewall', [f'scope={scope}'] + names):
+			if row['type'] != 'var' or row['source'] != source:
+				continue
+			if row[scope] in dump:
+				dump[row[scope]].append(self._firewall_row(row))
+		return dump
+
+	def dump_routes(self, names):
+		scope = self.get_scope()
+		dump  = { name: [] for name in names }
+		if not names:
+			return dump
+
+		for row in self.call(f'list.{scope}.route', names):
+			if scope == 'host' and row['source'] != 'H':
+				continue
+			if row[scope] in dump:
+				dump[row[scope]].append(self._route_row(row))
+		return dump
+
+	def dump_controllers(self, names):
+		scope = self.get_scope()
+		dump  = { name: [] for name in names }
+		if not names:
+			return dump
+
+		for row in self.call(f'list.{scope}.storage.controller', names):
+			if row[scope] in dump:
+				dump[row[scope]].append(self._controller_row(row))
+		return dump
+
+	def dump_partitions(self, names):
+		scope = self.get_scope()
+		if scope != 'host':
+			return { name: self.dump_partition(name) for name in names }
+
+		# Same rows and clean up as list storage partition gives for
+		# a single host.
+
+		dump = { name: [] for name in names }
+		for (name, device, mountpoint, size, fstype, options, partid) in self.db.select("""
+			n.name, p.device, p.mountpoint, p.size, p.fstype, p.options, p.partid
+			from storage_partition p, nodes n
+			where p.scope='host' and p.tableid=n.id
+			order by n.name, p.device, p.partid, p.fstype, p.size
+			"""):
+			if name not in dump:
+				continue
+			if size == -1:
+				size = 'recommended'
+			elif size == -2:
+				size = 'hibernation'
+			if mountpoint == 'None':
+				mountpoint = None
+			if fstype == 'None':
+				fstype = None
+			if partid == 0:
+				partid = None
+			dump[name].append(self._partition_row({
+				'device'    : device,
+				'partid'    : partid,
+				'mountpoint': mountpoint,
+				'size'      : size,
+				'fstype'    : fstype,
+				'options'   : options }))
+		return dump
+
+
+	# A dump document is a JSON object of (key, value) sections.  A
+	# generator value is written as a list one item at a time, so a
+	# section the size of the cluster is never held encoded (or built)
+	# all at once.  The text is the same json.dumps(document, indent=8)
+	# gives.
+
+	encoder   = json.JSONEncoder(indent=8)
+	_sections = None
+
+	def command_sections(self, command, args=[]):
+		"""
+		Runs the dump COMMAND and returns the (key, value) sections of
+		its document.  Generator values are handed back as they are,
+		they are only read when the document is written.
+		"""
+
+		o = self.loadCommand(command)
+		if not o:
+			return []
+
+		o._sections = []
+		self.runCommand(o, command, args)
+
+		# A command that doesn't use add_document() returns text
+		text = o.getText()
+		if text:
+			return json.loads(text, object_pairs_hook=OrderedDict).items()
+		return o._sections
+
+	def add_document(self, sections):
+		"""
+		Adds the document of the (key, value) SECTIONS as the output
+		of the command.  When the output is streamed (see
+		stack.commands.Command.stream) the document is written out as
+		it is encoded.
+		"""
+
+		if self._sections is not None:
+			self._sections.extend(sections)
+			return
+
+		document = OrderedDict()
+		for (key, value) in sections:
+			if isinstance(value, types.GeneratorType):
+				value = _Items(value)
+			document[key] = value
+
+		chunks = self.encoder.iterencode(document)
+		if self.stream:
+			for chunk in chunks:
+				self.stream.write(chunk)
+			self.stream.write('\n')
+		else:
+			self.addText(''.join(chunks))
+
+
+class _Items(list):
+	"""
+	Stands in for a list whose items come from a generator, the JSON
+	encoder asks for them one at a time.  The first item is read ahead
+	to know if the list is empty.
+	"""
+
+	def __init__(self, items):
+		self.items = iter(items)
+		self.first = next(self.items, _Items)
+
+	def __bool__(self):
+		return self.first is not _Items
+
+	def __iter__(self):
+		if self:
+			yield self.first
+			yield from self.items
 
 
 class Command(command):
@@ -167,8 +347,6 @@ class Command(command):
 		if len(args):
 			raise ArgNotAllowed(self, args[0])
 
-		dump = {}
-		
 		self.set_scope('global')
 
 		dump = OrderedDict(version    = stack.version,
@@ -179,8 +357,13 @@ class Command(command):
 				   firewall   = self.dump_firewall(),
 				   route      = self.dump_route())
 
+		# The plugins hand back the sections of their documents (or
+		# the text of any JSON document).  A key repeated by a later
+		# plugin replaces the earlier value but keeps its place.
 
 		for (_, doc) in self.runPlugins():
-			dump.update(json.loads(doc))
-		
-		self.addText(json.dumps(dump, indent=8))
+			if isinstance(doc, str):
+				doc = json.loads(doc, object_pairs_hook=OrderedDict).items()
+			dump.update(doc)
+
+		self.add_document(dump.items())
@@ -8,7 +8,6 @@ import stack
 import stack.commands
 from collections import defaultdict
 from collections import OrderedDict
-import json
 
 
 class Command(stack.commands.dump.command):
@@ -43,30 +42,45 @@ class Command(stack.commands.dump.command):
 
 		self.set_scope('host')
 
-		dump = []
-		for row in self.call('list.host', args):
-			name = row['host']
+		hosts = self.call('list.host', args)
+		names = [ row['host'] for row in hosts ]
 
-			dump.append(OrderedDict(
-				name          = name,
-				rack          = row['rack'],
-				rank          = row['rank'],
-				appliance     = row['appliance'],
-				box           = row['box'],
-				environment   = row['environment'],
-				osaction      = row['osaction'],
-				installaction = row['installaction'],
-				comment       = row['comment'],
-				metadata      = self.getHostAttr(name, 
-								 'metadata'),
-				group         = groups[name],
-				interface     = interfaces[name],
-				attr          = self.dump_attr(name),
-				controller    = self.dump_controller(name),
-				partition     = self.dump_partition(name),
-				firewall      = self.dump_firewall(name),
-				route         = self.dump_route(name)))
+		# Every section is fetched once for all the hosts
 
-		self.addText(json.dumps(OrderedDict(version = stack.version,
-						    host    = dump), indent=8))
+		metadata = {}
+		if names:
+			for row in self.call('list.host.attr', names + [ 'attr=metadata' ]):
+				metadata[row['host']] = row['value']
 
+		attrs	    = self.dump_attrs(names)
+		controllers = self.dump_controllers(names)
+		partitions  = self.dump_partitions(names)
+		firewalls   = self.dump_firewalls(names)
+		routes	    = self.dump_routes(names)
+
+		def dump():
+			for row in hosts:
+				name = row['host']
+
+				yield OrderedDict(
+					name          = name,
+					rack          = row['rack'],
+					rank          = row['rank'],
+					appliance     = row['appliance'],
+					box           = row['box'],
+					environment   = row['environment'],
+					osaction      = row['osaction'],
+					installaction = row['installaction'],
+					comment       = row['comment'],
+					metadata      = metadata.get(name),
+					group         = groups[name],
+					interface     = interfaces[name],
+					attr          = attrs[name],
+					controller    = controllers[name],
+					partition     = partitions[name],
+					firewall      = firewalls[name],
+					route         = routes[name])
+
+		# Each host is encoded as it is built
+		self.add_document([ ('version', stack.version),
+				    ('host',    dump()) ])
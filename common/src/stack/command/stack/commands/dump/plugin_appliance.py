@@ -12,4 +12,4 @@ class Plugin(stack.commands.Plugin):
 		return 'appliance'
 
 	def run(self, args):
-		return self.owner.command('dump.appliance')
+		return self.owner.command_sections('dump.appliance')
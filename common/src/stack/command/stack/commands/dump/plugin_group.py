@@ -13,4 +13,4 @@ class Plugin(stack.commands.Plugin):
 
 
 	def run(self, args):
-		return self.owner.command('dump.group')
+		return self.owner.command_sections('dump.group')
@@ -12,4 +12,4 @@ class Plugin(stack.commands.Plugin):
 		return 'os'
 
 	def run(self, args):
-		return self.owner.command('dump.os')
+		return self.owner.command_sections('dump.os')
@@ -17,32 +17,41 @@ import os
 import stack.attr
 import stack.commands
 from stack.bool import str2bool
+from stack.util import flatten
 from stack.exception import CommandError
 
 
-class Command(stack.commands.Command,
-	      stack.commands.OSArgumentProcessor,
-	      stack.commands.ApplianceArgumentProcessor,
-	      stack.commands.EnvironmentArgumentProcessor,
-	      stack.commands.HostArgumentProcessor):
+class AttrResolver:
 	"""
-	Lists the set of global attributes.
+	Loads the attributes of every scope and resolves host attributes
+	through the global -> os -> appliance -> environment -> host
+	layering.
 
-	<param type='string' name='attr'>
-	A shell syntax glob pattern to specify to attributes to
-	be listed.
-	</param>
-
-	<param type='boolean' name='shadow'>
-	Specifies is shadow attributes are listed, the default
-	is True.
-	</param>
+	Everything is done with a constant number of queries no matter
+	how many hosts are resolved, so commands that need attributes for
+	lots of hosts should use this rather than calling 'list host attr'
+	once per host. The owner is the Command the resolver works for.
 
-	<example cmd='list attr'>
-	List the global attributes.
-	</example>
+	Example:
+		attrs = AttrResolver(self).resolve(hosts, glob='os.*')
 	"""
 
+	tables = { 'global'	: None,
+		   'os'		: 'oses',
+		   'appliance'	: 'appliances',
+		   'environment': 'environments',
+		   'host'	: 'nodes' }
+
+	def __init__(self, owner, *, shadow=True, var=True, const=True):
+		self.owner	= owner
+		self.db		= owner.db
+		self.shadow	= shadow
+		self.var	= var
+		self.const	= const
+
+		self.attributes	= None
+		self.hosts	= None
+
 	def addGlobalAttrs(self, attributes):
 		readonly = {}
 
@@ -107,7 +116,7 @@ class Command(stack.commands.Command,
 		readonly = {}
 
 		versions = {}
-		for row in self.call('list.pallet'):
+		for row in self.owner.call('list.pallet'):
 			# Compute a version number for each os pallet
 			#
 			# If the pallet already has a '.' take everything
@@ -122,7 +131,7 @@ class Command(stack.commands.Command,
 				versions[key] = (name, '%s.x' % version.split('.')[0])
 
 		boxes = {}
-		for row in self.call('list.box'):
+		for row in self.owner.call('list.box'):
 			pallets = row['pallets'].split()
 			carts   = row['carts'].split()
 			
@@ -178,11 +187,12 @@ class Command(stack.commands.Command,
 				readonly[name]['hostaddr']   = address
 			readonly[name]['domainname'] = zone
 
+		scopes = self.getHostScopes()
 		for host in readonly:
-			readonly[host]['os']	   = self.db.getHostOS(host)
+			readonly[host]['os']	   = scopes[host][0]
 			readonly[host]['hostname'] = host
 
-		for row in self.call('list.host.group'):
+		for row in self.owner.call('list.host.group'):
 			for group in row['groups'].split():
 				readonly[row['host']]['group.%s' % group] = 'true'
 			readonly[row['host']]['groups'] = row['groups']
@@ -212,52 +222,28 @@ class Command(stack.commands.Command,
 
 		return attributes
 
+	def getHostScopes(self):
+		"""
+		Returns a dictionary of host -> (os, appliance, environment)
+		"""
 
+		if self.hosts is None:
+			hosts, names = self.db.getHostIndex()
 
+			self.hosts = {}
+			for host in hosts.values():
+				self.hosts[host.name] = (host.os, host.appliance, host.environment)
 
-	def run(self, params, args):
+		return self.hosts
 
-		(glob, shadow, scope, resolve, var, const, display) = self.fillParams([ 
-			('attr',   None),
-			('shadow', True),
-			('scope',  'global'),
-			('resolve', None),
-			('var', True),
-			('const', True),
-			('display', 'all'),
-		])
+	def load(self):
+		"""
+		Returns the unresolved attributes of every scope as a
+		dictionary of {scope: {target: {attr: (value, type, scope)}}}
+		"""
 
-		shadow	= self.str2bool(shadow)
-		var	= self.str2bool(var)
-		const	= self.str2bool(const)
-		lookup	= { 'global'	 : { 'fn'     : lambda x=None: [ 'global' ],
-					     'const'  : self.addGlobalAttrs,
-					     'resolve': False,
-					     'table'  : None },
-			    'os'	 : { 'fn'     : self.getOSNames,
-					     'const'  : lambda x: x,
-					     'resolve': False,
-					     'table'  : 'oses' },
-			    'appliance'	 : { 'fn'     : self.getApplianceNames, 
-					     'const'  : lambda x: x,
-					     'resolve': False,
-					     'table'  : 'appliances' },
-			    'environment': { 'fn'     : self.getEnvironmentNames,
-					     'const'  : lambda x: x,
-					     'resolve': False,
-					     'table'  : 'environments' },
-			    'host'	 : { 'fn'     : self.getHostnames,
-					     'const'  : self.addHostAttrs,
-					     'resolve': True,
-					     'table'  : 'nodes' }}
-
-		if scope not in lookup.keys():
-			raise CommandError(self, 'invalid scope "%s"' % scope)
-
-		if resolve is None:
-			resolve = lookup[scope]['resolve']
-		else:
-			resolve = self.str2bool(resolve)
+		if self.attributes is not None:
+			return self.attributes
 
 		# Connect to a copy of the database if we are running pytest-xdist
 		if 'PYTEST_XDIST_WORKER' in os.environ:
@@ -266,9 +252,13 @@ class Command(stack.commands.Command,
 			db_name = 'shadow'
 
 		attributes = {}
-		for s in lookup.keys():
+		for s, table in self.tables.items():
 			attributes[s] = {}
-			for target in lookup[s]['fn']():
+			if table:
+				for target in flatten(self.db.select('name from %s' % table)):
+					attributes[s][target] = {}
+			else:
+				target = 'global'
 				attributes[s][target] = {}
 
 			# Do a UNION select for the attributes in the cluster
@@ -278,8 +268,7 @@ class Command(stack.commands.Command,
 			# database, we fallback to just selecting out of the
 			# cluster database.
 
-			if var:
-				table = lookup[s]['table']
+			if self.var:
 				if table:
 					rows = self.db.select(
 						"""
@@ -302,7 +291,7 @@ class Command(stack.commands.Command,
 					for (o, x, a, v) in rows:
 						if not x:
 							attributes[s][o][a] = (v, 'var', s)
-					if shadow:
+					if self.shadow:
 						for (o, x, a, v) in rows:
 							if x:
 								attributes[s][o][a] = (v, 'shadow', s)
@@ -327,43 +316,133 @@ class Command(stack.commands.Command,
 					for (x, a, v) in rows:
 						if not x:
 							attributes[s][o][a] = (v, 'var', s)
-					if shadow:
+					if self.shadow:
 						for (x, a, v) in rows:
 							if x:
 								attributes[s][o][a] = (v, 'shadow', s)
 
-			if const:
+			if self.const:
 				# Mix in any const attributes
-				lookup[s]['const'](attributes[s])
+				if s == 'global':
+					self.addGlobalAttrs(attributes[s])
+				elif s == 'host':
+					self.addHostAttrs(attributes[s])
+
+		self.attributes = attributes
+		return self.attributes
+
+	def resolve(self, hosts, glob=None):
+		"""
+		Returns a dictionary of {host: {attr: (value, type, scope)}}
+		for the HOSTS with each attribute resolved through all the
+		scopes. If GLOB is set only the matching attributes are
+		returned.
+
+		The os/appliance/environment layers are merged once for
+		each distinct combination, so every host only costs a
+		single dictionary copy and update.
+		"""
+
+		attributes = self.load()
+		scopes	   = self.getHostScopes()
+
+		parents	 = {}
+		resolved = {}
+		for host in hosts:
+			key = scopes.get(host, (None, None, None))
+			if key not in parents:
+				(osname, appliance, environment) = key
+
+				parent = {}
+				parent.update(attributes['global']['global'])
+				parent.update(attributes['os'].get(osname, {}))
+				parent.update(attributes['appliance'].get(appliance, {}))
+				parent.update(attributes['environment'].get(environment, {}))
+				parents[key] = parent
+
+			attrs = dict(parents[key])
+			attrs.update(attributes['host'].get(host, {}))
+
+			if glob:
+				attrs = { a: attrs[a] for a in fnmatch.filter(attrs.keys(), glob) }
+
+			resolved[host] = attrs
+
+		return resolved
+
+
+class Command(stack.commands.Command,
+	      stack.commands.OSArgumentProcessor,
+	      stack.commands.ApplianceArgumentProcessor,
+	      stack.commands.EnvironmentArgumentProcessor,
+	      stack.commands.HostArgumentProcessor):
+	"""
+	Lists the set of global attributes.
+
+	<param type='string' name='attr'>
+	A shell syntax glob pattern to specify to attributes to
+	be listed.
+	</param>
+
+	<param type='boolean' name='shadow'>
+	Specifies is shadow attributes are listed, the default
+	is True.
+	</param>
+
+	<example cmd='list attr'>
+	List the global attributes.
+	</example>
+	"""
+
+	def run(self, params, args):
+
+		(glob, shadow, scope, resolve, var, const, display) = self.fillParams([ 
+			('attr',   None),
+			('shadow', True),
+			('scope',  'global'),
+			('resolve', None),
+			('var', True),
+			('const', True),
+			('display', 'all'),
+		])
+
+		shadow	= self.str2bool(shadow)
+		var	= self.str2bool(var)
+		const	= self.str2bool(const)
+		lookup	= { 'global'	 : { 'fn'     : lambda x=None: [ 'global' ],
+					     'resolve': False },
+			    'os'	 : { 'fn'     : self.getOSNames,
+					     'resolve': False },
+			    'appliance'	 : { 'fn'     : self.getApplianceNames, 
+					     'resolve': False },
+			    'environment': { 'fn'     : self.getEnvironmentNames,
+					     'resolve': False },
+			    'host'	 : { 'fn'     : self.getHostnames,
+					     'resolve': True }}
+
+		if scope not in lookup.keys():
+			raise CommandError(self, 'invalid scope "%s"' % scope)
+
+		if resolve is None:
+			resolve = lookup[scope]['resolve']
+		else:
+			resolve = self.str2bool(resolve)
+
+		resolver   = AttrResolver(self, shadow=shadow, var=var, const=const)
+		attributes = resolver.load()
 
 		targets = sorted(lookup[scope]['fn'](args))
 
 		if resolve and scope == 'host':
-			for o in targets:
-				env = self.db.getHostEnvironment(o)
-				if env:
-					parent = attributes['environment'][env]
-					for (a, (v, t, s)) in parent.items():
-						if a not in attributes[scope][o]:
-							attributes[scope][o][a] = (v, t, s)
-
-				parent = attributes['appliance'][self.db.getHostAppliance(o)]
-				for (a, (v, t, s)) in parent.items():
-					if a not in attributes[scope][o]:
-						attributes[scope][o][a] = (v, t, s)
-
-				parent = attributes['os'][self.db.getHostOS(o)]
-				for (a, (v, t, s)) in parent.items():
-					if a not in attributes[scope][o]:
-						attributes[scope][o][a] = (v, t, s)
+			attributes[scope] = resolver.resolve(targets, glob)
 
-		if resolve and scope != 'global':
+		elif resolve and scope != 'global':
 			for o in targets:
 				for (a, (v, t, s)) in attributes['global']['global'].items():
 					if a not in attributes[scope][o]:
 						attributes[scope][o][a] = (v, t, s)
 
-		if glob:
+		if glob and not (resolve and scope == 'host'):
 			for o in targets:
 				matches = {}
 				for key in fnmatch.filter(attributes[scope][o].keys(), glob):
@@ -17,5 +17,5 @@ class Command(stack.commands.list.environment.command):
 	"""
 
 	def run(self, params, args):
-		self.addText(self.command('list.storage.controller', self._argv + ['scope=environment']))
+		self.addText(self.command('list.storage.controller', self._argv + ['scope=environment'], passthrough=True))
 		return self.rc
@@ -46,6 +46,6 @@ class Command(stack.commands.list.host.command):
 	"""
 
 	def run(self, params, args):
-		self.addText(self.command('list.attr', self._argv + [ 'scope=host' ]))
+		self.addText(self.command('list.attr', self._argv + [ 'scope=host' ], passthrough=True))
 		return self.rc
 
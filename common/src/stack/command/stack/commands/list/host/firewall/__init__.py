@@ -25,5 +25,5 @@ class Command(stack.commands.NetworkArgumentProcessor,
 	"""
 
 	def run(self, params, args):
-		self.addText(self.command('list.firewall', self._argv + ['scope=host']))
+		self.addText(self.command('list.firewall', self._argv + ['scope=host'], passthrough=True))
 		return self.rc
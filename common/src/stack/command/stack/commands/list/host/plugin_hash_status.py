@@ -30,13 +30,13 @@ class Plugin(stack.commands.Plugin):
 		for name, id in self.db.select('name, id from nodes'):
 			ids[name] = id
 
-		for host in hosts:
-			try:
-				r = redis.StrictRedis()
-				status = r.get('host:%d:installhash' % ids[host])
-			except:
-				status = None
+		try:
+			r = redis.StrictRedis()
+			installhash = r.mget([ 'host:%d:installhash' % ids[host] for host in hosts ])
+		except:
+			installhash = [ None ] * len(hosts)
 
+		for host, status in zip(hosts, installhash):
 			if status:
 				hashinfo = status.decode()
 				onhost = json.loads(hashinfo.replace("'", '"'))
@@ -37,15 +37,24 @@ class Command(command):
 		for (_, names) in self.runPlugins():
 			components.extend(names)
 
+		hosts = self.getHostnames(args)
+
+		# Every key for every host is read in a single round trip.
+
+		keys = []
+		for host in hosts:
+			for component in components:
+				keys.append('host:%d:status:%s' % (ids[host], component))
+		try:
+			values = r.mget(keys) if keys else []
+		except redis.exceptions.ConnectionError:
+			values = [ None ] * len(keys)
+
 		self.beginOutput()
 
-		for host in self.getHostnames(args):
+		for i, host in enumerate(hosts):
 			status = []
-			for component in components:
-				try:
-					v = r.get('host:%d:status:%s' % (ids[host], component))
-				except redis.exceptions.ConnectionError:
-					v = None
+			for v in values[i * len(components):(i + 1) * len(components)]:
 				if v is not None:
 					v = v.decode()
 				status.append(v)
@@ -27,5 +27,5 @@ class Command(stack.commands.list.os.command):
 	"""
 
 	def run(self, params, args):
-		self.addText(self.command('list.route', self._argv + ['scope=os']))
+		self.addText(self.command('list.route', self._argv + ['scope=os'], passthrough=True))
 		return self.rc
@@ -16,12 +16,20 @@ import logging
 import stack.commands
 from stack.bool import str2bool
 import re
+import time
 import shlex
 
 
-class command(stack.commands.Command):
+class command(stack.commands.Command,
+	      stack.commands.OSArgumentProcessor,
+	      stack.commands.ApplianceArgumentProcessor,
+	      stack.commands.EnvironmentArgumentProcessor,
+	      stack.commands.HostArgumentProcessor):
 	MustBeRoot = 0
 
+	plan	= None		# (section, cmd, args, params) when executing
+	section = 'global'
+
 	def _load(self, text):
 		parser = JsonComment(json) # standard JSON is stupid
 		try:
@@ -62,6 +70,17 @@ class command(stack.commands.Command):
 			params = {}
 		for key in [key for key in params if params[key] is None]:
 			del params[key]	  # nuke *=None params
+
+		if self.plan is not None:
+			argv = []
+			for arg in args:
+				if isinstance(arg, (list, tuple)):
+					argv.extend(arg)
+				elif arg is not None:
+					argv.append(arg)
+			self.plan.append((self.section, cmd, argv, params))
+			return
+
 		c = ' '.join(cmd.split('.'))
 		a = ''
 		if args:
@@ -70,6 +89,156 @@ class command(stack.commands.Command):
 		print(f'/opt/stack/bin/stack "{c}" {a} {p}')
 
 
+	# Attributes set with executemany rather than one set attr command
+	# each, the scope maps to the table the target names live in.
+
+	attrTables = { 'global'     : None,
+		       'os'         : 'oses',
+		       'appliance'  : 'appliances',
+		       'environment': 'environments',
+		       'host'       : 'nodes' }
+
+	def getAttrTargets(self, scope, args):
+		"""
+		Returns the names the set attr ARGS select for SCOPE, the
+		same way set attr looks them up (so globs and host selectors
+		work), or [ None ] for the global scope.
+		"""
+
+		lookup = { 'global'     : lambda args: [ None ],
+			   'os'         : self.getOSNames,
+			   'appliance'  : self.getApplianceNames,
+			   'environment': self.getEnvironmentNames,
+			   'host'       : self.getHostnames }
+
+		return lookup[scope](args)
+
+	def validate(self):
+		"""
+		Checks every queued command before anything is written.
+		"""
+
+		for (section, cmd, args, params) in self.plan:
+			try:
+				modpath = 'stack.commands.%s' % cmd
+				__import__(modpath)
+				if not hasattr(sys.modules[modpath], 'Command'):
+					raise ImportError(modpath)
+			except ImportError:
+				raise CommandError(self, f'{section} section has unknown command "{cmd}"')
+
+			if cmd == 'set.attr':
+				attr = params.get('attr')
+				if not attr or not re.match('^[a-zA-Z_][a-zA-Z0-9_.]*$', attr):
+					raise CommandError(self, f'{section} section has invalid attr name "{attr}"')
+
+	def batchAttrs(self, attrs):
+		"""
+		Sets the (scope, target, attr, value) ATTRS replacing any
+		existing values, shadow or not, one executemany per scope.
+		"""
+
+		# Connect to a copy of the database if we are running pytest-xdist
+		if 'PYTEST_XDIST_WORKER' in os.environ:
+			db_name = 'shadow' + os.environ['PYTEST_XDIST_WORKER']
+		else:
+			db_name = 'shadow'
+
+		scopes = {}
+		for (scope, target, attr, value) in attrs:
+			scopes.setdefault(scope, []).append((target, attr, value))
+
+		for scope, rows in scopes.items():
+			table = self.attrTables[scope]
+			if table:
+				for database in [ '%s.' % db_name, '' ]:
+					self.db.execute("""
+						delete from %sattributes where scope=%%s and attr=%%s
+						and scopeid=(select id from %s where name=%%s)
+						""" % (database, table),
+						[ (scope, attr, target) for (target, attr, value) in rows ],
+						many=True)
+				self.db.execute("""
+					insert into attributes (scope, attr, value, scopeid)
+					values (%%s, %%s, %%s, (select id from %s where name=%%s))
+					""" % table,
+					[ (scope, attr, value, target) for (target, attr, value) in rows ],
+					many=True)
+			else:
+				for database in [ '%s.' % db_name, '' ]:
+					self.db.execute("""
+						delete from %sattributes where scope=%%s and attr=binary %%s
+						""" % database,
+						[ (scope, attr) for (target, attr, value) in rows ],
+						many=True)
+				self.db.execute("""
+					insert into attributes (scope, attr, value)
+					values (%s, %s, %s)
+					""",
+					[ (scope, attr, value) for (target, attr, value) in rows ],
+					many=True)
+
+	def execute(self):
+		"""
+		Applies the queued commands in-process inside a single
+		transaction and reports how long each section took. Nothing
+		is written if any command fails.
+		"""
+
+		self.validate()
+
+		sections = []
+		for (section, cmd, args, params) in self.plan:
+			if not sections or sections[-1][0] != section:
+				sections.append((section, []))
+			sections[-1][1].append((cmd, args, params))
+
+		link = self.db.database
+		link.begin()
+		try:
+			self.beginOutput()
+			for (section, commands) in sections:
+				t0    = time.time()
+				attrs = []
+				for (cmd, args, params) in commands:
+
+					# Plain (not shadow) attrs are queued and
+					# set in bulk, the queue is flushed before
+					# any other command so they are applied in
+					# document order.
+
+					if cmd == 'set.attr' and not str2bool(params.get('shadow')) \
+					   and params.get('value') not in [ None, '' ] \
+					   and params.get('scope', 'global') in self.attrTables:
+						scope = params.get('scope', 'global')
+						if (scope == 'global') != (not args):
+							raise CommandError(self, f'{section} section has attr "{params["attr"]}" without a target')
+						try:
+							targets = self.getAttrTargets(scope, args)
+						except CommandError as e:
+							raise CommandError(self, f'{section} section: cannot set attr "{params["attr"]}" - {e.msg}')
+						for target in targets:
+							attrs.append((scope, target, params['attr'], str(params['value'])))
+						continue
+
+					self.batchAttrs(attrs)
+					attrs = []
+
+					argv = args + [ f'{k}={v}' for k, v in params.items() ]
+					try:
+						self.command(cmd, argv)
+					except CommandError as e:
+						raise CommandError(self, f'{section} section: "{" ".join(cmd.split("."))} {" ".join(argv)}" failed: {e.msg}')
+
+				self.batchAttrs(attrs)
+				self.addOutput(section, (len(commands), '%.3f' % (time.time() - t0)))
+		except:
+			link.rollback()
+			raise
+		link.commit()
+
+		self.endOutput(header=['section', 'commands', 'seconds'], trimOwner=False)
+
 	def check_required(self, data, section, keys):
 		for key in keys:
 			if data.get(key) is None:
@@ -198,8 +367,9 @@ class command(stack.commands.Command):
 			
 	def run(self, params, args):
 
-		(document, ) = self.fillParams([
-			('document', None)
+		(document, execute) = self.fillParams([
+			('document', None),
+			('exec', False)
 		])
 
 		if not document:
@@ -209,7 +379,14 @@ class command(stack.commands.Command):
 				raise ArgUnique(self, 'filename')
 			document = self.load_file(args[0])
 
+		# By default the commands are printed as a script, when
+		# executing they are collected first and applied at once.
+
+		if self.str2bool(execute):
+			self.plan = []
 		self.main(document)
+		if self.plan is not None:
+			self.execute()
 
 
 
@@ -218,11 +395,18 @@ class Command(command):
 	"""
 	Load configuration data from the provided json document. If no arguments
 	are provided then all plugins will be run.
+
+	<param type='boolean' name='exec'>
+	If yes, apply the document directly in a single database transaction
+	instead of printing the stack commands that would load it, and
+	report the time taken by each section. Default is no.
+	</param>
 	"""
 
 	def main(self, document):
 
 		self.set_scope('global')
+		self.section = 'global'
 
 		self.load_access(document.get('access'))
 		self.load_attr(document.get('attr'))
@@ -233,6 +417,7 @@ class Command(command):
 		for plugin in self.loadPlugins():
 			section = document.get(plugin.provides())
 			if section:
+				self.section = plugin.provides()
 				plugin.run(section)
 
 		
@@ -30,22 +30,36 @@ class Command(stack.commands.load.command):
 	The processor used to parse the file and to load the data into the
 	database. Default: default.
 	</param>
+
+	<param type='boolean' name='batch'>
+	Compare the file against the database and write only the hosts,
+	interfaces, and group memberships that changed using multi-row
+	statements rather than running a command for every host.
+	Default: false.
+	</param>
 	
 	<example cmd='load hostfile file=hosts.csv'>
 	Load all the host info in file named hosts.csv and use the default
 	processor.
 	</example>
+
+	<example cmd='load hostfile file=hosts.csv batch=true'>
+	Reload hosts.csv, only changes are written to the database.
+	</example>
 	
 	<related>unload hostfile</related>
 	"""		
 
 
 	def run(self, params, args):
-		filename, processor = self.fillParams([
+		filename, processor, batch = self.fillParams([
 			('file', None),
-			('processor', 'default')
+			('processor', 'default'),
+			('batch', 'false')
 			])
 
+		self.batch = self.str2bool(batch)
+
 		if not filename:
 			raise ParamRequired(self, 'file')
 
@@ -75,7 +89,10 @@ class Command(stack.commands.load.command):
 
 		self.call('set.host.boot', argv)
 		
-		self.call('sync.config')
+		if self.batch:
+			self.call('sync.config', [ 'incremental=true' ])
+		else:
+			self.call('sync.config')
 
 		argv = []
 		for a in self.hosts.keys():
@@ -7,6 +7,7 @@
 # @rocks@
 
 import sys
+import time
 import stack.commands
 from stack.exception import CommandError
 from stack.bool import str2bool
@@ -27,6 +28,11 @@ class Plugin(stack.commands.HostArgumentProcessor, stack.commands.Plugin):
 
 	def run(self, args):
 		hosts, interfaces = args
+
+		if self.owner.batch:
+			self.runBatch(hosts, interfaces)
+			return
+
 		existinghosts = self.getHostnames()
 		existing_memberships = {}
 		existing_groups = {}
@@ -216,3 +222,365 @@ class Plugin(stack.commands.HostArgumentProcessor, stack.commands.Plugin):
 			self.owner.call('add.host.interface', t)
 
 
+
+
+	#
+	# Batch mode, the spreadsheet is compared against the database and
+	# only the differences are written.
+	#
+
+	def progress(self, step, count, t0):
+		sys.stderr.write('\t%-24s %8d %10.3fs\n' % (step, count, time.time() - t0))
+
+	def placeholders(self, values):
+		return ', '.join([ '%s' ] * len(values))
+
+	def lookup(self, table):
+		return { name: id for id, name in self.db.select('id, name from %s' % table) }
+
+	def runBatch(self, hosts, interfaces):
+		start = time.time()
+
+		# Host names are stored in lowercase, as add host does.
+
+		hosts      = { host.lower(): info for host, info in hosts.items() }
+		interfaces = { host.lower(): info for host, info in interfaces.items() }
+
+		self.appliances = self.lookup('appliances')
+		self.boxes      = self.lookup('boxes')
+		self.subnets    = { name.lower(): id for name, id in self.lookup('subnets').items() }
+		self.bootnames  = {}
+		for id, name, type in self.db.select('id, name, type from bootnames'):
+			self.bootnames[(name, type)] = id
+		self.bootactions = set(self.db.select("""
+			bn.name, bn.type, o.name from bootactions ba
+			join bootnames bn on ba.bootname=bn.id
+			left join oses o on ba.os=o.id
+			"""))
+		self.boxoses = {}
+		for box, os in self.db.select('b.name, o.name from boxes b left join oses o on b.os=o.id'):
+			self.boxoses[box] = os
+
+		t0 = time.time()
+		count = self.batchHosts(hosts)
+		self.progress('Hosts', count, t0)
+
+		self.nodes = self.lookup('nodes')
+
+		t0 = time.time()
+		count = self.batchGroups(hosts)
+		self.progress('Group Memberships', count, t0)
+
+		t0 = time.time()
+		count = self.batchInterfaces(interfaces)
+		self.progress('Interfaces', count, t0)
+
+		self.progress('Total', len(hosts), start)
+
+	def bootaction(self, action, type, box=None):
+		"""
+		Returns the bootnames id of ACTION.  When a BOX is given the
+		action must also be defined for its OS, like add host checks.
+		"""
+
+		id = self.bootnames.get((action, type))
+		if id is None:
+			raise CommandError(self.owner, 'bootaction "%s" does not exist' % action)
+
+		if box is not None:
+			os = self.boxoses.get(box)
+			if not { (action, type, os), (action, type, None) } & self.bootactions:
+				raise CommandError(self.owner, '"%s" %s boot action for "%s" is missing' % (action, type, os))
+		return id
+
+	def batchHosts(self, hosts):
+		"""
+		Inserts the new hosts and updates only the columns that
+		changed on the existing ones. Returns the number of hosts
+		added or changed.
+		"""
+
+		existing = {}
+		for row in self.db.select("""
+			n.name, a.name, b.name, n.rack, n.rank,
+			n.comment, ia.name, oa.name
+			from nodes n
+			left join appliances a on n.appliance=a.id
+			left join boxes b on n.box=b.id
+			left join bootnames ia on n.installaction=ia.id
+			left join bootnames oa on n.osaction=oa.id
+			"""):
+			existing[row[0]] = dict(zip([ 'appliance', 'box', 'rack', 'rank',
+						      'comment', 'installaction', 'osaction' ],
+						    row[1:]))
+
+		inserts = []
+		updates = {}	# (column, value) -> [ hosts ]
+		fallback = []
+
+		for host, info in hosts.items():
+			comment = info.get('comment')
+			if comment and len(comment) > 140:
+				raise CommandError(self.owner, 'comments must be no longer than 140 characters')
+
+			# Boot actions are stored in lowercase, as set host
+			# bootaction does.
+
+			info = dict(info)
+			for key in [ 'installaction', 'osaction' ]:
+				if info.get(key):
+					info[key] = info[key].lower()
+
+			if host not in existing:
+				if info.get('appliance') == 'frontend':
+					raise CommandError(self.owner, 'Renaming frontend is not supported!')
+
+				# Hosts without a rack and rank need the
+				# name guessing done by add host.
+
+				if not info.get('rack') or not info.get('rank'):
+					fallback.append(host)
+					continue
+
+				box = info.get('box', 'default')
+				inserts.append((host,
+						self.appliances[info['appliance']],
+						self.boxes[box],
+						info['rack'], info['rank'],
+						self.bootaction(info.get('installaction', 'default'), 'install', box),
+						self.bootaction(info.get('osaction', 'default'), 'os', box),
+						comment))
+				continue
+
+			current = existing[host]
+			for key in [ 'appliance', 'box', 'rack', 'rank', 'comment',
+				     'installaction', 'osaction' ]:
+				if key in info and info[key] != current[key]:
+					updates.setdefault((key, info[key]), []).append(host)
+
+			box = info.get('box', current['box'])
+			for key, type in [ ('installaction', 'install'), ('osaction', 'os') ]:
+				if key in info and info[key] != current[key]:
+					self.bootaction(info[key], type, box)
+
+		if inserts:
+			self.db.execute("""
+				insert into nodes
+				(name, appliance, box, rack, rank,
+				installaction, osaction, comment)
+				values (%s, %s, %s, %s, %s, %s, %s, %s)
+				""", inserts, many=True)
+
+		for host in fallback:
+			args = [ host ]
+			for key in [ 'appliance', 'box', 'rack', 'rank',
+				     'installaction', 'osaction' ]:
+				if hosts[host].get(key):
+					args.append('%s=%s' % (key, hosts[host][key]))
+			self.owner.call('add.host', args)
+			if hosts[host].get('comment'):
+				self.owner.call('set.host.comment',
+					[ host, 'comment=%s' % hosts[host]['comment'] ])
+
+		# Rack moves tend to give many hosts the same new value so
+		# the updates are grouped by value.
+
+		changed = set()
+		for (key, value), names in updates.items():
+			if key == 'appliance':
+				column, value = key, self.appliances[value]
+			elif key == 'box':
+				column, value = key, self.boxes[value]
+			elif key == 'installaction':
+				column, value = key, self.bootaction(value, 'install')
+			elif key == 'osaction':
+				column, value = key, self.bootaction(value, 'os')
+			else:
+				column = key
+
+			self.db.execute('update nodes set %s=%%s where name in (%s)' %
+					(column, self.placeholders(names)),
+					[ value ] + names)
+			changed.update(names)
+
+		return len(inserts) + len(fallback) + len(changed)
+
+	def batchGroups(self, hosts):
+		"""
+		Makes the group memberships of the spreadsheet hosts match
+		the spreadsheet. Returns the number of memberships added
+		or removed.
+		"""
+
+		groups = self.lookup('groups')
+		missing = set()
+		for info in hosts.values():
+			for group in info.get('groups', []):
+				if group and group not in groups:
+					missing.add(group)
+		if missing:
+			self.db.execute('insert into groups (name) values (%s)',
+					[ (group, ) for group in sorted(missing) ], many=True)
+			groups = self.lookup('groups')
+
+		nodeids = { self.nodes[host] for host in hosts }
+		current = set()
+		for nodeid, groupid in self.db.select('nodeid, groupid from memberships'):
+			if nodeid in nodeids:
+				current.add((nodeid, groupid))
+
+		wanted = set()
+		for host, info in hosts.items():
+			for group in info.get('groups', []):
+				if group:
+					wanted.add((self.nodes[host], groups[group]))
+
+		stale = current - wanted
+		if stale:
+			self.db.execute('delete from memberships where nodeid=%s and groupid=%s',
+					list(stale), many=True)
+
+		new = wanted - current
+		if new:
+			self.db.execute('insert into memberships (nodeid, groupid) values (%s, %s)',
+					list(new), many=True)
+
+		return len(stale) + len(new)
+
+	def wantedInterface(self, host, interface, info):
+		"""
+		Returns the networks row add host interface would create for
+		the spreadsheet INTERFACE, the ip is None for ip=auto
+		interfaces.
+		"""
+
+		default = str2bool(info.get('default', False))
+
+		name = info.get('ifhostname')
+		if name and name.upper() == 'NULL':
+			name = host
+		if default:
+			name = host
+		if name and '.' in name:
+			raise CommandError(self.owner, 'interface name "%s" on %s must not be a FQDN' % (name, host))
+
+		subnet = None
+		network = info.get('network')
+		if network:
+			if network not in self.subnets:
+				raise CommandError(self.owner, 'network "%s" does not exist' % network)
+			subnet = self.subnets[network]
+
+		ip = info.get('ip')
+		if ip and ip.upper() in [ 'NULL', 'AUTO' ]:
+			ip = None
+
+		channel = info.get('channel')
+		if channel and channel.upper() == 'NULL':
+			channel = None
+
+		module = None
+		if 'bond' == interface[:4]:
+			module = 'bonding'
+
+		return (interface, info.get('mac'), ip, name, subnet, module,
+			info.get('vlan') or None, info.get('options'), channel, default)
+
+	def batchInterfaces(self, interfaces):
+		"""
+		Replaces the interfaces of every host whose interfaces in the
+		spreadsheet differ from the database. Returns the number of
+		hosts that changed.
+		"""
+
+		current = {}
+		for row in self.db.select("""
+			node, id, device, mac, ip, name, subnet, module,
+			vlanid, options, channel, main from networks
+			"""):
+			nodeid, id, device = row[:3]
+			current.setdefault(nodeid, []).append((id, row[2:-1] + (bool(row[-1]), )))
+
+		changed = []
+		inserts = []
+		autoip  = []
+		for host in interfaces:
+			if host not in self.nodes:
+				continue
+			nodeid = self.nodes[host]
+			auto   = []
+			wanted = {}
+			for interface, info in interfaces[host].items():
+				wanted[interface] = self.wantedInterface(host, interface, info)
+				if info.get('ip', '').upper() == 'AUTO':
+					auto.append(interface)
+
+			# add host interface leaves only the last default
+			# interface it adds as the default, and the ip=auto
+			# interfaces are added last.
+
+			order = [ interface for interface in wanted if interface not in auto ] + auto
+			defaults = [ interface for interface in order if wanted[interface][-1] ]
+			for interface in defaults[:-1]:
+				wanted[interface] = wanted[interface][:-1] + (False, )
+
+			# An ip=auto interface matches any address already
+			# assigned to it.
+
+			have = {}
+			for id, row in current.get(nodeid, []):
+				if row[0] in auto and row[2]:
+					row = row[:2] + (None, ) + row[3:]
+				have[row[0]] = row
+
+			if len(have) == len(current.get(nodeid, [])) and have == wanted:
+				continue
+
+			changed.append(host)
+			for interface, row in wanted.items():
+				if interface in auto:
+					autoip.append((host, interface, row))
+				else:
+					inserts.append((nodeid, ) + row)
+
+		# The old interfaces go through remove host interface so its
+		# plugins clean up everything that refers to them.
+
+		removed = [ host for host in changed if current.get(self.nodes[host]) ]
+		if removed:
+			self.owner.call('remove.host.interface', removed + [ 'all=true' ])
+
+		if inserts:
+			self.db.execute("""
+				insert into networks
+				(node, device, mac, ip, name, subnet, module,
+				vlanid, options, channel, main)
+				values (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+				""", inserts, many=True)
+
+		# Addresses are allocated by add host interface once all the
+		# static addresses are in.
+
+		for host, interface, (device, mac, ip, name, subnet, module,
+				      vlan, options, channel, default) in autoip:
+			cmdparams = [ host,
+				'unsafe=true',
+				'interface=%s' % interface,
+				'default=%s' % default,
+				'ip=auto',
+				'network=%s' % interfaces[host][interface]['network'] ]
+			if mac:
+				cmdparams.append('mac=%s' % mac)
+			if name:
+				cmdparams.append('name=%s' % name)
+			if vlan:
+				cmdparams.append('vlan=%d' % vlan)
+			if module:
+				cmdparams.append('module=%s' % module)
+			if channel:
+				cmdparams.append('channel=%s' % channel)
+			if options:
+				cmdparams.append('options=%s' % options)
+			self.owner.call('add.host.interface', cmdparams)
+
+		return len(changed)
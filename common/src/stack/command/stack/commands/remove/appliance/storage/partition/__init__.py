@@ -26,5 +26,5 @@ class Command(stack.commands.remove.command):
 	"""
 
 	def run(self, params, args):
-		self.addText(self.command('remove.storage.partition', self._argv + [ 'scope=appliance' ]))
+		self.addText(self.command('remove.storage.partition', self._argv + [ 'scope=appliance' ], passthrough=True))
 		return self.rc
@@ -14,6 +14,7 @@ import ipaddress
 
 import stack.commands
 from stack.commands import Warn
+from stack.commands.list.attr import AttrResolver
 import stack.text
 
 header = """
@@ -138,8 +139,19 @@ class Command(stack.commands.HostArgumentProcessor,
 		for host in self.call('list.host'):
 			data[host['host']] = []
 
-		host_devices = {}
+		# Index the interfaces by host so checking a channel
+		# against the other interfaces of the host, and resolving
+		# the address of an interface without one, are lookups
+		# rather than scans of every interface.
+
 		interfaces = self.call('list.host.interface')
+		host_interfaces = {}
+		for interface in interfaces:
+			key = (interface['host'], interface['interface'])
+			if key not in host_interfaces:
+				host_interfaces[key] = (interface['ip'], interface['channel'])
+
+		host_devices = {}
 		for interface in interfaces:
 			host = interface['host']
 			mac = interface['mac']
@@ -147,14 +159,11 @@ class Command(stack.commands.HostArgumentProcessor,
 			device = interface['interface']
 			channel = interface['channel']
 
-			other_interfaces = [iface['interface'] for iface in interfaces
-					    if iface['host'] == host and iface['interface'] != device]
-
 			if channel:
 				if device == 'ipmi' and not ip:
 					Warn(f'WARNING: skipping IPMI interface on host "{host}" - interface has a channel but no IP')
 					continue
-				elif device != 'ipmi' and channel not in other_interfaces:
+				elif device != 'ipmi' and (channel == device or (host, channel) not in host_interfaces):
 					Warn(f'WARNING: skipping interface "{device}" on host "{host}" - '
 					     f'interface has channel "{channel}" that does not match any other interface on the host')
 					continue
@@ -163,16 +172,31 @@ class Command(stack.commands.HostArgumentProcessor,
 					Warn(f'WARNING: skipping interface "{device}" on host "{host}" - duplicate interface detected')
 					continue
 				else:
-					host_devices[host].append(device)
+					host_devices[host].add(device)
 			elif host:
-				host_devices[host] = [device]
+				host_devices[host] = {device}
 
 			if host and mac:
 				data[host].append((mac, ip, device))
 
+		# The PXE network of every (host, ip) pair and the
+		# attributes of every host, each fetched in one go.
+
+		pxe_networks = {}
+		for (name, ip, netname) in self.db.select("""
+			n.name, nt.ip, s.name from subnets s, networks nt, nodes n
+			where nt.node=n.id and nt.subnet=s.id and s.pxe=TRUE
+			and nt.ip is not NULL
+		"""):
+			if (name, ip) not in pxe_networks:
+				pxe_networks[(name, ip)] = netname
+
+		attributes = AttrResolver(self).resolve(data.keys())
+
 		for name in data.keys():
-			kickstartable = self.str2bool(self.getHostAttr(name, 'kickstartable'))
-			aws = self.str2bool(self.getHostAttr(name, 'aws'))
+			attrs = attributes.get(name, {})
+			kickstartable = self.str2bool(attrs.get('kickstartable', (None, ))[0])
+			aws = self.str2bool(attrs.get('aws', (None, ))[0])
 			mac = None
 			ip  = None
 			dev = None
@@ -184,20 +208,13 @@ class Command(stack.commands.HostArgumentProcessor,
 			for (mac, ip, dev) in data[name]:
 				if not ip:
 					try:
-						ip = self.resolve_ip(name, dev)
+						ip = self.resolve_ip(name, dev, host_interfaces)
 					except IndexError:
-						Warn(f'WARNING: skipping interface "{device}" on host "{host}" - duplicate interface detected')
+						Warn(f'WARNING: skipping interface "{dev}" on host "{name}" - duplicate interface detected')
 						continue
 				netname = None
 				if ip:
-					r = self.db.select("""
-						s.name from subnets s, networks nt, nodes n
-						where nt.node=n.id and n.name=%s
-						and nt.subnet=s.id and s.pxe=TRUE and nt.ip=%s
-					""", (name, ip))
-
-					if r:
-						(netname, ) = r[0]
+					netname = pxe_networks.get((name, ip))
 				if ip and mac and dev and netname and not aws:
 					self.addOutput('', '\nhost %s.%s.%s {' %
 						(name, netname, dev))
@@ -222,19 +239,27 @@ class Command(stack.commands.HostArgumentProcessor,
 
 		self.addOutput('', '</stack:file>')
 
-	def resolve_ip(self, host, device):
+	def resolve_ip(self, host, device, interfaces=None):
 		"""
 		Attempts to resolve the IP address of a host interface that lacks an address
 		(for example, if the interface is part of a bond).
+
+		INTERFACES is an optional {(host, device): (ip, channel)} index
+		used instead of querying the database.
 		"""
 
-		(ip, channel) = self.db.select("""
-			nt.ip, nt.channel from networks nt, nodes n
-			where n.name=%s and nt.device=%s and nt.node=n.id
-		""", (host, device))[0]
+		if interfaces is None:
+			(ip, channel) = self.db.select("""
+				nt.ip, nt.channel from networks nt, nodes n
+				where n.name=%s and nt.device=%s and nt.node=n.id
+			""", (host, device))[0]
+		elif (host, device) in interfaces:
+			(ip, channel) = interfaces[(host, device)]
+		else:
+			raise IndexError(device)
 
 		if channel:
-			return self.resolve_ip(host, channel)
+			return self.resolve_ip(host, channel, interfaces)
 		return ip
 
 	def writeDhcpSysconfig(self):
@@ -17,6 +17,10 @@ class Command(stack.commands.report.host.command):
 	no host name is supplied, then generate the configuration file
 	for all hosts.
 	</arg>
+
+	If the smq.transport attribute is set to "batch" the host ships
+	its messages to the frontend in batched frames over zmq rather
+	than as UDP datagrams.
 	"""
 
 	def run(self, params, args):
@@ -27,6 +31,9 @@ class Command(stack.commands.report.host.command):
 			self.addOutput(host,
 				       '<stack:file stack:name="/etc/sysconfig/stack-mq">')
 			self.addOutput(host, 'MASTER=%s' % self.getHostAttr(host, 'Kickstart_PrivateAddress'))
+			transport = self.getHostAttr(host, 'smq.transport')
+			if transport:
+				self.addOutput(host, 'TRANSPORT=%s' % transport)
 			self.addOutput(host, '</stack:file>')
 
 		self.endOutput(padChar='', trimOwner=True)
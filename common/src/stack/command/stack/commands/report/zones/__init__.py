@@ -22,6 +22,7 @@
 import os
 import time
 import zlib
+import ipaddress
 
 import stack.commands
 import stack.commands.report
@@ -69,8 +70,22 @@ class Command(stack.commands.report.command,
 			self.named = '/var/named'
 
 		networks = self.call('list.network', [ 'dns=true' ])
-		hosts = self.call("list.host.interface", ["expanded=true"])
-		aliases = self.call("list.host.alias")
+
+		# Index the aliases by (host, interface) and the interfaces
+		# by network so every zone only visits its own hosts.
+
+		aliases = {}
+		for alias in self.call('list.host.alias'):
+			key = (alias['host'], alias['interface'])
+			aliases.setdefault(key, []).append(alias['alias'])
+
+		hosts = {}
+		for host in self.call('list.host.interface', [ 'expanded=true' ]):
+			hosts.setdefault(host['network'], []).append({
+				'name'	 : host['host'],
+				'ip'	 : host['ip'],
+				'aliases': aliases.get((host['host'], host['interface']), [])
+				})
 
 		zones = []
 		for network in networks:
@@ -79,7 +94,7 @@ class Command(stack.commands.report.command,
 			sn.reverse()
 			r_sn = '.'.join(sn)
 
-			n["hosts"] = self.getHosts(network, hosts, aliases)
+			n["hosts"] = hosts.get(network["network"], [])
 			n["reverse_subnet"] = r_sn
 			zones.append(n)
 
@@ -88,22 +103,6 @@ class Command(stack.commands.report.command,
 		self.getReverseZones(zones)
 		self.endOutput()
 
-	def getHosts(self, network, hosts, aliases):
-		h = []
-		for host in hosts:
-			if host["network"] == network["network"]:
-				host_record = {
-					"name"	: host["host"],
-					"ip"	: host["ip"],
-					"aliases":[]
-					}
-				for alias in aliases:
-					if alias["host"] == host["host"] and \
-						alias["interface"] == host["interface"]:
-						host_record["aliases"].append(alias["alias"])
-				h.append(host_record)
-		return h
-
 	def host_local(self, name, zone):
 		"Appends any manually defined hosts to domain file"
 
@@ -132,19 +131,33 @@ class Command(stack.commands.report.command,
 			zone = network['zone']
 			filename = '%s/%s.domain' % (self.named, name)
 
-			s = '<stack:file stack:name="%s" stack:perms="0644">\n' % filename
-			s += preamble_template % (self.frontend, self.frontend, serial, self.frontend, self.frontend)
-			#s += 'ns A 127.0.0.1\n\n'
+			s = []
+			s.append('<stack:file stack:name="%s" stack:perms="0644">\n' % filename)
+			s.append(preamble_template % (self.frontend, self.frontend, serial, self.frontend, self.frontend))
 			for host in network["hosts"]:
 				if host["ip"]:
-					s += "%s A %s\n" % (host["name"], host["ip"])
+					s.append("%s A %s\n" % (host["name"], host["ip"]))
 				for alias in host["aliases"]:
-					s += "%s CNAME %s\n" % (alias, host["name"])
-			s += self.host_local(name, zone)
-			s += '</stack:file>\n'
+					s.append("%s CNAME %s\n" % (alias, host["name"]))
+			s.append(self.host_local(name, zone))
+			s.append('</stack:file>\n')
 
-			self.addOutput('', s)
+			self.addOutput('', ''.join(s))
 
+	def getPointer(self, ip, octets):
+		"""
+		Returns the PTR record name of IP within a reverse zone made
+		of the leading OCTETS of the address.
+		"""
+
+		try:
+			packed = ipaddress.IPv4Address(ip).packed
+		except ValueError:
+			host = ip.split('.')[octets:]
+			host.reverse()
+			return '.'.join(host)
+
+		return '.'.join(str(octet) for octet in reversed(packed[octets:]))
 
 	def getReverseZones(self, zones):
 		# Group by reverse zones
@@ -156,7 +169,6 @@ class Command(stack.commands.report.command,
 				z[r_sn] = []
 			z[r_sn].append(x)
 
-		s = ''
 		for zone in z:
 			if len(z[zone]) == 1:
 				name = z[zone][0]["network"]
@@ -172,31 +184,29 @@ class Command(stack.commands.report.command,
 				name = hex(zlib.crc32(n) & 0xffffffff)[2:]
 			filename = '%s/reverse.%s.domain' % (self.named, name)
 
-			s += '<stack:file stack:name="%s" stack:perms="0644">\n' % filename
-			s += preamble_template % (self.frontend, self.frontend, serial, self.frontend, self.frontend)
+			s = []
+			s.append('<stack:file stack:name="%s" stack:perms="0644">\n' % filename)
+			s.append(preamble_template % (self.frontend, self.frontend, serial, self.frontend, self.frontend))
 			sn_len = len(zone.split("."))
 			for l in z[zone]:
 				for host in l["hosts"]:
 					if not host["ip"]:
 						continue
-					ip = host["ip"].split(".")
-					trunc_ip = ip[sn_len:]
-					trunc_ip.reverse()
-					s += '%s IN PTR %s.%s.\n' % ('.'.join(trunc_ip), host["name"], l["zone"])
+					s.append('%s IN PTR %s.%s.\n' % (self.getPointer(host["ip"], sn_len), host["name"], l["zone"]))
 
 				# Handle reverse local additions
 				filename = '%s/reverse.%s.domain.local' % (self.named, l["network"])
 				if os.path.exists(filename):
-					s += '\n;Imported from %s\n\n' % filename
+					s.append('\n;Imported from %s\n\n' % filename)
 					f = open(filename, 'r')
-					s += f.read()
+					s.append(f.read())
 					f.close()
-					s += '\n'
+					s.append('\n')
 				else:
-					s += '\n'
-					s += '; Custom entries for the "%s" network\n' % l["network"]
-					s += '; can be placed in %s\n' % filename
-					s += '; These entries will be sourced on sync\n\n\n'
+					s.append('\n')
+					s.append('; Custom entries for the "%s" network\n' % l["network"])
+					s.append('; can be placed in %s\n' % filename)
+					s.append('; These entries will be sourced on sync\n\n\n')
 
-			s += '</stack:file>\n'
-		self.addOutput('', s)
+			s.append('</stack:file>\n')
+			self.addOutput('', ''.join(s))
@@ -14,96 +14,6 @@
 import os
 import stack.commands
 from stack.exception import ParamType, ParamValue
-import threading
-import socket
-import time
-import subprocess
-
-class Parallel(threading.Thread):
-	def __init__(self, cmd, host, output, timeout):
-		threading.Thread.__init__(self)
-		self.cmd = cmd
-		self.host = host
-		self.output = output
-		self.timeout = timeout
-
-	def run(self):
-		"""
-		Runs the COMMAND on the remote HOST.  If the HOST is the
-		current machine just run the COMMAND in a subprocess.
-		"""
-
-		online = True
-
-		if self.host != socket.gethostname().split('.')[0]:
-			# First check to make the machine is up and SSH is responding.
-			#
-			# This catches the case when the node is up, sshd is sitting
-			# on port 22, but it is not responding (e.g., the node is
-			# overloaded, sshd is hung, etc.)
-			#
-			# sock.recv() should return something like:
-			#
-			#	SSH-2.0-OpenSSH_4.3
-
-			sock   = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-			sock.settimeout(2.0)
-			try:
-				sock.connect((self.host, 22))
-				buf = sock.recv(64)
-			except:
-				online = False
-
-		# If we're online, run the SSH command. Make sure to
-		# pipe STDERR to STDOUT. We wan't to merge the streams
-		# as if this were the output of running the command on
-		# the command line.
-		if online:
-			proc = subprocess.Popen([ 'ssh', self.host, self.cmd ],
-						stdin=None,
-						stdout=subprocess.PIPE,
-						stderr=subprocess.STDOUT)
-
-			# If we dont have a timeout, just wait for the process
-			# to finish
-			if self.timeout <= 0:
-				retval = proc.wait()
-			else:
-				hit_timeout = False
-				start_time = time.time()
-				while hit_timeout is False:
-					# Check if process is done
-					retval = proc.poll()
-					if retval is not None:
-						break
-					# If we're not done, check if we're out
-					# of time.
-					if time.time() - start_time > self.timeout:
-						hit_timeout = True
-						break
-					# If we're not done, and not timed out yet,
-					# just wait
-					if retval is None:
-						time.sleep(0.25)
-
-				# If we hit a timeout, terminate, and
-				# get return code
-				if hit_timeout is True:
-					proc.terminate()
-					retval = proc.wait()
-
-			# Finally get the output, and return back
-			o, e = proc.communicate()
-			self.output['retval'] = retval
-			self.output['output'] = o.strip()
-
-		else:
-			# If we couldn't connect to the host,
-			# return back
-			self.output['retval'] = -1
-			self.output['output'] = 'down'
-
-		return
 
 class command(stack.commands.Command,
 	stack.commands.HostArgumentProcessor):
@@ -187,7 +97,8 @@ class Command(command):
 	</param>
 
 	<param type='string' name='threads'>
-	The number of threads to start in parallel. Default is 0.
+	The number of hosts to run the command on in parallel. Default is 0
+	(limited only by the number of open files).
 	Set "run.host.threads" to set the default
 	</param>
 
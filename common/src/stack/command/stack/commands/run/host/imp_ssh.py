@@ -4,106 +4,148 @@
 # https://github.com/Teradata/stacki/blob/master/LICENSE.txt
 # @copyright@
 
-import stack.commands
-import threading
+import os
+import sys
 import time
-from stack.commands.run.host import Parallel
+import socket
+import asyncio
+import resource
+import stack.commands
+from stack.commands import Debug
 
-class Implementation(stack.commands.Implementation):
+# Master connections are kept open after the command finishes so the
+# next run host against the same nodes skips the SSH handshake.
 
-	#@warningLicenseCheck
-	def run(self, args):
-		# Command to run
-		cmd = self.owner.cmd
+SSH = [ 'ssh',
+	'-o', 'ControlMaster=auto',
+	'-o', 'ControlPath=~/.ssh/stack-%C',
+	'-o', 'ControlPersist=600' ]
 
-		# Hosts to run the commands on
-		hosts = self.owner.run_hosts
 
-		# Dictionary to store output
-		host_output = {}
+class Implementation(stack.commands.Implementation):
+
+	async def probe(self, host):
+		"""
+		Check to make the machine is up and SSH is responding.
 
-		# Control Collation
-		collate = self.owner.collate
+		This catches the case when the node is up, sshd is sitting
+		on port 22, but it is not responding (e.g., the node is
+		overloaded, sshd is hung, etc.)  The banner should be
+		something like:
 
-		# Number of simultaneous threads allowed
-		numthreads = self.owner.numthreads
+			SSH-2.0-OpenSSH_4.3
+		"""
 
-		# Delay between starting threads.
-		delay = self.owner.delay
+		if host == socket.gethostname().split('.')[0]:
+			return True
+
+		try:
+			reader, writer = await asyncio.wait_for(
+				asyncio.open_connection(host, 22), 2.0)
+			try:
+				await asyncio.wait_for(reader.read(64), 2.0)
+			finally:
+				writer.close()
+		except (OSError, asyncio.TimeoutError):
+			return False
+
+		return True
+
+	async def execute(self, host, hostname, output):
+		"""
+		Runs the command on the remote HOST, lines of output are
+		printed as they arrive unless the output is collated.
+		"""
+
+		if not await self.probe(hostname):
+			output['retval'] = -1
+			output['output'] = 'down'
+			if not self.owner.collate:
+				print(output['output'], flush=True)
+			return
+
+		# Make sure to pipe STDERR to STDOUT. We want to merge the
+		# streams as if this were the output of running the command
+		# on the command line.
+
+		proc = await asyncio.create_subprocess_exec(
+			*SSH, hostname, self.owner.cmd,
+			stdin=asyncio.subprocess.DEVNULL,
+			stdout=asyncio.subprocess.PIPE,
+			stderr=asyncio.subprocess.STDOUT)
+
+		lines = []
+
+		async def read():
+			async for line in proc.stdout:
+				line = line.decode(errors='replace')
+				lines.append(line)
+				if not self.owner.collate:
+					sys.stdout.write(line)
+					sys.stdout.flush()
+			return await proc.wait()
 
-		# Timeout that controls when to terminate SSH
 		timeout = self.owner.timeout
+		try:
+			output['retval'] = await asyncio.wait_for(read(), timeout if timeout > 0 else None)
+		except asyncio.TimeoutError:
+			proc.terminate()
+			output['retval'] = await proc.wait()
 
-		threads = []
-
-
-		# If we haven't set the number of threads
-		# to run concurrently, don't check for
-		# running threads.
-		if numthreads == 0:
-			running_threads = -1
-		else:
-			running_threads = 0
-		work = len(hosts)
-		i = 0
-		while work:
-			# Run the first batch of threads
-			while running_threads < numthreads and i < len(hosts):
-				host = hosts[i]['host']
-				hostname = hosts[i]['name']
-
-				host_output[host] = {'output': None, 'retval': -1}
-				p = Parallel(cmd, hostname, host_output[host], timeout)
-				p.setDaemon(True)
-				p.start()
-				threads.append(p)	
-
-				# Increment number of running threads, only if
-				# there is a maximum number of allowed threads
-				if numthreads > 0:
-					running_threads += 1
-				i += 1	
-
-				if delay > 0:
-					time.sleep(delay)
-
-			# Collect completed threads
+		output['output'] = ''.join(lines).strip()
+
+	async def limited(self, semaphore, host, hostname, output):
+		async with semaphore:
+			start = time.time()
 			try:
-				active = threading.enumerate()
+				await self.execute(host, hostname, output)
+			finally:
+				output['latency'] = time.time() - start
+				Debug('run host %s rc %s in %.3fs' % (host, output['retval'], output['latency']))
+
+	async def schedule(self, hosts, host_output):
+		# With no limit on the number of hosts at once stay well
+		# within the number of open files, every ssh costs a few.
+
+		limit = self.owner.numthreads
+		if limit == 0:
+			(soft, hard) = resource.getrlimit(resource.RLIMIT_NOFILE)
+			limit = max(1, soft // 4)
+		semaphore = asyncio.Semaphore(limit)
+
+		tasks = []
+		for h in hosts:
+			host_output[h['host']] = { 'output': None, 'retval': -1 }
+			tasks.append(asyncio.ensure_future(self.limited(semaphore,
+									 h['host'], h['name'],
+									 host_output[h['host']])))
+
+			if self.owner.delay > 0:
+				await asyncio.sleep(self.owner.delay)
+
+		if tasks:
+			await asyncio.wait(tasks)
 
-				t = threads
-				for thread in threads:
-					if thread not in active:
-						thread.join(0.1)
-						threads.remove(thread)
-						# As threads exit, decrement the
-						# number of running threads.
-						running_threads -= 1
-						work -= 1
+	def run(self, args):
+		# Dictionary to store output
+		host_output = {}
 
-				# If we're running fewer threads
-				# than maximum allowed, continue
-				# to create newer threads
-				if running_threads < numthreads:
-					continue
+		os.makedirs(os.path.expanduser('~/.ssh'), mode=0o700, exist_ok=True)
 
-				# If not, don't burn the CPU
-				time.sleep(0.5)
+		try:
+			asyncio.run(self.schedule(self.owner.run_hosts, host_output))
+		except KeyboardInterrupt:
+			pass
 
+		# Gather the output, uncollated output has already been
+		# printed as it arrived.
 
-			except KeyboardInterrupt:
-				work = 0
+		if not self.owner.collate:
+			return
 
-		# Gather and print the output
 		for host in host_output:
-			if not collate:
-				if host_output[host]['output']:
-					print(str(host_output[host]['output']))
-			else:
-				if isinstance((host_output[host]['output']), bytes):
-					out = (host_output[host]['output']).decode('utf').split('\n')
-				else:
-					out = (host_output[host]['output']).split('\n')
-				for line in out:
-					self.owner.addOutput(host, line)
-
+			output = host_output[host]['output']
+			if output is None:
+				continue
+			for line in output.split('\n'):
+				self.owner.addOutput(host, line)
@@ -11,24 +11,179 @@
 # @rocks@
 
 
+import os
+import re
+import glob
+import json
+import hashlib
+import contextlib
 import subprocess
+import stack.lock
 import stack.commands
 
 
 class command(stack.commands.Command):
+
+	# Digests of the files written by report() and the inputs of the
+	# sync config plugins, used by incremental syncs to skip work that
+	# would not change anything.  Removing the file forces a full sync.
+
+	syncState = '/var/cache/stack/sync.json'
+
+	# Set by the commands that take incremental=true, everything else
+	# writes every file and restarts every service like it always has.
+
+	incremental = False
+
+	def loadSyncState(self):
+		try:
+			with open(self.syncState) as fin:
+				state = json.load(fin)
+		except (OSError, ValueError):
+			state = {}
+		state.setdefault('files', {})
+		state.setdefault('plugins', {})
+		return state
+
+	def saveSyncState(self, state):
+		try:
+			os.makedirs(os.path.dirname(self.syncState), exist_ok=True)
+			tmp = '%s.%d' % (self.syncState, os.getpid())
+			with open(tmp, 'w') as fout:
+				json.dump(state, fout)
+			os.rename(tmp, self.syncState)
+		except OSError:
+			pass
+
+	@contextlib.contextmanager
+	def updateSyncState(self):
+		"""
+		Yields the sync state and saves it afterwards.  The state is
+		locked the whole time so concurrent syncs don't lose each
+		other's entries.
+		"""
+
+		mutex = None
+		try:
+			os.makedirs(os.path.dirname(self.syncState), exist_ok=True)
+			mutex = stack.lock.Mutex('%s.lock' % self.syncState)
+			mutex.acquire()
+		except OSError:
+			pass
+
+		try:
+			state = self.loadSyncState()
+			yield state
+			self.saveSyncState(state)
+		finally:
+			if mutex:
+				mutex.release()
+
+	def fileDigest(self, filename):
+		try:
+			with open(filename, 'rb') as fin:
+				return hashlib.sha1(fin.read()).hexdigest()
+		except OSError:
+			return None
+
+	def fingerprint(self, tables, files=[]):
+		"""
+		Returns a dictionary of the checksum of each database table in
+		TABLES and the mtime and size of each file matching the glob
+		patterns in FILES.
+		"""
+
+		result = {}
+		if tables:
+			self.db.execute('checksum table %s' % ', '.join(sorted(tables)))
+			for (table, checksum) in self.db.fetchall():
+				result[table.split('.')[-1]] = checksum
+		for pattern in files:
+			for filename in sorted(glob.glob(pattern)):
+				st = os.stat(filename)
+				result[filename] = [ st.st_mtime, st.st_size ]
+		return result
+
 	def report(self, cmd, args=[]):
 		"""
 		For report commands that output XML, this method runs the command
 		and processes the XML to create system files.
+
+		In an incremental sync each <stack:file> is only written if
+		its contents differ from what was last written, or the file
+		changed on disk since.  Returns the list of files that were
+		written.
 		"""
 
+		state   = self.loadSyncState()
+		files   = state['files']
+		lines   = []
+		written = []
+
+		# A row can hold several lines (and files), look at each
+		# line on its own.
+
+		rows = []
+		for row in self.call(cmd, args):
+			rows.extend(('%s\n' % row['col-1']).splitlines(True))
+
+		section = None
+		for line in rows:
+			if section is None and '<stack:file' in line:
+				m = re.search('stack:name="([^"]*)"', line)
+				section = (m.group(1) if m else None, [],
+					   'stack:mode="append"' in line)
+			if section is None:
+				lines.append(line)
+				continue
+
+			section[1].append(line)
+			if '</stack:file>' not in line:
+				continue
+
+			(name, text, append) = section
+			section = None
+
+			# Appending to a file is never skipped, there is
+			# nothing to compare it to.
+
+			if append:
+				lines.extend(text)
+				if name:
+					written.append((name, None))
+				continue
+
+			# Zone serials are timestamps, they do not count
+			# as a change.
+
+			digest = hashlib.sha1()
+			for l in text:
+				if not l.rstrip().endswith('; Serial'):
+					digest.update(l.encode())
+			digest = digest.hexdigest()
+
+			entry = files.get(name)
+			if self.incremental and name and entry and \
+			   entry['digest'] == digest and \
+			   entry['file'] == self.fileDigest(name):
+				continue
+
+			lines.extend(text)
+			if name:
+				written.append((name, digest))
+
+		if section:
+			lines.extend(section[1])
+
+		if not ''.join(lines).strip():
+			return []
+
 		p = subprocess.Popen(['/opt/stack/bin/stack', 'report', 'script'],
 				     stdin=subprocess.PIPE,
 				     stdout=subprocess.PIPE,
 				     stderr=subprocess.PIPE)
 
-		for row in self.call(cmd, args):
-			line = '%s\n' % row['col-1']
+		for line in lines:
 			p.stdin.write(line.encode())
 		o, e = p.communicate('')
 
@@ -38,5 +193,38 @@ class command(stack.commands.Command):
 				       stderr=subprocess.PIPE)
 		out, err = psh.communicate(o)
 
+		# Re-read the state, the sub-commands of a sync (or another
+		# sync) may have updated it while we were running.
+
+		with self.updateSyncState() as state:
+			for (name, digest) in written:
+				if digest is None:
+					state['files'].pop(name, None)
+				else:
+					state['files'][name] = {
+						'digest': digest,
+						'file'	: self.fileDigest(name)
+						}
+
+		return [ name for (name, digest) in written ]
+
+	def restartService(self, service, changed, reload=False):
+		"""
+		Restarts SERVICE.  In an incremental sync it is only restarted
+		(or reloaded) if its configuration CHANGED, or started if it is
+		not running.
+		"""
 
+		devnull = subprocess.DEVNULL
+		if not self.incremental:
+			action = 'restart'
+		elif changed:
+			action = 'reload-or-restart' if reload else 'restart'
+		elif subprocess.call(['systemctl', 'is-active', '--quiet', service],
+				     stdout=devnull, stderr=devnull):
+			action = 'restart'
+		else:
+			return
 
+		subprocess.call(['systemctl', action, service],
+				stdout=devnull, stderr=devnull)
@@ -23,10 +23,63 @@ class Command(stack.commands.sync.command):
 	<example cmd='sync config'>
 	Rebuild all configuration files and restart relevant services.
 	</example>
+
+	<param type='boolean' name='incremental'>
+	Only run the plugins whose database tables or local files have
+	changed since the last sync. Default is no.
+	</param>
+
+	<example cmd='sync config incremental=true'>
+	Rebuild only the configuration files that depend on data that
+	changed since the last sync.
+	</example>
 	"""
 
+	def changed(self, name, tables, files=[]):
+		"""
+		Returns True if the NAME plugin needs to run. Unless this is an
+		incremental sync it always does, otherwise only if any of the
+		TABLES or FILES (glob patterns) changed since it last ran.
+		"""
+
+		if not self.incremental:
+			return True
+
+		fingerprint = self.fingerprint(tables, files)
+		self.fingerprints[name] = (fingerprint, files)
+
+		return self.loadSyncState()['plugins'].get(name) != fingerprint
+
+	def incrementalArgs(self):
+		"""
+		Returns the arguments that pass incremental=true on to the
+		sync commands run by the plugins.
+		"""
+
+		if self.incremental:
+			return [ 'incremental=true' ]
+		return []
+
 	def run(self, params, args):
 
+		(incremental, ) = self.fillParams([ ('incremental', 'false') ])
+		self.incremental  = self.str2bool(incremental)
+		self.fingerprints = {}
+
 		self.notify('Sync Config')
 
 		self.runPlugins()
+
+		# The plugins rewrote their files, fingerprint those again
+		# so they do not look changed next time.  The tables keep
+		# their checksums from before the plugins ran.
+
+		if not self.fingerprints:
+			return
+
+		with self.updateSyncState() as state:
+			for name, (fingerprint, files) in self.fingerprints.items():
+				for key in [ key for key in fingerprint if key.startswith('/') ]:
+					del fingerprint[key]
+				fingerprint.update(self.fingerprint([], files))
+				state['plugins'][name] = fingerprint
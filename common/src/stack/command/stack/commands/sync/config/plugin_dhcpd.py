@@ -19,4 +19,8 @@ class Plugin(stack.commands.Plugin):
 		return ['hostfile']
 
 	def run(self, args):
-		self.owner.command('sync.dhcpd')
+		if self.owner.changed('dhcpd',
+				      [ 'nodes', 'networks', 'subnets', 'attributes',
+					'appliances', 'oses', 'environments', 'boxes' ],
+				      [ '/etc/dhcp/dhcpd.conf', '/etc/sysconfig/dhcpd' ]):
+			self.owner.command('sync.dhcpd', self.owner.incrementalArgs())
@@ -16,5 +16,10 @@ class Plugin(stack.commands.Plugin):
 		return 'dns'
 
 	def run(self, args):
-		self.owner.command('sync.dns', [])
+		if self.owner.changed('dns',
+				      [ 'nodes', 'networks', 'subnets', 'aliases', 'attributes',
+					'appliances', 'oses', 'environments', 'boxes' ],
+				      [ '/etc/named.conf', '/etc/named.conf.local',
+					'/etc/resolv.conf', '/var/named/*.domain*' ]):
+			self.owner.command('sync.dns', self.owner.incrementalArgs())
 
@@ -17,5 +17,9 @@ class Plugin(stack.commands.Plugin):
 		return []
 
 	def run(self, args):
-		if self.owner.getAttr('platform') not in [ 'docker', 'aws' ]:
-			self.owner.command('sync.host')
+		if self.owner.getAttr('platform') in [ 'docker', 'aws' ]:
+			return
+		if self.owner.changed('hostfile',
+				      [ 'nodes', 'networks', 'subnets', 'aliases' ],
+				      [ '/etc/hosts', '/etc/hosts.local' ]):
+			self.owner.command('sync.host', self.owner.incrementalArgs())
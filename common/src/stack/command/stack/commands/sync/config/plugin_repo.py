@@ -13,5 +13,9 @@ class Plugin(stack.commands.Plugin):
 		return 'repo'
 		
 	def run(self, args):
-		self.owner.command('sync.host.repo', [ 'localhost' ])
+		if self.owner.changed('repo',
+				      [ 'nodes', 'attributes', 'boxes', 'stacks', 'rolls',
+					'carts', 'cart_stacks', 'oses', 'appliances', 'environments' ],
+				      [ '/etc/yum.repos.d/*', '/etc/zypp/repos.d/*' ]):
+			self.owner.command('sync.host.repo', [ 'localhost' ])
 
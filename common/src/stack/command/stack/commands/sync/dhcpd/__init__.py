@@ -8,7 +8,6 @@
 #
 
 import stack.commands
-import subprocess
 
 
 class Command(stack.commands.sync.command):
@@ -21,13 +20,23 @@ class Command(stack.commands.sync.command):
 t the
 	DHCPD service
 	</example>
+
+	<param type='boolean' name='incremental'>
+	Only write the files whose contents changed, and only restart
+	dhcpd if they did. Default is no.
+	</param>
 	"""
 
 	def run(self, params, args):
 
+		(incremental, ) = self.fillParams([ ('incremental', 'false') ])
+		self.incremental = self.str2bool(incremental)
+
 		self.notify('Sync DHCP')
 
-		self.report('report.dhcpd')
+		changed = self.report('report.dhcpd')
+
+		# dhcpd cannot reload its configuration, in an incremental
+		# sync it is only restarted when the configuration changed.
 
-		subprocess.call(['/sbin/service', 'dhcpd', 'restart'],
-				stdout=open('/dev/null'), stderr=open('/dev/null'))
+		self.restartService('dhcpd', changed)
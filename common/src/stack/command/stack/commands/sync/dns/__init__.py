@@ -12,7 +12,6 @@
 
 
 import stack.commands
-import subprocess
 
 
 class Command(stack.commands.sync.command):
@@ -22,10 +21,22 @@ class Command(stack.commands.sync.command):
 	<example cmd='sync dns'>
 	Rebuild the DNS configuration files, then restart named.
 	</example>
+
+	<param type='boolean' name='incremental'>
+	Only write the files whose contents changed, and only restart
+	named if they did. Default is no.
+	</param>
 	"""
 
 	def run(self, params, args):
 
+		(incremental, ) = self.fillParams([ ('incremental', 'false') ])
+		self.incremental = self.str2bool(incremental)
+
 		self.notify('Sync DNS')
-		self.runPlugins()
-		subprocess.call(['systemctl','restart','named'])
+		changed = False
+		for (provides, files) in self.runPlugins():
+			if files:
+				changed = True
+
+		self.restartService('named', changed, reload=True)
@@ -19,4 +19,4 @@ class Plugin(stack.commands.Plugin):
 		return 'named'
 
 	def run(self, args):
-		self.owner.report('report.named')
+		return self.owner.report('report.named')
@@ -21,4 +21,4 @@ class Plugin(stack.commands.Plugin):
 
 	def run(self, args):
 		if self.owner.getAttr('platform') not in [ 'docker', 'aws' ]:
-			self.owner.report('report.host.resolv', [ 'localhost' ])
+			return self.owner.report('report.host.resolv', [ 'localhost' ])
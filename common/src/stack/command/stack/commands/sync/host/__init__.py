@@ -94,20 +94,34 @@ class Parallel(threading.Thread):
 class Command(command):
 	"""
 	Writes the /etc/hosts file based on the configuration database
+
+	<param type='boolean' name='incremental'>
+	Only write the files if their contents changed. Default is no.
+	</param>
 	"""
 
 	def run(self, params, args):
 
+		(incremental, ) = self.fillParams([ ('incremental', 'false') ])
+		incremental = self.str2bool(incremental)
+
 		self.notify('Sync Host')
 
-		output = self.command('report.host')
-		f = open('/etc/hosts', 'w')
-		f.write("%s\n" % output)
-		f.close()
+		output = '%s\n' % self.command('report.host')
 
+		files = [ '/etc/hosts' ]
 		if os.path.exists('/srv/salt/rocks'):
-			f = open('/srv/salt/rocks/hosts', 'w')
-			f.write("%s\n" % output)
+			files.append('/srv/salt/rocks/hosts')
+
+		# In an incremental sync leave the files alone if nothing
+		# changed
+		for filename in files:
+			if incremental and os.path.exists(filename):
+				with open(filename) as f:
+					if f.read() == output:
+						continue
+			f = open(filename, 'w')
+			f.write(output)
 			f.close()
 
 
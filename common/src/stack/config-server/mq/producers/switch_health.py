@@ -8,7 +8,7 @@ import json
 import subprocess
 import stack.mq
 import stack.api
-import stack.api.get
+from stack.switch.pool import SwitchPool
 from stack.switch.m7800 import SwitchMellanoxM7800
 from stack.switch.x1052 import SwitchDellX1052
 
@@ -18,8 +18,16 @@ class Producer(stack.mq.producers.ProducerBase):
 	the system.
 	This must run on the frontend and "spoof" the IP address of the switches because
 	we can't put message queue code on the switches.
+
+	The switches are checked at the same time and the SSH sessions are
+	kept open between runs, a switch is only logged into again once
+	its session dies.
 	"""
 
+	def __init__(self, scheduler, sock):
+		super().__init__(scheduler, sock)
+		self.pool = SwitchPool(16)
+
 	def schedule(self):
 		return 60
 
@@ -33,47 +41,53 @@ class Producer(stack.mq.producers.ProducerBase):
 		return None
 
 	def getSwitches(self):
+		"""
+		Returns (ip, attrs) for every switch, the attributes of all
+		the switches are read at once.
+		"""
+		attrs = {}
+		for o in stack.api.Call('list.host.attr', [ 'a:switch' ]):
+			attrs.setdefault(o['host'], {})[o['attr']] = o['value']
+
 		switches = []
 		for o in stack.api.Call('list.host.interface', [ 'a:switch' ]):
 			if 'default' in o and o['default']:
-				switches.append(o['ip'])
-		
+				switches.append((o['ip'], attrs.get(o['host'], {})))
+
 		return switches
 
-	def getStatus(self, switch, make, model):
-		s = None
-		status = None
-		u = stack.api.get.GetHostAttr(switch, 'switch_username')
-		p = stack.api.get.GetHostAttr(switch, 'switch_password')
+	def getStatus(self, switch, attrs):
+		cls = None
+		make  = attrs.get('component.make')
+		model = attrs.get('component.model')
 
 		if (make, model) == ('Mellanox', 'm7800'):
-			s = SwitchMellanoxM7800(switch, username = u, password = p)
+			cls = SwitchMellanoxM7800
 		elif (make, model) == ('DELL', 'x1052'):
-			s = SwitchDellX1052(switch, username = u, password = p)
+			cls = SwitchDellX1052
 
-		if s:
-			try:
-				s.connect()
-				status = 'up'
-			except:
-				pass
+		if not cls:
+			return None
 
-		return status
+		try:
+			self.pool.session(cls, switch,
+					  username=attrs.get('switch_username'),
+					  password=attrs.get('switch_password'))
+		except:
+			return None
 
-	def produce(self):
-		msgs = []
-
-		for switch in self.getSwitches():
-			online_status = self.ping(switch)
+		return 'up'
 
-			ssh_status = None
-			make = stack.api.get.GetHostAttr(switch, 'component.make')
-			model = stack.api.get.GetHostAttr(switch, 'component.model')
+	def check(self, switch):
+		ip, attrs = switch
+		return { 'state': self.ping(ip), 'ssh': self.getStatus(ip, attrs) }
 
-			ssh_status = self.getStatus(switch, make, model)
+	def produce(self):
+		msgs = []
 
-			payload = { 'state': online_status }
-			payload['ssh'] = ssh_status
+		for (switch, attrs), payload, error in self.pool.map(self.check, self.getSwitches()):
+			if error:
+				payload = { 'state': None, 'ssh': None }
 
 			msgs.append(stack.mq.Message(json.dumps(payload), channel='health',
 				source=switch, ttl=self.schedule() * 2))
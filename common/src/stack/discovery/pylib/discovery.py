@@ -5,6 +5,7 @@
 # @copyright@
 
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import ipaddress
 from itertools import filterfalse
 import json
@@ -16,10 +17,12 @@ import signal
 import socket
 import subprocess
 import sys
+import threading
 
 from stack.api.get import GetAttr
 from stack.commands import Command
 from stack.exception import CommandError
+from stack.logtail import LogTail
 import stack.mq
 
 
@@ -27,13 +30,26 @@ class Discovery:
     """
     Start or stop a daemon that listens for PXE boots and inserts the new
     nodes into the database.
+
+    The known MACs, IPs, and host names are read from the database when
+    the daemon starts and kept up to date as nodes are added, so a DHCP
+    request never waits on the database. The index is read again every
+    _INDEX_REFRESH seconds, or on SIGHUP, to pick up hosts that were
+    removed (or added) behind our back. New nodes are added in batches,
+    collected for up to _BATCH_WINDOW seconds (or _BATCH_SIZE nodes),
+    with a single config sync per batch.
     """
 
     _PIDFILE = "/var/run/stack-discovery.pid"
     _LOGFILE = "/var/log/stack-discovery.log"
 
+    _BATCH_WINDOW = 1.0
+    _BATCH_SIZE = 32
+    _INDEX_REFRESH = 300.0
+
     _get_next_ip_address_cache = {}
     _get_ipv4_network_for_interface_cache = {}
+    _get_network_for_interface_cache = {}
 
     @property
     def hostname(self):
@@ -79,13 +95,19 @@ class Discovery:
         
         if ipv4_network is not None:
             # Figure out the gateway for the interface and check that pxe is true
-            self._command.db.clearCache()
-            for row in self._command.call("list.network"):
+            with self._db_lock:
+                self._command.db.clearCache()
+                networks = self._command.call("list.network")
+
+            for row in networks:
                 if (
                     row['address'] == str(ipv4_network.network_address) and 
                     row['mask'] == str(ipv4_network.netmask)
                 ):
                     if row['pxe'] == True:
+                        # Remember the network name for adding the nodes
+                        self._get_network_for_interface_cache[interface] = row['network']
+
                         # Make sure to filter out the gateway IP address
                         gateway = ipaddress.IPv4Address(row['gateway'])
                         return filterfalse(lambda x: x == gateway, ipv4_network.hosts())
@@ -118,14 +140,8 @@ class Discovery:
             self._logger.debug("trying IP address: %s", ip_address)
             
             # Make sure this IP isn't already taken
-            self._command.db.clearCache()
-            for row in self._command.call("list.host.interface"):
-                if (
-                    row['ip'] == str(ip_address) and
-                    not row['interface'].startswith("vlan")
-                ):
-                    self._logger.debug("IP address already taken: %s", ip_address)
-                    break
+            if str(ip_address) in self._ip_addresses:
+                self._logger.debug("IP address already taken: %s", ip_address)
             else:
                 # Looks like it is free
                 self._logger.debug("IP address is free: %s", ip_address)
@@ -134,144 +150,325 @@ class Discovery:
         # No IP addresses left
         return None
 
-    def _add_node(self, interface, mac_address, ip_address):
-        # Figure out the network for this interface
-        network = None
-        ipv4_network = self._get_ipv4_network_for_interface(interface)
-        if ipv4_network is not None:
+    def _get_next_host(self):
+        """
+        Get the next host name, rack, and rank that isn't already in the database, moving the
+        rank along.
+        """
+
+        while self.hostname in self._hostnames:
+            self._logger.debug("host name already taken: %s", self.hostname)
+            self._rank += 1
+
+        host = (self.hostname, self._rack, self._rank)
+        self._rank += 1
+
+        return host
+
+    def _read_index(self):
+        """
+        Read the known MACs, IPs, and host names from the database.
+        """
+
+        mac_addresses = set()
+        ip_addresses = set()
+        hostnames = set()
+
+        with self._db_lock:
             self._command.db.clearCache()
-            for row in self._command.call("list.network"):
-                if (
-                    row['address'] == str(ipv4_network.network_address) and 
-                    row['mask'] == str(ipv4_network.netmask)
-                ):
-                    network = row['network']
-                    break
-        
-        # The network should alway be able to be found, unless something deleted it since the 
-        # discovery daemon started running
-        if network is not None:
-            # Add our new node
-            result = subprocess.run([
-                "/opt/stack/bin/stack",
-                "add",
-                "host",
-                self.hostname,
-                f"appliance={self._appliance_name}",
-                f"rack={self._rack}",
-                f"rank={self._rank}",
-                f"box={self._box}"
-            ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding="utf-8")
-            
-            if result.returncode != 0:
-                self._logger.error("failed to add host %s:\n%s", self.hostname, result.stderr)
-                return
+            for row in self._command.call("list.host.interface"):
+                if row['mac']:
+                    mac_addresses.add(row['mac'])
+                if row['ip'] and not (row['interface'] or "").startswith("vlan"):
+                    ip_addresses.add(row['ip'])
 
-            # Add the node's interface
-            result = subprocess.run([
-                "/opt/stack/bin/stack",
-                "add",
-                "host",
-                "interface",
-                self.hostname,
-                "interface=NULL",
-                "default=true",
-                f"mac={mac_address}",
-                f"name={self.hostname}",
-                f"ip={ip_address}",
-                f"network={network}"
-            ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding="utf-8")
-            
-            if result.returncode != 0:
-                self._logger.error("failed to add interface for host %s:\n%s", self.hostname, result.stderr)
-                return
-            
-            # Set the new node's install action
-            result = subprocess.run([
-                "/opt/stack/bin/stack",
-                "set",
-                "host",
-                "bootaction",
-                self.hostname,
-				"type=install",
-				"sync=false",
-                f"action={self._install_action}"
-            ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding="utf-8")
-            
-            if result.returncode != 0:
-                self._logger.error("failed to set install action for host %s:\n%s", self.hostname, result.stderr)
-                return
+            for row in self._command.call("list.host"):
+                hostnames.add(row['host'])
 
-            if self._install:
-                # Set the new node to install on boot
-                result = subprocess.run([
-                    "/opt/stack/bin/stack",
-                    "set",
-                    "host",
-                    "boot",
-                    self.hostname,
-                    "action=install"
-                ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding="utf-8")
-                    
-                if result.returncode != 0:
-                    self._logger.error("failed to set boot action for host %s:\n%s", self.hostname, result.stderr)
-                    return
-            else:
-                # Set the new node to OS on boot
-                result = subprocess.run([
-                    "/opt/stack/bin/stack",
-                    "set",
-                    "host",
-                    "boot",
-                    self.hostname,
-                    "action=os"
-                ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding="utf-8")
-                    
-                if result.returncode != 0:
-                    self._logger.error("failed to set boot action for host %s:\n%s", self.hostname, result.stderr)
-                    return
-            
-            # Sync the global config
-            result = subprocess.run([
-                "/opt/stack/bin/stack",
-                "sync",
-                "config"
-            ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding="utf-8")
-            
-            if result.returncode != 0:
-                self._logger.error("unable to sync global config:\n%s", result.stderr)
-                return
+        return mac_addresses, ip_addresses, hostnames
 
-            # Sync the host config
-            result = subprocess.run([
-                "/opt/stack/bin/stack",
-                "sync",
-                "host",
-                "config",
-                self.hostname
-            ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding="utf-8")
-            
-            if result.returncode != 0:
-                self._logger.error("unable to sync host config:\n%s", result.stderr)
-                return
+    def _build_index(self, index=None):
+        """
+        Replace the index with INDEX, or what is in the database if not given. The nodes
+        that are still waiting to be added keep their MAC, IP, and host name.
+        """
+
+        if index is None:
+            index = self._read_index()
 
-            self._logger.info("successfully added host %s", self.hostname)
+        self._mac_addresses, self._ip_addresses, self._hostnames = index
+        for node in self._claims.values():
+            self._claim_node(node)
+
+        # Removed hosts may have freed up addresses we already walked past
+        self._get_next_ip_address_cache.clear()
+
+        self._logger.debug(
+            "indexed %d MACs, %d IPs, %d hosts",
+            len(self._mac_addresses), len(self._ip_addresses), len(self._hostnames)
+        )
+
+    def _refresh_index(self):
+        """
+        Read the index again in the batch thread, after the batches already queued.
+        """
+
+        if self._refresh_handle is not None:
+            self._refresh_handle.cancel()
+            self._refresh_handle = None
+
+        refresh = self._loop.run_in_executor(self._executor, self._read_index)
+        refresh.add_done_callback(self._index_read)
+        self._batches.add(refresh)
+
+    def _index_read(self, refresh):
+        self._batches.discard(refresh)
+
+        if refresh.exception() is not None:
+            self._logger.error("failed to read the index: %s", refresh.exception())
+        else:
+            self._build_index(refresh.result())
+
+        if not self._done and self._refresh_handle is None:
+            self._refresh_handle = self._loop.call_later(self._INDEX_REFRESH, self._refresh_index)
+
+    def _claim_node(self, node):
+        """
+        Add a node's MAC, IP, and host name to the index, so later DHCP requests see them.
+        """
+
+        self._mac_addresses.add(node['mac_address'])
+        self._ip_addresses.add(str(node['ip_address']))
+        self._hostnames.add(node['hostname'])
+
+    def _release_node(self, node, taken=()):
+        """
+        Drop a node that couldn't be added from the index, so a later DHCP request can try
+        again. The MAC, IP, or host name in TAKEN belong to someone else and are kept.
+        """
+
+        self._logger.debug("releasing host %s", node['hostname'])
+
+        self._mac_addresses.discard(node['mac_address'])
+
+        if str(node['ip_address']) not in taken:
+            self._ip_addresses.discard(str(node['ip_address']))
+
+            # Start looking from the top of the network again
+            self._get_next_ip_address_cache.pop(node['interface'], None)
+
+        if node['hostname'] not in taken:
+            self._hostnames.discard(node['hostname'])
+
+            # Hand out the name again if it is from our rack
+            if node['rack'] == self._rack:
+                self._rank = min(self._rank, node['rank'])
+
+    def _remove_host(self, hostname):
+        """
+        Take out a host that was only partly added, so its name is free again.
+        """
+
+        try:
+            self._command.call("remove.host", [hostname])
+        except CommandError as e:
+            self._logger.error("failed to remove host %s:\n%s", hostname, e)
+
+    def _find_conflicts(self, nodes):
+        """
+        Return the MACs, IPs, and host names of these nodes that were added to the database
+        by someone else since the index was built.
+        """
+
+        values = []
+        for node in nodes:
+            values.extend([node['mac_address'], str(node['ip_address']), node['hostname']])
+
+        marks = ", ".join(["%s"] * len(nodes))
+        rows = self._command.db.select(f"""
+            networks.mac, networks.ip, nodes.name from nodes
+            left join networks on networks.node=nodes.id
+            where (networks.mac in ({marks}) or networks.ip in ({marks}) or nodes.name in ({marks}))
+        """, values[0::3] + values[1::3] + values[2::3])
+
+        conflicts = set()
+        for mac_address, ip_address, hostname in rows:
+            conflicts.update([mac_address, ip_address, hostname])
+
+        return conflicts
+
+    def _add_nodes(self, nodes):
+        """
+        Add a batch of nodes to the database, then sync the config once for all of them.
+        This runs in the batch thread, one batch at a time. Returns a list of (node, taken)
+        for the nodes that couldn't be added, where taken is the set of its MAC, IP, and
+        host name that are in use by someone else.
+        """
+
+        added = []
+        failed = []
+        with self._db_lock:
+            self._command.db.clearCache()
+            conflicts = self._find_conflicts(nodes)
+
+            for node in nodes:
+                hostname = node['hostname']
+
+                taken = conflicts & {node['mac_address'], str(node['ip_address']), hostname}
+                if taken:
+                    self._logger.error("host %s was added to the database by someone else", hostname)
+                    failed.append((node, taken))
+                    continue
+
+                try:
+                    # Add our new node
+                    self._command.call("add.host", [
+                        hostname,
+                        f"appliance={self._appliance_name}",
+                        f"rack={node['rack']}",
+                        f"rank={node['rank']}",
+                        f"box={self._box}",
+                        f"installaction={self._install_action}"
+                    ])
+                except CommandError as e:
+                    self._logger.error("failed to add host %s:\n%s", hostname, e)
+                    failed.append((node, set()))
+                    continue
+
+                try:
+                    # Add the node's interface
+                    self._command.call("add.host.interface", [
+                        hostname,
+                        "interface=NULL",
+                        "default=true",
+                        f"mac={node['mac_address']}",
+                        f"name={hostname}",
+                        f"ip={node['ip_address']}",
+                        f"network={node['network']}"
+                    ])
+                except CommandError as e:
+                    self._logger.error("failed to add interface for host %s:\n%s", hostname, e)
+                    self._remove_host(hostname)
+                    failed.append((node, set()))
+                    continue
+
+                added.append(node)
+
+            if not added:
+                return failed
+
+            try:
+                # Set the new nodes to install (or the OS) on boot
+                self._command.call("set.host.boot", [node['hostname'] for node in added] + [
+                    "action=install" if self._install else "action=os"
+                ])
+            except CommandError as e:
+                self._logger.error("failed to set boot action for hosts:\n%s", e)
+                return failed
+
+        # Sync the global config, only what the new nodes changed
+        result = subprocess.run([
+            "/opt/stack/bin/stack",
+            "sync",
+            "config",
+            "incremental=true"
+        ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding="utf-8")
+        
+        if result.returncode != 0:
+            self._logger.error("unable to sync global config:\n%s", result.stderr)
+            return failed
+
+        # Sync the host config
+        result = subprocess.run([
+            "/opt/stack/bin/stack",
+            "sync",
+            "host",
+            "config",
+            *[node['hostname'] for node in added]
+        ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding="utf-8")
+        
+        if result.returncode != 0:
+            self._logger.error("unable to sync host config:\n%s", result.stderr)
+            return failed
+
+        for node in added:
+            self._logger.info("successfully added host %s", node['hostname'])
 
             # Post the host added message
             message = json.dumps({
                 'channel': "discovery",
                 'payload': {
                     'type': "add",
-                    'interface': interface,
-                    'mac_address': mac_address,
-                    'ip_address': str(ip_address),
-                    'hostname': self.hostname
+                    'interface': node['interface'],
+                    'mac_address': node['mac_address'],
+                    'ip_address': str(node['ip_address']),
+                    'hostname': node['hostname']
                 }
             })
 
             self._socket.sendto(message.encode(), ("localhost", stack.mq.ports.publish))
-        else:
-            self._logger.error("no network exists for interface %s", interface)
+
+        return failed
+
+    def _queue_node(self, node):
+        """
+        Claim a node in the index and queue it up for the next batch, starting the batch
+        window if this is its first node.
+        """
+
+        self._claim_node(node)
+        self._claims[node['mac_address']] = node
+        self._pending.append(node)
+
+        if len(self._pending) >= self._BATCH_SIZE:
+            self._flush_nodes()
+        elif self._flush_handle is None:
+            self._flush_handle = self._loop.call_later(self._BATCH_WINDOW, self._flush_nodes)
+
+    def _flush_nodes(self):
+        """
+        Hand the pending nodes to the batch thread.
+        """
+
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        nodes, self._pending = self._pending, []
+        if nodes:
+            batch = self._loop.run_in_executor(self._executor, self._add_nodes, nodes)
+            batch.add_done_callback(lambda batch: self._batch_done(batch, nodes))
+            self._batches.add(batch)
+
+    def _batch_done(self, batch, nodes):
+        """
+        Finish a batch in the event loop, releasing the nodes that couldn't be added.
+        """
+
+        self._batches.discard(batch)
+
+        for node in nodes:
+            self._claims.pop(node['mac_address'], None)
+
+        if batch.exception() is not None:
+            self._logger.error("failed to add batch of hosts: %s", batch.exception())
+            return
+
+        for node, taken in batch.result():
+            self._release_node(node, taken)
+
+    async def _wait_for_batches(self):
+        """
+        Add whatever is still pending and wait for all the batches to finish.
+        """
+
+        if self._refresh_handle is not None:
+            self._refresh_handle.cancel()
+            self._refresh_handle = None
+
+        self._flush_nodes()
+        if self._batches:
+            await asyncio.wait(self._batches)
 
     def _process_dhcp_line(self, line):
         # See if we are a DHCPDISCOVER message
@@ -283,11 +480,8 @@ class Discovery:
             self._logger.info("detected a dhcp request: %s %s", mac_address, interface)
 
             # Is this a new MAC address?
-            self._command.db.clearCache()
-            for row in self._command.call("list.host.interface"):
-                if row['mac'] == mac_address:
-                    self._logger.debug("node is already known: %s %s", mac_address, interface)
-                    break
+            if mac_address in self._mac_addresses:
+                self._logger.debug("node is already known: %s %s", mac_address, interface)
             else:
                 self._logger.info("found a new node: %s %s", mac_address, interface)
 
@@ -296,11 +490,23 @@ class Discovery:
                 if ip_address is None:
                     self._logger.error("no IP addresses available for interface %s", interface)
                 else:
-                    # Add the new node
-                    self._add_node(interface, mac_address, ip_address)
-
-                    # Increment the rank
-                    self._rank += 1                    
+                    # The network should alway be able to be found, since we found an IP in it
+                    network = self._get_network_for_interface_cache.get(interface)
+                    if network is None:
+                        self._logger.error("no network exists for interface %s", interface)
+                        return
+
+                    # Add the new node with the next batch, claiming it right away
+                    hostname, rack, rank = self._get_next_host()
+                    self._queue_node({
+                        'interface': interface,
+                        'mac_address': mac_address,
+                        'ip_address': ip_address,
+                        'network': network,
+                        'hostname': hostname,
+                        'rack': rack,
+                        'rank': rank
+                    })
         else:
             if "DHCPDISCOVER" in line:
                 self._logger.warning("DHCPDISCOVER found in line but didn't match regex:\n%s", line)
@@ -327,20 +533,34 @@ class Discovery:
             except ValueError as e:
                 self._logger.error("Invalid Apache log format: %s", line)
 
-    async def _monitor_log(self, log_path, process_line):
-        # Open our log file
-        with open(log_path, 'r') as log:
-            # Move to the end
-            log.seek(0, 2)
+    def _queue_lines(self, pattern, process_line):
+        """
+        Return a LogTail callback that queues up the lines containing PATTERN for PROCESS_LINE.
+        """
+
+        def queue_line(line):
+            if pattern in line:
+                self._queue.put_nowait((process_line, line))
+
+        return queue_line
 
-            # Start looking for new lines in the log file
+    async def _monitor_logs(self, kickstart_log):
+        # Follow the logs, new lines wake us up as soon as they are written
+        tail = LogTail(self._loop)
+        try:
+            tail.follow("/var/log/messages", self._queue_lines("DHCPDISCOVER", self._process_dhcp_line))
+            tail.follow(kickstart_log, self._queue_lines("profile.cgi", self._process_kickstart_line))
+
+            # Hand the lines to their handlers, until the signal handler wakes us up with None
             while not self._done:
-                line = log.readline()
-                
-                if line:
-                    process_line(line)
-                else:
-                    await asyncio.sleep(1)
+                event = await self._queue.get()
+                if event is None:
+                    break
+
+                process_line, line = event
+                process_line(line)
+        finally:
+            tail.close()
     
     def _cleanup(self):
         try:
@@ -350,6 +570,7 @@ class Discovery:
 
     def _signal_handler(self):
         self._done = True
+        self._queue.put_nowait(None)
     
     def _get_pid(self):
         pid = None
@@ -479,10 +700,12 @@ class Discovery:
             if os.fork() != 0:
                 return
             
-            # Close stdin, stdout, stderr of our daemon
-            os.close(0)
-            os.close(1)
-            os.close(2)
+            # Point stdin, stdout, stderr of our daemon at /dev/null, the
+            # commands we run in-process may still write to them
+            devnull = os.open(os.devnull, os.O_RDWR)
+            for fd in (0, 1, 2):
+                os.dup2(devnull, fd)
+            os.close(devnull)
             
             # Seperate ourselves from the parent process
             os.setsid()
@@ -499,6 +722,14 @@ class Discovery:
             self._command.db.database.connect()
             self._command.db.link = self._command.db.database.cursor()
 
+            # The database is shared by the log handlers and the batch thread
+            self._db_lock = threading.Lock()
+
+            # Index what is already in the database, the claims are the
+            # nodes we found that are still waiting to be added
+            self._claims = {}
+            self._build_index()
+
             # Open the message queue socket
             self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
@@ -511,23 +742,38 @@ class Discovery:
             # Get our coroutine event loop
             loop = asyncio.get_event_loop()
 
+            # Nodes are added by a single batch thread
+            self._loop = loop
+            self._executor = ThreadPoolExecutor(max_workers=1)
+            self._pending = []
+            self._flush_handle = None
+            self._batches = set()
+
+            # Read the index again every so often
+            self._refresh_handle = loop.call_later(self._INDEX_REFRESH, self._refresh_index)
+
+            # Lines from the logs waiting for their handler
+            self._queue = asyncio.Queue()
+
             # Setup signal handlers to cleanly stop
             loop.add_signal_handler(signal.SIGINT, self._signal_handler)
             loop.add_signal_handler(signal.SIGTERM, self._signal_handler)
+            loop.add_signal_handler(signal.SIGHUP, self._refresh_index)
 
             # Start our event loop
             status_code = 0
             self._done = False
             try:
-                loop.run_until_complete(asyncio.gather(
-                    self._monitor_log("/var/log/messages", self._process_dhcp_line),
-                    self._monitor_log(kickstart_log, self._process_kickstart_line)
-                ))
+                loop.run_until_complete(self._monitor_logs(kickstart_log))
+
+                # Finish adding the nodes we already found
+                loop.run_until_complete(self._wait_for_batches())
             except:
                 self._logger.exception("event loop threw an exception")
                 status_code = 1
             finally:
                 # All done, clean up
+                self._executor.shutdown()
                 loop.close()
                 self._command.db.database.close()
                 self._socket.close()
@@ -0,0 +1,320 @@
+# @copyright@
+# Copyright (c) 2006 - 2019 Teradata
+# All rights reserved. Stacki(r) v5.x stacki.com
+# https://github.com/Teradata/stacki/blob/master/LICENSE.txt
+# @copyright@
+
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import struct
+
+
+# From <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT = struct.Struct("iIII")
+
+
+class Inotify:
+    """
+    A bare bones wrapper around the Linux inotify calls in libc.
+    """
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path, mask):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+
+        return wd
+
+    def rm_watch(self, wd):
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self):
+        """
+        Return a list of (wd, mask, name) for the events that are waiting.
+        """
+
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0").decode(errors="replace")
+            offset += length
+
+            events.append((wd, mask, name))
+
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _Handle:
+    """
+    An open log file and any partial line read from the end of it.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.inode = os.fstat(file.fileno()).st_ino
+        self.buffer = b""
+        self.wd = None
+
+    def read(self, callback):
+        try:
+            # A file truncated in place (copytruncate) starts over
+            if os.fstat(self.file.fileno()).st_size < self.file.tell():
+                self.file.seek(0)
+                self.buffer = b""
+        except (OSError, ValueError):
+            return
+
+        while True:
+            data = self.file.read(64 * 1024)
+            if not data:
+                break
+
+            lines = (self.buffer + data).split(b"\n")
+            self.buffer = lines.pop()
+            for line in lines:
+                callback(line.decode(errors="replace") + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+class _Log:
+    """
+    A log file followed by name, the file currently at the path and the files it was
+    rotated away from, which are still read for a little while in case the writer
+    hasn't let go of them yet.
+    """
+
+    def __init__(self, tail, path, callback):
+        self.tail = tail
+        self.path = path
+        self.directory, self.name = os.path.split(os.path.abspath(path))
+        self.callback = callback
+        self.current = None
+        self.rotated = []
+
+    def open(self, at_end=False):
+        try:
+            handle = _Handle(open(self.path, "rb"))
+        except OSError:
+            return False
+
+        if at_end:
+            handle.file.seek(0, 2)
+
+        if self.current is not None:
+            self.tail._later(self.tail.linger, self._expire, self.current)
+            self.rotated.append(self.current)
+
+        self.current = handle
+        self.tail._watch_file(handle, self.read)
+
+        return True
+
+    def read(self):
+        for handle in self.rotated:
+            handle.read(self.callback)
+
+        if self.current is not None:
+            self.current.read(self.callback)
+
+    def check(self):
+        """
+        Read anything new, then switch to a new file if the path was
+        rotated (renamed, removed and recreated) out from under us.
+        """
+
+        self.read()
+
+        try:
+            inode = os.stat(self.path).st_ino
+        except OSError:
+            # Keep the old file until the new one shows up
+            return
+
+        if self.current is None or self.current.inode != inode:
+            if self.open():
+                self.current.read(self.callback)
+
+    def _expire(self, handle):
+        if handle in self.rotated:
+            handle.read(self.callback)
+            self.rotated.remove(handle)
+            self.tail._unwatch_file(handle)
+            handle.close()
+
+    def close(self):
+        for handle in self.rotated + [self.current]:
+            if handle is not None:
+                self.tail._unwatch_file(handle)
+                handle.close()
+
+        self.rotated = []
+        self.current = None
+
+
+class LogTail:
+    """
+    Follow log files the way tail -F does, calling back with every complete line
+    as soon as it is written.
+
+    Linux inotify wakes us up when a file changes so there is no polling delay.
+    Files truncated in place start over from the top, and files renamed or removed
+    by logrotate are followed to the new file at the same path, reading what was
+    left of the old file first. Without inotify the files are polled every
+    *interval* seconds instead.
+    """
+
+    # Seconds a rotated file is still read after the new one shows up
+    linger = 10.0
+
+    def __init__(self, loop=None, interval=1.0):
+        self._loop = loop or asyncio.get_event_loop()
+        self._interval = interval
+        self._logs = []
+        self._watches = {}
+        self._directories = {}
+        self._timers = []
+        self._poller = None
+
+        try:
+            self._inotify = Inotify()
+        except (OSError, AttributeError):
+            # No inotify (or no libc with it), fall back to polling
+            self._inotify = None
+
+        if self._inotify is not None:
+            self._loop.add_reader(self._inotify.fd, self._read_events)
+        else:
+            self._poller = self._loop.create_task(self._poll())
+
+    @property
+    def inotify(self):
+        "True if the files are followed with inotify rather than polling."
+
+        return self._inotify is not None
+
+    def follow(self, path, callback, at_end=True):
+        """
+        Start following the log file at PATH, calling CALLBACK with each new line.
+        Only lines written from now on are seen, unless AT_END is False. The file
+        doesn't have to exist yet.
+        """
+
+        log = _Log(self, path, callback)
+        self._logs.append(log)
+
+        if self._inotify is not None and log.directory not in self._directories:
+            wd = self._inotify.add_watch(
+                log.directory,
+                IN_CREATE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE | IN_ONLYDIR
+            )
+            self._directories[log.directory] = wd
+            self._watches[wd] = self._directory_changed(log.directory)
+
+        log.open(at_end)
+
+        return log
+
+    def close(self):
+        "Stop following all the log files."
+
+        for timer in self._timers:
+            timer.cancel()
+        self._timers = []
+
+        for log in self._logs:
+            log.close()
+        self._logs = []
+
+        if self._inotify is not None:
+            self._loop.remove_reader(self._inotify.fd)
+            self._inotify.close()
+            self._inotify = None
+
+        if self._poller is not None:
+            self._poller.cancel()
+            self._poller = None
+
+    def _later(self, delay, function, *args):
+        self._timers.append(self._loop.call_later(delay, function, *args))
+
+    def _watch_file(self, handle, read):
+        if self._inotify is None:
+            return
+
+        # Watch the file we have open, not whatever is at its path by now
+        try:
+            handle.wd = self._inotify.add_watch(
+                f"/proc/self/fd/{handle.file.fileno()}",
+                IN_MODIFY | IN_DELETE_SELF
+            )
+        except OSError:
+            return
+
+        self._watches[handle.wd] = lambda mask, name: read()
+
+    def _unwatch_file(self, handle):
+        if handle.wd is not None and self._watches.pop(handle.wd, None) is not None:
+            if self._inotify is not None:
+                self._inotify.rm_watch(handle.wd)
+        handle.wd = None
+
+    def _directory_changed(self, directory):
+        def changed(mask, name):
+            for log in self._logs:
+                if log.directory == directory and log.name == name:
+                    log.check()
+
+        return changed
+
+    def _read_events(self):
+        for wd, mask, name in self._inotify.read():
+            if mask & IN_Q_OVERFLOW:
+                # We missed some events, so look at everything
+                for log in self._logs:
+                    log.check()
+            elif mask & IN_IGNORED:
+                # The kernel dropped the watch (file removed)
+                self._watches.pop(wd, None)
+            elif wd in self._watches:
+                self._watches[wd](mask, name)
+
+    async def _poll(self):
+        while True:
+            for log in self._logs:
+                log.check()
+
+            await asyncio.sleep(self._interval)
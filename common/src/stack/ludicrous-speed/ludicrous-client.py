@@ -4,8 +4,14 @@ from flask import Flask, request, jsonify, send_from_directory, render_template,
 from urllib.request import unquote
 import os
 import requests
+from requests.adapters import HTTPAdapter
 import hashlib
-import subprocess
+import tempfile
+import threading
+import gzip
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree
 import click
 import logging
 from logging import FileHandler
@@ -29,6 +35,30 @@ client_settings = {
 
 timed_out_hosts = []
 
+# One pooled session (keep-alive connections) per peer, shared by
+# the request threads.
+sessions = {}
+sessions_lock = threading.Lock()
+
+# Bodies are written to disk in chunks of this many bytes
+CHUNK_SIZE = 1024 * 1024
+
+# Packages are split into byte ranges of this many bytes, fetched from
+# up to MAX_STREAMS peers at once
+RANGE_SIZE = 8 * 1024 * 1024
+MAX_STREAMS = 4
+
+# Checksums from the repodata of every repository, by repository root
+repodata = {}
+repodata_lock = threading.Lock()
+
+REPO_NS = '{http://linux.duke.edu/metadata/repo}'
+COMMON_NS = '{http://linux.duke.edu/metadata/common}'
+
+
+class ChecksumError(Exception):
+	pass
+
 
 @app.errorhandler(404)
 def four_o_four(error=None):
@@ -49,16 +79,189 @@ def hashit(filename):
 	hashcode.update(filename.encode('utf-8'))
 	return hashcode.hexdigest()
 
-# Save the file locally
-def save_file(content, location, filename):
+# Returns the pooled session for a host
+def session(host):
+	with sessions_lock:
+		if host not in sessions:
+			s = requests.Session()
+			adapter = HTTPAdapter(pool_connections=1, pool_maxsize=32)
+			s.mount('http://', adapter)
+			sessions[host] = s
+		return sessions[host]
+
+# Returns a new hashlib object for a repodata checksum type
+def new_hash(checksum_type):
+	return hashlib.new('sha1' if checksum_type == 'sha' else checksum_type)
+
+# Save the body of a streamed response locally. The body goes to a
+# hidden temporary file next to the real one a chunk at a time and is
+# renamed into place once it is complete, so a partial file is never
+# served.
+# Returns False, and nothing is saved, if the file doesn't match the
+# EXPECTED (checksum type, checksum, size) from the repodata.
+def save_file(res, location, filename, expected=None):
 	try:
-		subprocess.call(['mkdir', '-p', location])
-		with open(location + filename, 'wb') as f:
-			f.write(content)
+		os.makedirs(location, exist_ok=True)
+		fd, temp = tempfile.mkstemp(prefix='.%s.' % filename, dir=location)
 	except:
 		app.logger.info("save_file: Error saving file")
 		raise
 
+	try:
+		digest = new_hash(expected[0]) if expected else None
+		size = 0
+		with os.fdopen(fd, 'wb') as f:
+			for chunk in res.iter_content(CHUNK_SIZE):
+				f.write(chunk)
+				size += len(chunk)
+				if digest:
+					digest.update(chunk)
+		if expected and (digest.hexdigest(), size) != (expected[1], expected[2]):
+			os.unlink(temp)
+			return False
+		os.chmod(temp, 0o644)
+		os.replace(temp, location + filename)
+	except:
+		app.logger.info("save_file: Error saving file")
+		os.unlink(temp)
+		raise
+
+	return True
+
+# Read the package checksums and sizes out of the repodata of a
+# repository, returns a dictionary of location to
+# (checksum type, checksum, size)
+def read_repodata(root):
+	repomd = ElementTree.parse('%s/repodata/repomd.xml' % root)
+	packages = {}
+	for data in repomd.getroot().iter('%sdata' % REPO_NS):
+		if data.get('type') != 'primary':
+			continue
+		primary = '%s/%s' % (root, data.find('%slocation' % REPO_NS).get('href'))
+		opener = gzip.open if primary.endswith('.gz') else open
+		with opener(primary, 'rb') as f:
+			for event, element in ElementTree.iterparse(f):
+				if element.tag != '%spackage' % COMMON_NS:
+					continue
+				checksum = element.find('%schecksum' % COMMON_NS)
+				location = element.find('%slocation' % COMMON_NS)
+				size = element.find('%ssize' % COMMON_NS)
+				if checksum is not None and location is not None and size is not None:
+					packages[location.get('href')] = (checksum.get('type'),
+									   checksum.text.strip(),
+									   int(size.get('package')))
+				element.clear()
+	return packages
+
+# Find the repodata checksum for a file under /install, using the
+# repodata the installer already pulled through us. Returns
+# (checksum type, checksum, size) or None if the file isn't a package
+# in a repository we know about.
+def repodata_checksum(remote_file):
+	save_location = client_settings['LOCAL_SAVE_LOCATION']
+	directory = os.path.dirname('%s%s' % (save_location, remote_file))
+	top = '%s/install' % save_location
+
+	while directory.startswith(top):
+		repomd = '%s/repodata/repomd.xml' % directory
+		if os.path.isfile(repomd):
+			mtime = os.path.getmtime(repomd)
+			with repodata_lock:
+				cached = repodata.get(directory)
+				if not cached or cached[0] != mtime:
+					try:
+						cached = (mtime, read_repodata(directory))
+					except:
+						# Not cached, the primary metadata may
+						# not have been pulled through us yet
+						app.logger.info("repodata_checksum: Error reading %s", repomd)
+						return None
+					repodata[directory] = cached
+			href = os.path.relpath('%s%s' % (save_location, remote_file), directory)
+			return cached[1].get(href)
+		directory = os.path.dirname(directory)
+
+	return None
+
+# Get a file that is EXPECTED (checksum type, checksum, size) to be
+# in the repodata from several peers at once. The file is split into
+# byte ranges handed out to the peers, a range that fails on one peer
+# is retried on another one and then on the frontend. The file is only
+# put in place once its checksum matches.
+# Returns the peers that failed.
+def get_file_ranges(peers, remote_file, location, filename, expected):
+	checksum_type, checksum, size = expected
+	frontend = tracker_settings['TRACKER']
+	ranges = collections.deque([ (start, min(start + RANGE_SIZE, size) - 1, frozenset())
+				     for start in range(0, size, RANGE_SIZE) ])
+	failed = set()
+	lock = threading.Lock()
+
+	os.makedirs(location, exist_ok=True)
+	fd, temp = tempfile.mkstemp(prefix='.%s.' % filename, dir=location)
+
+	def fetch(source, start, end):
+		headers = { 'Range': 'bytes=%d-%d' % (start, end) }
+		with session(source).get('http://%s%s' % (source, remote_file), headers=headers,
+					 timeout=(0.1, 5), stream=True) as res:
+			whole = res.status_code == 200 and (start, end) == (0, size - 1)
+			if res.status_code != 206 and not whole:
+				raise ValueError('status %d' % res.status_code)
+			offset = start
+			for chunk in res.iter_content(CHUNK_SIZE):
+				if offset + len(chunk) > end + 1:
+					raise ValueError('range too long')
+				os.pwrite(fd, chunk, offset)
+				offset += len(chunk)
+			if offset != end + 1:
+				raise ValueError('range too short')
+
+	def worker(index):
+		while True:
+			with lock:
+				if not ranges:
+					return
+				start, end, tried = ranges.popleft()
+				candidates = [ peer for peer in peers
+					       if peer not in failed and peer not in tried ]
+			source = candidates[index % len(candidates)] if candidates else frontend
+			try:
+				fetch(source, start, end)
+			except:
+				if source == frontend:
+					raise
+				app.logger.info("  %s bytes %d-%d from %s was unsuccessful",
+						filename, start, end, source)
+				with lock:
+					failed.add(source)
+					ranges.append((start, end, tried | { source }))
+
+	try:
+		os.ftruncate(fd, size)
+		streams = max(1, min(MAX_STREAMS, len(peers), len(ranges)))
+		with ThreadPoolExecutor(max_workers=streams) as executor:
+			for result in [ executor.submit(worker, i) for i in range(streams) ]:
+				result.result()
+
+		digest = new_hash(checksum_type)
+		with open(temp, 'rb') as f:
+			for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+				digest.update(chunk)
+		if digest.hexdigest() != checksum:
+			# No telling which range was bad
+			failed.update(peers)
+			raise ChecksumError('%s checksum mismatch' % filename)
+
+		os.chmod(temp, 0o644)
+		os.replace(temp, location + filename)
+	except:
+		os.unlink(temp)
+		raise
+	finally:
+		os.close(fd)
+
+	return failed
+
 # Check if the file exists locally
 def file_exists(local_file):
 	return os.path.isfile(local_file)
@@ -74,19 +277,22 @@ def tracker():
 def lookup_file(hashcode):
 	try:
 		# timeout=(connect timeout, read timeout).
-		res = requests.get('http://%s/ludicrous/lookup/%s' % (tracker(), hashcode), timeout=(0.1, 5))
+		res = session(tracker()).get('http://%s/ludicrous/lookup/%s' % (tracker(), hashcode), timeout=(0.1, 5))
 		return res
 	except:
 		raise
 
-# Get a file from a host
-def get_file(peer, remote_file):
+# Get a file from a host and save it locally
+# Returns the status code, or None if the host couldn't be reached
+def get_file(peer, remote_file, location, filename):
 	_counter = 0
 	while _counter < 3:
 		try:
 			# timeout=(connect timeout, read timeout).
-			res = requests.get('http://%s%s' % (peer, remote_file), timeout=(0.1, 5))
-			return res
+			with session(peer).get('http://%s%s' % (peer, remote_file), timeout=(0.1, 5), stream=True) as res:
+				if res.status_code == 200:
+					save_file(res, location, filename)
+				return res.status_code
 		except requests.ConnectTimeout:
 			app.logger.debug('get_file: Connect Timeout. Retrying.')
 		except requests.ConnectionError:
@@ -102,7 +308,7 @@ def register_file(port, hashcode):
 	_counter = 0
 	while _counter < 3:
 		try:
-			res = requests.post('http://%s/ludicrous/register/%s/%s' % (
+			res = session(tracker()).post('http://%s/ludicrous/register/%s/%s' % (
 									tracker(),
 									port,
 									hashcode)
@@ -122,7 +328,7 @@ def unregister_file(hashcode, params):
 	_counter = 0
 	while _counter < 3:
 		try:
-			res = requests.delete('http://%s/ludicrous/unregister/hashcode/%s' % (
+			res = session(tracker()).delete('http://%s/ludicrous/unregister/hashcode/%s' % (
 									tracker(),
 									hashcode),
 									params=params
@@ -142,7 +348,7 @@ def unregister_host(host):
 	_counter = 0
 	while _counter < 3:
 		try:
-			res = requests.delete('http://%s/ludicrous/unregister/host/%s' % (tracker(), host), timeout=(0.1, 5))
+			res = session(tracker()).delete('http://%s/ludicrous/unregister/host/%s' % (tracker(), host), timeout=(0.1, 5))
 			break
 		except requests.ConnectTimeout:
 			app.logger.debug('unregister_host: Connect Timeout. Retrying.')
@@ -180,15 +386,36 @@ def get_file_locally(path, filename):
 		except:
 			successful = False
 
+		expected = repodata_checksum(remote_file)
+		peers = []
 		if successful and payload['peers']:
-			peers = set(payload['peers'])
-			for peer in peers.difference(timed_out_hosts):
+			peers = list(set(payload['peers']).difference(timed_out_hosts))
+
+		if peers and expected:
+			app.logger.info("requesting file: %s from peers: %s", filename, ', '.join(peers))
+			failed = set()
+			try:
+				failed = get_file_ranges(peers, remote_file, '%s/' % (file_location), filename, expected)
+				app.logger.info("  %s from peers was successful", filename)
+				register_file(port, hashcode)
+			except ChecksumError:
+				app.logger.info("  %s from peers failed the checksum", filename)
+				failed = set(peers)
+			except:
+				app.logger.info("  %s from peers was unsuccessful", filename)
+
+			for peer in failed:
+				unregister_params = params.copy()
+				unregister_params["peer"] = peer.split(":")[0]
+				unregister_file(hashcode, unregister_params)
+
+		elif peers:
+			for peer in peers:
 				peer_ip = peer.split(":")[0]
 				app.logger.info("requesting file: %s from peer: %s", filename, peer)
 				try:
-					peer_res = get_file(peer, remote_file)
-					if peer_res.status_code == 200:
-						save_file(peer_res.content, '%s/' % (file_location), filename)
+					status_code = get_file(peer, remote_file, '%s/' % (file_location), filename)
+					if status_code == 200:
 						app.logger.info("  %s from %s was successful", filename, peer)
 						register_file(port, hashcode)
 						break
@@ -211,11 +438,16 @@ def get_file_locally(path, filename):
 			app.logger.info("requesting %s from frontend", filename)
 			try:
 				# timeout=(connect timeout, read timeout).
-				tracker_res = requests.get('http://%s%s' % (tracker_settings['TRACKER'], remote_file), timeout=(0.1, 5))
-				if tracker_res.status_code == 200:
-					save_file(tracker_res.content, '%s/' % (file_location), filename)
-					if client_settings['SAVE_FILES']:
-						register_file(port, hashcode)
+				frontend = tracker_settings['TRACKER']
+				with session(frontend).get('http://%s%s' % (frontend, remote_file), timeout=(0.1, 5), stream=True) as tracker_res:
+					if tracker_res.status_code == 200:
+						expected = repodata_checksum(remote_file)
+						if not save_file(tracker_res, '%s/' % (file_location), filename, expected):
+							# Nothing was saved, the installer is sent
+							# to the frontend for it below.
+							app.logger.info("%s from frontend doesn't match the repodata", filename)
+						elif client_settings['SAVE_FILES']:
+							register_file(port, hashcode)
 				break
 			except requests.ConnectTimeout:
 				app.logger.debug('Frontend Request: Connect Timeout. Retrying.')
@@ -267,7 +499,7 @@ def running():
 
 @app.route('/peerdone')
 def peerdone():
-	peerdone_res = requests.delete('http://%s/ludicrous/peerdone' % tracker())
+	peerdone_res = session(tracker()).delete('http://%s/ludicrous/peerdone' % tracker())
 	return jsonify({"success": True})
 
 
@@ -0,0 +1,107 @@
+#!/opt/stack/bin/python3
+#
+# @copyright@
+# Copyright (c) 2006 - 2019 Teradata
+# All rights reserved. Stacki(r) v5.x stacki.com
+# https://github.com/Teradata/stacki/blob/master/LICENSE.txt
+# @copyright@
+
+"""
+Load generator for the ludicrous tracker.
+
+Seeds a local Redis database with PEERS peers sharing HASHES package
+hashes, then drives the tracker's lookup, register, and peerdone
+routes in-process (through the Flask test client, so only the tracker
+and Redis are measured) and prints their latency.
+
+Use a Redis database other than the tracker's (db 0), it is flushed.
+"""
+
+import os
+import sys
+import time
+import random
+import hashlib
+import click
+import redis
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, '/opt/stack/bin')
+
+import ludicrousServer
+
+
+def percentiles(samples):
+	samples = sorted(samples)
+	pick = lambda p: samples[min(len(samples) - 1, int(len(samples) * p))] * 1000
+	return 'n=%-6d p50 %.3fms  p90 %.3fms  p99 %.3fms  max %.3fms' % (
+		len(samples), pick(0.5), pick(0.9), pick(0.99), samples[-1] * 1000)
+
+
+def timed(client, method, url, ipaddr):
+	start = time.perf_counter()
+	res = getattr(client, method)(url, environ_base={ 'REMOTE_ADDR': ipaddr })
+	elapsed = time.perf_counter() - start
+	if res.status_code != 200:
+		raise click.ClickException('%s %s returned %d' % (method.upper(), url, res.status_code))
+	return elapsed
+
+
+@click.command()
+@click.option('--hashes', default=100000, help='package hashes to seed')
+@click.option('--peers', default=200, help='peers to seed')
+@click.option('--replicas', default=3, help='peers registered for each hash')
+@click.option('--lookups', default=10000, help='lookups to time')
+@click.option('--registers', default=1000, help='registers to time')
+@click.option('--done', default=50, help='peers to time peerdone for')
+@click.option('--db', default=15, help='Redis database to use (flushed)')
+def main(hashes, peers, replicas, lookups, registers, done, db):
+	if db == 0:
+		raise click.ClickException('refusing to flush the tracker database')
+
+	ludicredis = redis.StrictRedis(db=db)
+	ludicredis.flushdb()
+	ludicrousServer.ludicredis = ludicredis
+
+	hashcodes = [ hashlib.md5(b'/install/pallets/package-%d.rpm' % i).hexdigest()
+		      for i in range(hashes) ]
+	addresses = [ '10.%d.%d.%d' % (i // 65536, (i // 256) % 256, i % 256 + 1)
+		      for i in range(peers) ]
+
+	# Seed with the same keys the register route writes, in bulk
+	start  = time.time()
+	expire = time.time() + ludicrousServer.PEER_TTL
+	pipe   = ludicredis.pipeline(transaction=False)
+	for i, hashcode in enumerate(hashcodes):
+		for ipaddr in random.sample(addresses, min(replicas, peers)):
+			pipe.zadd(ludicrousServer.file_key(hashcode), { ipaddr: expire })
+			pipe.sadd(ludicrousServer.files_key(ipaddr), hashcode)
+		if i % 1000 == 999:
+			pipe.execute()
+	for ipaddr in addresses:
+		pipe.set(ludicrousServer.port_key(ipaddr), 80)
+	pipe.execute()
+	print('seeded %d hashes x %d replicas over %d peers in %.1fs (%d keys)' %
+	      (hashes, replicas, peers, time.time() - start, ludicredis.dbsize()))
+
+	client = ludicrousServer.app.test_client()
+
+	samples = [ timed(client, 'get', '/lookup/%s' % random.choice(hashcodes),
+			  random.choice(addresses))
+		    for i in range(lookups) ]
+	print('lookup    %s' % percentiles(samples))
+
+	samples = [ timed(client, 'post', '/register/80/%s' % random.choice(hashcodes),
+			  random.choice(addresses))
+		    for i in range(registers) ]
+	print('register  %s' % percentiles(samples))
+
+	samples = [ timed(client, 'delete', '/peerdone', ipaddr)
+		    for ipaddr in random.sample(addresses, min(done, peers)) ]
+	print('peerdone  %s' % percentiles(samples))
+
+	ludicredis.flushdb()
+
+
+if __name__ == "__main__":
+	main()
@@ -2,22 +2,95 @@
 
 from flask import Flask, request, jsonify, send_from_directory, render_template, redirect
 from urllib.request import unquote
-from random import shuffle, randint
+from random import random
 import os
+import time
+import queue
+import socket
+import threading
 import logging
 from logging import FileHandler
 import redis
-import stack.api
+import stack.mq
 
 ludicredis = redis.StrictRedis()
 
 app = Flask(__name__)
 
-PEERS = set()
-
 MAX_PEERS = 3
 ROOT_DIR = "/var/www/html"
 
+# A peer's registrations expire unless it registers again within this
+# many seconds
+PEER_TTL = 6 * 60 * 60
+
+# Peers handed out by a lookup count against their load for this many
+# seconds, the least loaded peers are handed out first
+LOAD_WINDOW = 60
+
+# At most one install progress message per host in this many seconds
+MESSAGE_INTERVAL = 60
+
+# Redis keys
+#
+#   ludicrous:file:HASH		sorted set of peer IPs that have the file,
+#				scored by when the registration expires
+#   ludicrous:peer:IP:files	set of file hashes the peer registered
+#   ludicrous:peer:IP:port	port the peer serves files on
+#   ludicrous:peer:IP:load	lookups that handed out the peer lately
+
+def file_key(hashcode):
+	return 'ludicrous:file:%s' % hashcode
+
+def files_key(ipaddr):
+	return 'ludicrous:peer:%s:files' % ipaddr
+
+def port_key(ipaddr):
+	return 'ludicrous:peer:%s:port' % ipaddr
+
+def load_key(ipaddr):
+	return 'ludicrous:peer:%s:load' % ipaddr
+
+
+class Reporter(threading.Thread):
+	"""
+	Sends the install progress messages from a background thread so
+	lookups never wait on them.  Messages are dropped rather than
+	queued up when the thread falls behind.
+	"""
+
+	def __init__(self):
+		super().__init__(daemon=True)
+		self.queue = queue.Queue(maxsize=1024)
+		self.last = {}
+		self.lock = threading.Lock()
+
+	def report(self, ipaddr):
+		now = time.time()
+		with self.lock:
+			if now - self.last.get(ipaddr, 0) < MESSAGE_INTERVAL:
+				return
+			self.last[ipaddr] = now
+
+		try:
+			self.queue.put_nowait(ipaddr)
+		except queue.Full:
+			pass
+
+	def run(self):
+		tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		while True:
+			ipaddr = self.queue.get()
+			msg = stack.mq.Message('{"state": "install download"}',
+					       channel='health', ttl=3600, source=ipaddr)
+			try:
+				tx.sendto(str(msg).encode(), ('localhost', stack.mq.ports.publish))
+			except OSError:
+				pass
+
+reporter = Reporter()
+reporter.start()
+
 
 @app.errorhandler(404)
 def four_o_four(error=None):
@@ -38,32 +111,41 @@ def lookup(hashcode):
 	res = {}
 	res['success'] = True
 	ipaddr = request.remote_addr
+	now = time.time()
 
-	if randint(0, 100) < 10:
-		# throttle the flood of message to only X% of package installs,
-		# not looking for detail just want to know what stage we are in
-		stack.api.Call('add.host.message', [ 'localhost', 
-						     'channel=health',
-						     'ttl=3600',
-						     'message={"state": "install download"}',
-						     'source=%s' % ipaddr ])
+	# not looking for detail just want to know what stage we are in
+	reporter.report(ipaddr)
+
+	# peers with the request hash, whose registration hasn't expired
+	pipe = ludicredis.pipeline(transaction=False)
+	pipe.zremrangebyscore(file_key(hashcode), '-inf', now)
+	pipe.zrange(file_key(hashcode), 0, -1)
+	peers = [ peer.decode() for peer in pipe.execute()[1] ]
+
+	# only hand out peers that are not the requester
+	peers = [ peer for peer in peers if peer != ipaddr ]
 
-	# return list of peers with the request hash
 	res['peers'] = []
-	peers = list(ludicredis.smembers("ludicrous:%s" % hashcode))
-	shuffle(peers)
-	for peer in peers:
-		# only append a peer if it is not the requester
-		if ipaddr not in peer.decode():
-                        peer_port = ludicredis.smembers('%s:PORT' % ipaddr)
-                        if peer_port:
-                                res['peers'].append("%s:%s" % (peer.decode(), peer_port.pop().decode()))
-                        else:
-                                res['peers'].append("%s:%s" % (peer.decode(), '80'))		
-
-		# if array of peers is max_peers, break
-		if len(res['peers']) == MAX_PEERS:
-			break
+	if peers:
+		for peer in peers:
+			pipe.get(load_key(peer))
+			pipe.get(port_key(peer))
+		values = pipe.execute()
+
+		# the least loaded peers first, ties broken at random
+		load = {}
+		port = {}
+		for i, peer in enumerate(peers):
+			load[peer] = int(values[i * 2] or 0)
+			port[peer] = (values[i * 2 + 1] or b'80').decode()
+		peers.sort(key=lambda peer: (load[peer], random()))
+		peers = peers[:MAX_PEERS]
+
+		for peer in peers:
+			pipe.incr(load_key(peer))
+			pipe.expire(load_key(peer), LOAD_WINDOW)
+			res['peers'].append("%s:%s" % (peer, port[peer]))
+		pipe.execute()
 
 	return jsonify(res)
 
@@ -77,14 +159,15 @@ def register(port=80, hashcode=None):
 	if not hashcode:
 		return four_o_four()
 
-	# check if 
-	if ipaddr not in PEERS:
-		if not ludicredis.smembers("%s:PORT" % ipaddr):
-			ludicredis.sadd("%s:PORT" % ipaddr, "%s" % port)
-			PEERS.add(ipaddr)
-
-	# Register Package
-	ludicredis.sadd("ludicrous:%s" % hashcode, "%s" % ipaddr)
+	# Register Package, and the package with the peer so it can be
+	# unregistered without looking at every package
+	pipe = ludicredis.pipeline(transaction=False)
+	pipe.zadd(file_key(hashcode), { ipaddr: time.time() + PEER_TTL })
+	pipe.expire(file_key(hashcode), PEER_TTL)
+	pipe.sadd(files_key(ipaddr), hashcode)
+	pipe.expire(files_key(ipaddr), PEER_TTL)
+	pipe.set(port_key(ipaddr), port, ex=PEER_TTL)
+	pipe.execute()
 
 	return jsonify(res)
 
@@ -95,7 +178,10 @@ def unregister(hashcode):
 	res = {}
 	res['success'] = True
 
-	result = ludicredis.srem("ludicrous:%s" % hashcode, ipaddr)
+	pipe = ludicredis.pipeline(transaction=False)
+	pipe.zrem(file_key(hashcode), ipaddr)
+	pipe.srem(files_key(ipaddr), hashcode)
+	result = pipe.execute()[0]
 	if result:
 		res['message'] = "'%s' was unregistered for hash: %s" % (ipaddr, hashcode)
 	else:
@@ -109,12 +195,13 @@ def peerdone():
 	res = {}
 	res['success'] = True
 
-	for package in ludicredis.scan_iter():
-		try:
-			ludicredis.srem(package, ipaddr)
-		except:
-			pass	
-		
+	# only the packages this peer registered
+	pipe = ludicredis.pipeline(transaction=False)
+	for hashcode in ludicredis.smembers(files_key(ipaddr)):
+		pipe.zrem(file_key(hashcode.decode()), ipaddr)
+	pipe.delete(files_key(ipaddr), port_key(ipaddr), load_key(ipaddr))
+	pipe.execute()
+
 	return jsonify(res)
 
 @app.route('/status', methods=['GET'])
@@ -129,10 +216,9 @@ def purge_packages():
 	res['sucess'] = True
 	is_from_frontend = request.remote_addr == "127.0.0.1"
 	if is_from_frontend:
-		for package in ludicredis.scan_iter():
+		for package in ludicredis.scan_iter(match='ludicrous:*', count=1000):
 			try:
-				if 'ludicrous' in package.decode():
-					result = ludicredis.delete(package)
+				result = ludicredis.delete(package)
 			except:
 				pass
 	else:
@@ -15,7 +15,7 @@ import zmq
 try:
 	opt, args = getopt.getopt(sys.argv[1:], 'c:H:',['command','host'])
 except getopt.GetoptError:
-	print('usage: [ -c enable | disable | status ] [ -H host ] {channel}')
+	print('usage: [ -c enable | disable | status | counters ] [ -H host ] {channel}')
 	sys.exit(-1)
 
 control = 'smq'
@@ -12,6 +12,7 @@ import daemon
 import lockfile.pidlockfile
 import signal
 import time
+import threading
 import zmq
 import stack.mq
 
@@ -22,15 +23,23 @@ class Publisher(stack.mq.Receiver):
 		stack.mq.Receiver.__init__(self)
 
 		self.channels = {}
+		self.lock = threading.Lock()
 		self.pub = context.socket(zmq.PUB)
 		self.pub.bind('tcp://*:%d' % outPort)
 
 
 	def callback(self, message):
 		"""
-		Process incomming messages from the UDP receiver.
+		Process incomming messages from the UDP receiver and the
+		Collector.
+		"""
+		with self.lock:
+			self.publish(message)
+
+	def track(self, channel, timestamp):
+		"""
+		Returns the number of the next message on the channel.
 		"""
-		channel = message.getChannel()
 
 		# For each channel keep track of the last message
 		# ID and timestamp.
@@ -43,20 +52,53 @@ class Publisher(stack.mq.Receiver):
 		else:
 			self.channels[channel] = {}
 			num = 0
+		self.channels[channel]['id']   = num
+		self.channels[channel]['time'] = timestamp
+
+		return num
+
+	def publish(self, message, hop=True):
+		channel = message.getChannel()
+		num	= self.track(channel, message.getTime())
 		message.setID(num)
-		self.channels[channel]['id']   = message.getID()
-		self.channels[channel]['time'] = message.getTime()
 
 		# Publish the message:
 		#
 		# <channel> stack.mq.Message
 		#   text	json
 
-		message.addHop().setChannel(None)
+		if hop:
+			message.addHop()
+		message.setChannel(None)
 
 		if 'STACKDEBUG' in os.environ:
 			print(channel, message)
 		self.pub.send_multipart((channel.encode(), str(message).encode()))
+		self.status(num)
+
+	def forward(self, channel, body, hops, source):
+		"""
+		Publishes a message from a shipper frame.  The body is sent
+		as it was received (keeping the ID the shipping host gave
+		it) unless the hops or source have to change.
+		"""
+		if stack.mq.Frame.needsDecode(body, hops, source):
+			message = stack.mq.Frame.decode(channel, body, hops, source)
+			if not message.getTime():
+				message.setTime(time.asctime())
+			with self.lock:
+				self.publish(message, hop=False)
+			return
+
+		name = channel.decode()
+		with self.lock:
+			num = self.track(name, time.asctime())
+			if 'STACKDEBUG' in os.environ:
+				print(name, body.decode(errors='replace'))
+			self.pub.send_multipart((channel, body))
+			self.status(num)
+
+	def status(self, num):
 
 		# If this is the first message for the given channel 
 		# send the list of channels over the smq channel to
@@ -74,6 +116,34 @@ class Publisher(stack.mq.Receiver):
 			self.pub.send_multipart(('smq'.encode(), str(message).encode()))
 
 
+class Collector(threading.Thread):
+	"""
+	Receives batched frames from the shippers and hands every message
+	to the publisher.
+	"""
+
+	def __init__(self, context, publisher, port):
+		threading.Thread.__init__(self)
+
+		self.publisher = publisher
+		self.pull = context.socket(zmq.PULL)
+		self.pull.setsockopt(zmq.RCVHWM, 1000)
+		self.pull.bind('tcp://*:%d' % port)
+
+	def run(self):
+		while True:
+			try:
+				source, records = stack.mq.Frame.unpack(self.pull.recv())
+			except (ValueError, UnicodeDecodeError):
+				continue   # drop bad frame
+
+			for (channel, body, hops) in records:
+				try:
+					self.publisher.forward(channel, body, hops, source)
+				except (ValueError, UnicodeDecodeError):
+					pass   # drop bad message
+
+
 def Handler(signal, frame):
 	sys.exit(0)
 
@@ -85,9 +155,12 @@ if 'STACKDEBUG' not in os.environ:
 
 context   = zmq.Context()
 publisher = Publisher(context, stack.mq.ports.subscribe)
+collector = Collector(context, publisher, stack.mq.ports.forward)
 publisher.setDaemon(True)
+collector.setDaemon(True)
 
 publisher.start()
+collector.start()
 
 signal.signal(signal.SIGINT, Handler)
 signal.pause()
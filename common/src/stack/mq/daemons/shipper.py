@@ -8,6 +8,7 @@
 
 import os
 import sys
+import time
 import socket
 import threading
 import signal
@@ -26,24 +27,109 @@ class Subscriber(stack.mq.Subscriber):
 		stack.mq.Subscriber.__init__(self, context)
 
 		self.channels = {}
+		self.counters = stack.mq.Counters()
 		self.tx  = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 		self.dst = (addr, stack.mq.ports.publish)
 
+	def status(self, message):
+		smq = message.getPayload()
+		try:
+			r = json.loads(smq)
+			if r['type'] == 'status':
+				self.channels = r['channels']
+		except:
+			pass
+
 	def callback(self, message):
 		if message.getChannel() == 'smq':
-			smq = message.getPayload()
-			try:
-				r = json.loads(smq)
-				if r['type'] == 'status':
-					self.channels = r['channels']
-			except:
-				pass
+			self.status(message)
 		else:
+			channel = message.getChannel()
 			message.addHop()
 			try:
 				self.tx.sendto(str(message).encode(), self.dst)
+				self.counters.add(channel, 'sent')
 			except: # ignore failed sends
-				pass
+				self.counters.add(channel, 'dropped')
+
+
+class Shipper(Subscriber):
+	"""
+	Ships messages to the frontend in batched frames over a zmq PUSH
+	socket instead of one UDP datagram per message.  Messages are
+	forwarded as received from the local publisher, they are never
+	decoded.  A frame is sent every *interval* seconds or once it
+	holds *batch* messages.  If the frontend falls behind the high
+	water mark is reached and frames are dropped (and counted)
+	rather than queued without bound.
+	"""
+
+	interval = 0.5
+	batch	 = 1000
+	hwm	 = 100
+
+	def __init__(self, context, host):
+		Subscriber.__init__(self, context, host)
+
+		# The frontend cannot see our address behind zmq so the
+		# frame carries the address we use to reach it.
+
+		probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		try:
+			probe.connect(self.dst)
+			source = probe.getsockname()[0]
+		except OSError:
+			source = None
+		probe.close()
+
+		self.frame  = stack.mq.Frame(source)
+		self.queued = {}
+		self.push   = context.socket(zmq.PUSH)
+		self.push.setsockopt(zmq.SNDHWM, self.hwm)
+		self.push.setsockopt(zmq.LINGER, 0)
+		self.push.connect('tcp://%s:%d' % (self.dst[0], stack.mq.ports.forward))
+
+	def flush(self):
+		if not self.frame.count:
+			return
+
+		try:
+			self.push.send(self.frame.pack(), zmq.NOBLOCK)
+			counter = 'sent'
+		except zmq.ZMQError:
+			counter = 'dropped'
+
+		for channel, n in self.queued.items():
+			self.counters.add(channel, counter, n)
+			self.counters.set(channel, 'queued', 0)
+		self.queued = {}
+		self.frame.clear()
+
+	def run(self):
+		deadline = time.time() + self.interval
+		while True:
+			timeout = max(0, deadline - time.time()) * 1000
+			if self.sub.poll(timeout):
+				try:
+					channel, body = self.sub.recv_multipart()
+				except zmq.ZMQError:
+					continue
+
+				if channel == b'smq':
+					try:
+						self.status(stack.mq.Message(message=body.decode(),
+									     channel='smq'))
+					except:
+						pass
+				else:
+					name = channel.decode(errors='replace')
+					self.frame.add(channel, body)
+					self.queued[name] = self.queued.get(name, 0) + 1
+					self.counters.set(name, 'queued', self.queued[name])
+
+			if self.frame.count >= self.batch or time.time() >= deadline:
+				self.flush()
+				deadline = time.time() + self.interval
 
 
 class Controller(threading.Thread):
@@ -95,6 +181,9 @@ class Controller(threading.Thread):
 			elif c == 'status':
 				channels = self.channels +  list(subscriber.channels.keys())
 				self.rep.send_string("Enabled channels: %s" % ' '.join(channels))
+
+			elif c == 'counters':
+				self.rep.send_string(json.dumps(subscriber.counters.get()))
 			else:
 				self.rep.send_string('')
 
@@ -103,13 +192,21 @@ def Handler(signal, frame):
 	sys.exit(0)
 
 
-host = None
+# /etc/sysconfig/stack-mq
+#
+#	MASTER=<address of the frontend>
+#	TRANSPORT=udp | batch		(optional, default is udp)
+
+config = {}
 try:
 	fin = open('/etc/sysconfig/stack-mq', 'r')
 	for line in fin:
-		(key, val) = line[:-1].split('=', 1)
-		host = val
+		if not line.strip():
+			continue
+		(key, val) = line.strip().split('=', 1)
+		config[key] = val
 	fin.close()
+	host = config['MASTER']
 except:
 	print('error - /etc/sysconfig/stack-mq bad format')
 	sys.exit(-1)
@@ -132,7 +229,10 @@ if 'STACKDEBUG' not in os.environ:
 
 
 context    = zmq.Context()
-subscriber = Subscriber(context, host)
+if config.get('TRANSPORT', 'udp') == 'batch':
+	subscriber = Shipper(context, host)
+else:
+	subscriber = Subscriber(context, host)
 controller = Controller(context, channels)
 subscriber.setDaemon(True)
 controller.setDaemon(True)
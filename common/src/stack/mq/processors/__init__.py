@@ -42,13 +42,10 @@ class ProcessorBase(stack.mq.Subscriber):
 
 	def setKey(self, key, value, ttl=None):
 		try:
-			self.redis.set(key, value)
+			self.redis.set(key, value, ex=ttl)
 		except redis.exceptions.ConnectionError:
 			return
 
-		if ttl is not None:
-			self.redis.expire(key, ttl)
-
 
 	def run(self):
 		if self.isActive():
@@ -4,66 +4,165 @@
 # https://github.com/Teradata/stacki/blob/master/LICENSE.txt
 # @copyright@
 
+import os
+import time
 import json
 import stack.api
+import stack.mq
 import stack.mq.processors
+try:
+	import redis
+except ModuleNotFoundError:
+	pass
 
 
 class ProcessorBase(stack.mq.processors.ProcessorBase):
 	"""
 	Extends the stack.mq.processors.ProcessorBase to
-	add support for creating Redis keys.  
+	add support for creating Redis keys.
 	This is used to cache host information.
 	"""
 
+	# Sources that are not in the database are not looked up
+	# again for this many seconds.
+
+	unknownTimeout = 60
+
+	def __init__(self, context, sock):
+		super().__init__(context, sock)
+		self.unknown  = {}
+		self.resolved = 0
+
 	def isActive(self):
 		return self.redis
 
-	def updateHostKeys(self, client):
+	def lookupHosts(self, clients):
 		"""
-		Updates the Redis keys for a given host in the cluster.	 
-		If Redis does not know about the host the cluster database is inspected and
-		the keys are created with a one hour timeout.
-		If Redis already contains the keys the timeout is reset.
-		The following Redis keys are defined for the host::
+		Finds the CLIENTS (IP addresses or host names) in the cluster
+		database with a single query.  The address 127.0.0.1 is the
+		frontend.
+
+		:param clients: IP addresses or host names
+		:type clients: list
+		:returns: dictionary of client to (*id*, *rack*, *rank*)
+		"""
+		clients = list(clients)
+		hosts   = {}
+		if not clients:
+			return hosts
+
+		marks = ', '.join([ '%s' ] * len(clients))
+		rows  = stack.api.Select("""
+			net.ip, n.name, n.id, n.rack, n.rank, a.name
+			from nodes n
+			join appliances a on n.appliance=a.id
+			left join networks net on net.node=n.id
+			where net.ip in (%s) or n.name in (%s) or a.name='frontend'
+			""" % (marks, marks), clients + clients)
+
+		for ip, name, id, rack, rank, appliance in rows:
+			for client in [ ip, name ]:
+				if client in clients:
+					hosts[client] = (id, rack, rank)
+			if appliance == 'frontend' and '127.0.0.1' in clients:
+				hosts.setdefault('127.0.0.1', (id, rack, rank))
+
+		return hosts
+
+	def resolveHosts(self, clients):
+		"""
+		Returns the Redis keys for all the given hosts in the cluster.
+		Known hosts are read from Redis with two pipelined round
+		trips, the rest are looked up in the cluster database at once
+		and their keys created with a one hour timeout.
+		The following Redis keys are defined for each host::
 
 			host:ID:rack
 			host:ID:rank
 			host:ID:addr
 			host:IPADDRESS:id
 
+		:param clients: IP addresses
+		:type clients: list
+		:returns: dictionary of client to dictionary with *id*, *addr*, *rack*, and *rank*
+		"""
+		clients = list({ client if client else '127.0.0.1' for client in clients })
+		keys	= {}
+
+		try:
+			pipe = self.redis.pipeline(transaction=False)
+			for client in clients:
+				pipe.get('host:%s:id' % client)
+			ids = dict(zip(clients, pipe.execute()))
+
+			known = [ (client, id.decode()) for client, id in ids.items() if id ]
+			for client, id in known:
+				pipe.get('host:%s:rack' % id)
+				pipe.get('host:%s:rank' % id)
+				pipe.get('host:%s:addr' % id)
+			values = pipe.execute()
+		except redis.exceptions.ConnectionError:
+			return keys
+
+		for i, (client, id) in enumerate(known):
+			rack, rank, addr = values[i * 3:i * 3 + 3]
+			if rack is not None and rank is not None and addr is not None:
+				keys[client] = { 'id'  : id,
+						 'addr': client,
+						 'rack': rack.decode(),
+						 'rank': rank.decode() }
+
+		# Forget the unknown sources that are due to be looked up
+		# again so sources that come and go don't pile up.
+
+		now = time.time()
+		self.unknown = { client: expires for client, expires in self.unknown.items()
+				 if expires >= now }
+
+		missing = [ client for client in clients
+			    if client not in keys and self.unknown.get(client, 0) < now ]
+		if not missing:
+			return keys
+
+		hosts = self.lookupHosts(missing)
+		self.resolved += len(hosts)
+
+		pipe = self.redis.pipeline(transaction=False)
+		for client in missing:
+			if client not in hosts:
+				self.unknown[client] = now + self.unknownTimeout
+				continue
+			self.unknown.pop(client, None)
+
+			id, rack, rank = [ '' if v is None else str(v) for v in hosts[client] ]
+			pipe.set('host:%s:id'	% client, id,	  ex=60 * 60)
+			pipe.set('host:%s:addr' % id,	  client, ex=60 * 60)
+			pipe.set('host:%s:rack' % id,	  rack,	  ex=60 * 60)
+			pipe.set('host:%s:rank' % id,	  rank,	  ex=60 * 60)
+			keys[client] = { 'id'  : id,
+					 'addr': client,
+					 'rack': rack,
+					 'rank': rank }
+		try:
+			pipe.execute()
+		except redis.exceptions.ConnectionError:
+			pass
+
+		return keys
+
+	def updateHostKeys(self, client):
+		"""
+		Updates the Redis keys for a given host in the cluster.
+		See resolveHosts().
+
 		:param addr: IP address
 		:type addr: string
 		:returns: dictionary with *id*, *addr*, *rack*, and *rank*
 		"""
-		keys = None
-
 		if not client:
 			client = '127.0.0.1'
 
-		id = self.getKey('host:%s:id' % client)
-		if id:
-			rack = self.getKey('host:%s:rack' % id)
-			rank = self.getKey('host:%s:rank' % id)
-			addr = self.getKey('host:%s:addr' % id)
-
-		if not id or not rack or not rank or not addr:
-			for row in stack.api.Call('list.host', [ client, 'expanded=true' ]):
-				id   = row['id']
-				rack = row['rack']
-				rank = row['rank']
-
-				self.setKey('host:%s:id'   % client, id,     60 * 60)
-				self.setKey('host:%s:addr' % id,     client, 60 * 60)
-				self.setKey('host:%s:rack' % id,     rack,   60 * 60)
-				self.setKey('host:%s:rank' % id,     rank,   60 * 60)
-		if id:
-			keys = { 'id'  : id,
-				 'addr': client,
-				 'rack': rack,
-				 'rank': rank }
-
-		return keys
+		return self.resolveHosts([ client ]).get(client)
 
 
 
@@ -71,17 +170,117 @@ class Processor(ProcessorBase):
 	"""
 	Listen for health messages and insert host:* keys into
 	the redis datbase.  Keys will expire in 5 minutes.
+
+	Messages are drained from the channel in windows of up to
+	*window* seconds or *batch* messages, every window costs one
+	database query (only for unknown hosts) and a few Redis round
+	trips no matter how many messages it holds.
+
+	Throughput and lag are kept in the smq:processor:health hash:
+
+		messages  total messages processed
+		batches   total windows processed
+		size      messages in the last window
+		rate      messages per second over the last window
+		lag       seconds from the oldest message in the last window
+			  being queued to it being stored
+		resolved  host keys looked up in the database
 	"""
 
+	window	= 1.0
+	batch	= 5000
+	metrics = 'smq:processor:health'
+
+	def __init__(self, context, sock):
+		super().__init__(context, sock)
+		self.messages = 0
+		self.batches  = 0
+		self.last     = time.time()
+
 	def channel(self):
 		return 'health'
 
+	def run(self):
+		if not self.isActive():
+			return
+
+		self.subscribe(self.channel())
+		while True:
+			msgs = self.receive()
+			if not msgs:
+				continue
+			if 'STACKDEBUG' not in os.environ:
+				try:
+					self.processBatch(msgs)
+				except:
+					pass
+			else:
+				self.processBatch(msgs)
+
+	def receive(self):
+		"""
+		Blocks for the next message and then collects everything that
+		arrives within the window.
+
+		:returns: list of stack.mq.Message
+		"""
+		msgs	 = []
+		deadline = None
+		while len(msgs) < self.batch:
+			if msgs:
+				timeout = (deadline - time.time()) * 1000
+				if timeout <= 0:
+					break
+			else:
+				timeout = None
+
+			if not self.sub.poll(timeout):
+				break
+			try:
+				channel, payload = self.sub.recv_multipart()
+				msg = stack.mq.Message(message=payload.decode(),
+						       channel=channel.decode())
+			except:
+				continue
+
+			if not msgs:
+				deadline = time.time() + self.window
+			msgs.append(msg)
+
+		return msgs
+
 	def process(self, msg):
-		keys    = self.updateHostKeys(msg.getSource())
-		payload = msg.getPayload()
-		ttl     = msg.getTTL()
+		self.processBatch([ msg ])
+		return None
+
+	def processBatch(self, msgs):
+		"""
+		Stores the health of every message in the batch.  When a host
+		reports more than once only the latest state is kept.
+
+		:param msgs: list of stack.mq.Message
+		"""
+		start = time.time()
 
-		if keys and payload:
+		hosts = self.resolveHosts([ msg.getSource() for msg in msgs ])
+
+		status = {}	# key -> (state, ttl)
+		oldest = None
+		for msg in msgs:
+			when = msg.getTime()
+			if when:
+				try:
+					when = time.mktime(time.strptime(when))
+					oldest = when if oldest is None else min(oldest, when)
+				except ValueError:
+					pass
+
+			keys	= hosts.get(msg.getSource() or '127.0.0.1')
+			payload = msg.getPayload()
+			ttl	= msg.getTTL()
+
+			if not keys or not payload:
+				continue
 
 			# health payloads were originally just strings, but
 			# this channel is going to be used to monitor more
@@ -100,14 +299,61 @@ class Processor(ProcessorBase):
 				health = json.loads(payload)
 			except ValueError:
 				health = { 'state': payload }
+			if not isinstance(health, dict):
+				health = { 'state': payload }
 
+			# A bad value fails the whole pipeline, so anything Redis
+			# would refuse is dealt with here one message at a time.
+			# The TTL must be a positive number of seconds and the
+			# state a string or a number, other JSON values are
+			# stored as their JSON text.
+
+			if ttl == -1:
+				ttl = None
+			elif ttl is not None:
+				try:
+					ttl = int(ttl)
+				except (TypeError, ValueError):
+					ttl = 0
+				if ttl <= 0:
+					continue
 			for component, state in health.items():
-				if ttl == -1:
-					ttl = None
-				self.setKey('host:%s:status:%s' % 
-					    (keys['id'], component), state, ttl)
+				if isinstance(state, bool) or not isinstance(state, (str, int, float)):
+					state = json.dumps(state)
+				status['host:%s:status:%s' % (keys['id'], component)] = (state, ttl)
 
+		# Keys that never expire go out in a single MSET, the rest
+		# as SET ... EX in the same pipeline.
 
-		return None
+		now	 = time.time()
+		forever  = { key: state for key, (state, ttl) in status.items() if ttl is None }
+		pipe	 = self.redis.pipeline(transaction=False)
+		if forever:
+			pipe.mset(forever)
+		for key, (state, ttl) in status.items():
+			if ttl is not None:
+				pipe.set(key, state, ex=ttl)
+
+		self.messages += len(msgs)
+		self.batches  += 1
+		elapsed   = max(now - self.last, 1e-6)
+		self.last = now
+		metrics	  = {
+			'messages': self.messages,
+			'batches' : self.batches,
+			'size'	  : len(msgs),
+			'rate'	  : '%.1f' % (len(msgs) / elapsed),
+			'lag'	  : '%.3f' % (now - oldest if oldest else 0),
+			'resolved': self.resolved
+			}
+		for field, value in metrics.items():
+			pipe.hset(self.metrics, field, value)
 
+		try:
+			pipe.execute()
+		except redis.exceptions.RedisError:
+			pass
 
+		if 'STACKDEBUG' in os.environ:
+			print('health: %d messages %d keys in %.3fs (%s)' %
+			      (len(msgs), len(status), time.time() - start, metrics))
@@ -7,7 +7,9 @@
 import time
 import threading
 import json
+import re
 import socket
+import struct
 import sys
 import os
 
@@ -30,10 +32,165 @@ class ports:
 	:var publish: UDP socket service for publishing a message
 	:var subscribe: zmq.SUB socket for subscribing to a channel
 	:var control: TCP socket service for enabling/disabling channel propagation
+	:var forward: zmq.PULL socket for batched messages from shippers
 	"""
 	publish	  = 5000
 	subscribe = 5001
 	control	  = 5002
+	forward	  = 5003
+
+
+class Frame:
+	"""
+	Batched binary transport between the shippers and the publisher.
+
+	A frame holds any number of messages exactly as they were
+	received from a publisher so forwarding never decodes and
+	re-encodes a message.  The layout is:
+
+		magic   4 bytes (SMQ\\x01)
+		source  !H length + address of the sending host
+		record  !BHI (hops, channel length, body length) + channel + body
+		...
+
+	*hops* is the number of hops to add to the :class:`Message` when
+	it is published.  Forwarding a frame is not a hop, so a message
+	that needs neither its hops nor its source changed is published
+	with its body exactly as it was received.
+	"""
+
+	magic  = b'SMQ\x01'
+	source = struct.Struct('!H')
+	record = struct.Struct('!BHI')
+
+	# Message.__str__ writes the source and time last, a body ending
+	# with a source already says where it came from.
+
+	sourced = re.compile(rb'"source": "[^"]*"(, "time": "[^"]*")?}$')
+
+	def __init__(self, source=None):
+		self.chunks = [ ]
+		self.count  = 0
+		self.size   = 0
+		self.setSource(source)
+
+	def setSource(self, source):
+		self.src = (source or '').encode()
+
+	def add(self, channel, body, hops=0):
+		"""
+		Appends an encoded message to the frame.
+
+		:param channel: channel name
+		:type channel: bytes
+		:param body: json encoded :class:`Message`
+		:type body: bytes
+		:param hops: hops to add when the message is published
+		:type hops: int
+		"""
+		self.chunks.append(self.record.pack(min(hops, 255), len(channel), len(body)))
+		self.chunks.append(channel)
+		self.chunks.append(body)
+		self.count += 1
+		self.size  += self.record.size + len(channel) + len(body)
+		return self
+
+	def pack(self):
+		"""
+		:returns: frame as bytes
+		"""
+		return b''.join([ self.magic, self.source.pack(len(self.src)), self.src ] + self.chunks)
+
+	def clear(self):
+		self.chunks = [ ]
+		self.count  = 0
+		self.size   = 0
+
+	@classmethod
+	def unpack(cls, data):
+		"""
+		Splits a packed frame back into its records, the messages
+		are not decoded.
+
+		:param data: packed frame
+		:type data: bytes
+		:returns: source address and a list of (channel, body, hops)
+		"""
+		if data[:len(cls.magic)] != cls.magic:
+			raise ValueError('not a message frame')
+
+		try:
+			offset = len(cls.magic)
+			(size, ) = cls.source.unpack_from(data, offset)
+			offset += cls.source.size
+			source = data[offset:offset + size].decode()
+			offset += size
+
+			records = [ ]
+			while offset < len(data):
+				hops, chanlen, bodylen = cls.record.unpack_from(data, offset)
+				offset += cls.record.size
+				channel = data[offset:offset + chanlen]
+				offset += chanlen
+				body = data[offset:offset + bodylen]
+				offset += bodylen
+				records.append((channel, body, hops))
+		except struct.error:
+			offset = len(data) + 1
+
+		if offset > len(data):
+			raise ValueError('truncated message frame')
+
+		return source, records
+
+	@classmethod
+	def needsDecode(cls, body, hops, source):
+		"""
+		:returns: True if the message has to be decoded to add
+			  *hops* or set its *source*
+		"""
+		return bool(hops or (source and not cls.sourced.search(body)))
+
+	@staticmethod
+	def decode(channel, body, hops, source):
+		"""
+		Builds the :class:`Message` for a frame record.
+
+		:returns: :class:`Message` with the *hops* added and the
+			  *source* set if the message did not have one
+		"""
+		msg = Message(message=body.decode(), channel=channel.decode())
+		msg.hops += hops
+		if source and not msg.getSource():
+			msg.setSource(source)
+		return msg
+
+
+class Counters:
+	"""
+	Thread safe per channel message counters.  Counters are created
+	on first use and start at zero.
+	"""
+
+	def __init__(self):
+		self.lock     = threading.Lock()
+		self.channels = { }
+
+	def add(self, channel, counter, n=1):
+		with self.lock:
+			c = self.channels.setdefault(channel, { })
+			c[counter] = c.get(counter, 0) + n
+
+	def set(self, channel, counter, n):
+		with self.lock:
+			self.channels.setdefault(channel, { })[counter] = n
+
+	def get(self):
+		"""
+		:returns: dictionary of channel to dictionary of counters
+		"""
+		with self.lock:
+			return { channel: dict(c) for channel, c in self.channels.items() }
 
 
 class Message():
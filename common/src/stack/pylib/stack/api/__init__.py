@@ -5,14 +5,59 @@
 # @copyright@
 
 import os
+import io
+import pwd
 import sys
 import subprocess
+import threading
 import json
 
 __stack__ = '/opt/stack/bin/stack'
 
 rc = None
 
+# Database connection shared by all in-process calls, the lock keeps
+# the calls of different threads from using it at the same time.
+
+_db	= None
+_lock	= threading.RLock()
+
+
+class _ThreadStream:
+	"""
+	Stands in for sys.stdout or sys.stderr.  Writes made by a thread
+	that is running an in-process command go to that command's buffer,
+	every other thread writes to the real stream as usual.
+	"""
+
+	def __init__(self, stream):
+		self.stream = stream
+		self.local  = threading.local()
+
+	def __getattr__(self, name):
+		buffer = getattr(self.local, 'buffer', None)
+		if buffer is None:
+			return getattr(self.stream, name)
+		return getattr(buffer, name)
+
+	@staticmethod
+	def install(name):
+		stream = getattr(sys, name)
+		if not isinstance(stream, _ThreadStream):
+			stream = _ThreadStream(stream)
+			setattr(sys, name, stream)
+		return stream
+
+	def capture(self, buffer):
+		"""
+		Sends the writes of this thread to BUFFER (None for the real
+		stream) and returns where they went before.
+		"""
+
+		previous = getattr(self.local, 'buffer', None)
+		self.local.buffer = buffer
+		return previous
+
 
 def ReturnCode():
 	"""
@@ -21,11 +66,211 @@ def ReturnCode():
 	return rc
 
 
-def Call(cmd, args=None, format='json', sudo=False, *, stderr=True):
+def _connect():
+	"""
+	Connects to the cluster database the same way the stack command
+	does.  Returns None if the database cannot be reached.
+	"""
+
+	try:
+		import pymysql
+	except ImportError:
+		return None
+
+	passwd = ''
+	try:
+		with open('/etc/apache.my.cnf') as fin:
+			for line in fin.readlines():
+				if line.startswith('password'):
+					passwd = line.split('=')[1].strip()
+					break
+	except:
+		pass
+
+	if os.geteuid() == 0:
+		username = 'apache'
+	else:
+		username = pwd.getpwuid(os.geteuid())[0]
+
+	if 'PYTEST_XDIST_WORKER' in os.environ:
+		db_name = 'cluster' + os.environ['PYTEST_XDIST_WORKER']
+	else:
+		db_name = 'cluster'
+
+	try:
+		if os.path.exists('/var/run/mysql/mysql.sock'):
+			return pymysql.connect(db=db_name,
+					       user=username, passwd=passwd,
+					       host='localhost',
+					       unix_socket='/var/run/mysql/mysql.sock',
+					       autocommit=True)
+		return pymysql.connect(db=db_name,
+				       host='localhost', port=40000,
+				       user=username, passwd=passwd,
+				       autocommit=True)
+	except pymysql.err.OperationalError:
+		return None
+
+
+def _database():
+	global _db
+
+	if _db:
+		try:
+			_db.ping(reconnect=True)
+		except Exception:
+			_db = None
+	if not _db:
+		_db = _connect()
+	return _db
+
+
+def _native(command, args, format, stderr, db=None):
+	"""
+	Runs the command inside this process, over DB if given or else the
+	shared connection.  Returns a (rc, result) tuple, or None if the
+	command cannot be run in-process and the caller should fall back
+	to the stack command.
+	"""
+
+	if command[0] == 'list' and format != 'json':
+		return None
+
+	try:
+		from stack.exception import CommandError
+		modpath = 'stack.commands.%s' % '.'.join(command)
+		__import__(modpath)
+		module = sys.modules[modpath]
+	except Exception:
+		return None
+	if not hasattr(module, 'Command'):
+		return None
+
+	with _lock:
+		if not db:
+			db = _database()
+		if not db:
+			return None
+
+		args = list(args or [])
+
+		# Anything the command prints is treated as its output just
+		# like stdout of the stack command would be.  Only the writes
+		# of this thread are captured, threads the command starts
+		# itself write to the real streams.
+
+		out = io.StringIO()
+		err = None if stderr else io.StringIO()
+
+		outstream = _ThreadStream.install('stdout')
+		errstream = _ThreadStream.install('stderr')
+		outprev	  = outstream.capture(out)
+		errprev	  = errstream.capture(err)
+		try:
+			o = module.Command(db)
+			o._native = command[0] == 'list'
+
+			# Writes from other processes never invalidate our
+			# select cache, start each call from the database.
+
+			o.db.clearCache()
+			try:
+				status = o.runWrapper(' '.join(command), args)
+			except CommandError as e:
+				sys.stderr.write('%s\n' % e)
+				return 255, [ ]
+			except Exception as e:
+				sys.stderr.write('%s: %s\n' % (e.__class__.__name__, e))
+				return 255, [ ]
+			if status is not True:
+				return 255, [ ]
+		finally:
+			outstream.capture(outprev)
+			errstream.capture(errprev)
+
+	if command[0] == 'list':
+		return 0, o._rows or [ ]
+
+	text = out.getvalue() + o.getText()
+	if text and text[-1] != '\n':
+		text += '\n'
+	if text:
+		return 0, text.split('\n')
+	return 0, [ ]
+
+
+def Select(query, args=None):
+	"""
+	Runs "select QUERY" against the cluster database over the shared
+	connection and returns the rows as tuples.  This is for daemons
+	that need a single bulk lookup where running a list command per
+	item would be too slow.  Returns an empty list if the database
+	cannot be reached.
+
+	Example:
+		rows = stack.api.Select('id, name from nodes where rack=%s', ('0', ))
+	"""
+
+	with _lock:
+		db = _database()
+		if not db:
+			return [ ]
+		try:
+			with db.cursor() as cursor:
+				cursor.execute('select %s' % query, args)
+				return list(cursor.fetchall())
+		except Exception as e:
+			sys.stderr.write('%s: %s\n' % (e.__class__.__name__, e))
+			return [ ]
+
+
+def Transaction(calls):
+	"""
+	Runs each (cmd, args) of CALLS in-process, in order, inside a single
+	database transaction.  Returns True if every command succeeded,
+	otherwise nothing the commands wrote is kept and False is returned.
+	The stack command is never run as a fallback, ReturnCode() is the
+	return code of the command that failed.
+
+	Example:
+		stack.api.Transaction([ ('set host boot', [ 'backend-0-0', 'action=os' ]),
+					('set host attr', [ 'backend-0-0', 'attr=nukedisks', 'value=false' ]) ])
+	"""
+
+	global rc
+
+	with _lock:
+		db = _database()
+		if not db:
+			rc = 255
+			return False
+
+		db.begin()
+		try:
+			for (cmd, args) in calls:
+				command = cmd.replace('.', ' ').strip().split()
+				result  = _native(command, args, 'json', True, db)
+				rc	= result[0] if result else 255
+				if rc:
+					db.rollback()
+					return False
+		except:
+			db.rollback()
+			raise
+		db.commit()
+
+	return True
+
+
+def Call(cmd, args=None, format='json', sudo=False, *, stderr=True, native=True):
 	"""
 	Call the Stack Command Line and return a python dictionary as the
 	result.  Currently only works with list commands.
 
+	Unless SUDO is requested the command is imported and run inside
+	the calling process over a shared database connection.  Set NATIVE
+	to False to always run the stack command in a subprocess.
+
 	Example:
 		result = stack.api.Call('list network', [ 'private' ])
 	"""
@@ -37,6 +282,12 @@ def Call(cmd, args=None, format='json', sudo=False, *, stderr=True):
 		return [ ]
 	
 	command = cmd.replace('.', ' ').strip().split()
+
+	if native and not sudo:
+		result = _native(command, args, format, stderr)
+		if result:
+			rc, result = result
+			return result
 	
 	if sudo:
 		list = [ sudo ]
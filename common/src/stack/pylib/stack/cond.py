@@ -102,18 +102,24 @@ def CreateCondExpr(archs, oses, releases, cond):
 
 
     
-def EvalCondExpr(cond, attrs):
-	"""Tests the conditional expression.  The ATTRS dictionary is use to
-	build the Python local() dictional (local vars) and the COND
-	expression is evaluated in using these variables.  In other words,
-	for every key-value pair in the ATTRS dictionary a Python variable
-	is created, this allows the COND expression to directly refer to
-	all the attributes as variables.
+def CompileCondExpr(cond):
+	"""Compiles the conditional expression COND into a code object that
+	can be passed to EvalCondExpr. Use this when the same expression is
+	tested against lots of attribute sets (e.g. one per host).
+	Raises a SyntaxError for a bad expression.
 	"""
-	if not cond:
-		return True
 
-	cond = cond.replace('.', '_DOT_')
+	# Leading blanks are fine for eval() but not for compile()
+	return compile(cond.replace('.', '_DOT_').lstrip(' \t'), '<cond>', 'eval')
+
+
+def CreateCondEnv(attrs):
+	"""Builds the Python local() dictionary used to evaluate conditional
+	expressions from the ATTRS dictionary.  For every key-value pair in
+	the ATTRS dictionary a Python variable is created. The result can be
+	passed to EvalCondExpr instead of ATTRS and reused for many
+	expressions.
+	"""
 
 	env = _CondEnv()
 	for (k, v) in attrs.items():
@@ -140,7 +146,31 @@ def EvalCondExpr(cond, attrs):
 #		print(cond, ':', k, ':', v)
 		env[k] = v
 
+	return env
+
+    
+def EvalCondExpr(cond, attrs):
+	"""Tests the conditional expression.  The ATTRS dictionary is use to
+	build the Python local() dictional (local vars) and the COND
+	expression is evaluated in using these variables.  In other words,
+	for every key-value pair in the ATTRS dictionary a Python variable
+	is created, this allows the COND expression to directly refer to
+	all the attributes as variables.
+
+	COND can also be a code object from CompileCondExpr and ATTRS an
+	environment from CreateCondEnv.
+	"""
+	if not cond:
+		return True
+
+	if isinstance(attrs, _CondEnv):
+		env = attrs
+	else:
+		env = CreateCondEnv(attrs)
+
 	try:
+		if isinstance(cond, str):
+			cond = CompileCondExpr(cond)
 		result = eval(cond, globals(), env)
 	except:
 		result = False
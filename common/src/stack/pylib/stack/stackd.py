@@ -0,0 +1,277 @@
+#! /opt/stack/bin/python3
+#
+# @copyright@
+# Copyright (c) 2006 - 2019 Teradata
+# All rights reserved. Stacki(r) v5.x stacki.com
+# https://github.com/Teradata/stacki/blob/master/LICENSE.txt
+# @copyright@
+
+"""
+Persistent stack command server.
+
+Every invocation of /opt/stack/bin/stack pays for starting Python,
+importing the command tree, and connecting to the database before any
+work is done.  The stackd daemon does the imports once and then forks
+a worker per request.  The worker adopts the client's stdin, stdout,
+stderr, environment, working directory, and umask and runs the stack
+script exactly as the client would have, so output, exit codes,
+signals, and nested commands behave the same.
+
+The stack script calls Call() first and only runs the command itself
+when stackd is not available (not running, busy, or another user).
+Set STACKD=no in the environment to always bypass the server.
+
+Database connections are not pooled.  A MySQL connection can't be
+shared by forked workers, so each worker still opens its own, just as
+the stack script does.  Only the interpreter start up and the imports
+are saved.
+"""
+
+import os
+import sys
+import json
+import array
+import signal
+import struct
+import socket
+import pkgutil
+import traceback
+import socketserver
+
+
+SOCKET = '/var/run/stackd/stackd.sock'
+SCRIPT = '/opt/stack/bin/stack'
+
+# Set in the worker process so the stack script runs the command rather
+# than forwarding it back to the server.
+serving = False
+
+_length = struct.Struct('!I')
+
+
+def _send(sock, message, fds=None):
+	data = json.dumps(message).encode()
+	head = _length.pack(len(data))
+
+	# The file descriptors ride along with the length prefix, the
+	# payload follows as a regular stream.
+
+	if fds:
+		sock.sendmsg([head], [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+				       array.array('i', fds))])
+	else:
+		sock.sendall(head)
+	sock.sendall(data)
+
+
+def _recvall(sock, size):
+	data = b''
+	while len(data) < size:
+		chunk = sock.recv(size - len(data))
+		if not chunk:
+			raise ConnectionError('stackd connection closed')
+		data += chunk
+	return data
+
+
+def _recv(sock, nfds=0):
+	fds  = array.array('i')
+	head = b''
+	if nfds:
+		head, ancdata, flags, addr = sock.recvmsg(
+			_length.size, socket.CMSG_LEN(nfds * fds.itemsize))
+		for level, kind, data in ancdata:
+			if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+				fds.frombytes(data[:len(data) - (len(data) % fds.itemsize)])
+		if not head:
+			raise ConnectionError('stackd connection closed')
+	head += _recvall(sock, _length.size - len(head))
+	(size, ) = _length.unpack(head)
+	message = json.loads(_recvall(sock, size).decode())
+	return message, list(fds)
+
+
+def enabled():
+	"""
+	Returns True if commands should be forwarded to stackd.
+	"""
+	if serving:
+		return False
+	if os.environ.get('STACKD', 'yes').lower() in [ 'no', 'n', 'false', '0', 'off' ]:
+		return False
+	return os.path.exists(SOCKET)
+
+
+def Call(argv):
+	"""
+	Runs the stack command line ARGV in stackd using the caller's
+	stdin, stdout, and stderr.  Returns the exit code of the command,
+	or None if the server did not accept the request, in which case
+	the caller should run the command itself.
+	"""
+
+	if not enabled():
+		return None
+
+	umask = os.umask(0)
+	os.umask(umask)
+
+	request = {
+		'argv'	: argv,
+		'env'	: dict(os.environ),
+		'cwd'	: os.getcwd(),
+		'umask'	: umask
+		}
+
+	sys.stdout.flush()
+	sys.stderr.flush()
+
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		sock.connect(SOCKET)
+		_send(sock, request, [ 0, 1, 2 ])
+		reply, fds = _recv(sock)
+		pid = reply['pid']
+	except (OSError, ValueError, KeyError):
+		# Nothing has run yet so it is safe to fall back.
+		sock.close()
+		return None
+
+	# Once the worker owns the request signals are passed along so
+	# ^C and friends behave as if the command were local.
+
+	def forward(signum, frame):
+		try:
+			os.kill(pid, signum)
+		except OSError:
+			pass
+
+	for signum in [ signal.SIGINT, signal.SIGTERM, signal.SIGHUP, signal.SIGQUIT ]:
+		signal.signal(signum, forward)
+
+	try:
+		reply, fds = _recv(sock)
+		rc = reply.get('rc', -1)
+	except (OSError, ValueError):
+		rc = -1
+	finally:
+		sock.close()
+
+	return rc
+
+
+class Handler(socketserver.BaseRequestHandler):
+
+	def handle(self):
+		# Only run commands for our own user, everyone else falls
+		# back to running the command locally.
+
+		creds = self.request.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+						struct.calcsize('3i'))
+		pid, uid, gid = struct.unpack('3i', creds)
+		if uid != os.geteuid():
+			return
+
+		request, fds = _recv(self.request, 3)
+		if len(fds) != 3:
+			for fd in fds:
+				os.close(fd)
+			return
+
+		_send(self.request, { 'pid': os.getpid() })
+		rc = self.server.runCommand(request, fds)
+		_send(self.request, { 'rc': rc })
+
+
+class Server(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+	"""
+	Forks a worker for every stack command.  The parent process only
+	holds the preloaded command tree, it never opens a database
+	connection so every worker starts from a clean state.
+	"""
+
+	# When all the workers are busy (e.g. commands running nested
+	# commands) new requests are refused and the client runs the
+	# command itself rather than waiting on a slot.
+
+	workers	     = 64
+	max_children = workers + 1
+
+	def __init__(self, path=SOCKET):
+		self.path = path
+		if os.path.exists(path):
+			os.unlink(path)
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+
+		super().__init__(path, Handler)
+		os.chmod(path, 0o600)
+
+		self.preload()
+
+	def preload(self):
+		__import__('stack.commands')
+
+		# Importing a package to find its children is what
+		# walk_packages does, so this loads the whole command tree.
+
+		commands = sys.modules['stack.commands']
+		for finder, name, ispkg in pkgutil.walk_packages(commands.__path__,
+								  'stack.commands.',
+								  onerror=lambda name: None):
+			try:
+				__import__(name)
+			except Exception:
+				pass
+
+		with open(SCRIPT) as fin:
+			self.code = compile(fin.read(), SCRIPT, 'exec')
+
+	def verify_request(self, request, client_address):
+		return len(self.active_children or []) < self.workers
+
+	def server_close(self):
+		super().server_close()
+		if os.path.exists(self.path):
+			os.unlink(self.path)
+
+	def runCommand(self, request, fds):
+		global serving
+
+		sys.stdout.flush()
+		sys.stderr.flush()
+		for target, fd in enumerate(fds):
+			os.dup2(fd, target)
+			os.close(fd)
+
+		os.chdir(request['cwd'])
+		os.umask(request['umask'])
+		os.environ.clear()
+		os.environ.update(request['env'])
+		sys.argv = request['argv']
+
+		for signum in [ signal.SIGTERM, signal.SIGHUP, signal.SIGQUIT ]:
+			signal.signal(signum, signal.SIG_DFL)
+
+		serving = True
+		try:
+			exec(self.code, { '__name__': '__main__', '__file__': SCRIPT })
+			rc = 0
+		except SystemExit as e:
+			if e.code is None:
+				rc = 0
+			elif isinstance(e.code, int):
+				rc = e.code
+			else:
+				sys.stderr.write('%s\n' % e.code)
+				rc = 1
+		except BaseException:
+			traceback.print_exc()
+			rc = 1
+
+		try:
+			sys.stdout.flush()
+			sys.stderr.flush()
+		except OSError:
+			pass
+
+		return rc
@@ -0,0 +1,92 @@
+# @copyright@
+# Copyright (c) 2006 - 2019 Teradata
+# All rights reserved. Stacki(r) v5.x stacki.com
+# https://github.com/Teradata/stacki/blob/master/LICENSE.txt
+# @copyright@
+
+import io
+import threading
+from unittest.mock import MagicMock, patch
+
+import stack.api
+from stack.api import _ThreadStream
+
+
+def test_thread_stream():
+	real   = io.StringIO()
+	stream = _ThreadStream(real)
+	mine   = io.StringIO()
+
+	assert stream.capture(mine) is None
+
+	# Only this thread's writes are captured
+	other = threading.Thread(target=lambda: stream.write('other\n'))
+	other.start()
+	other.join()
+	stream.write('mine\n')
+
+	assert stream.capture(None) is mine
+	stream.write('after\n')
+
+	assert mine.getvalue() == 'mine\n'
+	assert real.getvalue() == 'other\nafter\n'
+
+
+def test_thread_stream_nested():
+	stream = _ThreadStream(io.StringIO())
+	outer  = io.StringIO()
+	inner  = io.StringIO()
+
+	stream.capture(outer)
+	previous = stream.capture(inner)
+	stream.write('inner\n')
+	stream.capture(previous)
+	stream.write('outer\n')
+
+	assert inner.getvalue() == 'inner\n'
+	assert outer.getvalue() == 'outer\n'
+
+
+def transaction(results):
+	db = MagicMock()
+	native = MagicMock(side_effect=results)
+	with patch.object(stack.api, '_database', return_value=db), \
+	     patch.object(stack.api, '_native', native):
+		ok = stack.api.Transaction([ ('set host boot', [ 'a', 'action=os' ]),
+					     ('set.host.attr', [ 'a', 'attr=b', 'value=c' ]) ])
+
+	return ok, db, native
+
+
+def test_transaction():
+	ok, db, native = transaction([ (0, [ ]), (0, [ ]) ])
+
+	assert ok
+	assert stack.api.ReturnCode() == 0
+	assert [ call[0][:2] for call in native.call_args_list ] == [
+		(['set', 'host', 'boot'], [ 'a', 'action=os' ]),
+		(['set', 'host', 'attr'], [ 'a', 'attr=b', 'value=c' ]) ]
+
+	# Every command runs on the connection the transaction began on
+	assert all(call[0][4] is db for call in native.call_args_list)
+	db.begin.assert_called_once_with()
+	db.commit.assert_called_once_with()
+	db.rollback.assert_not_called()
+
+
+def test_transaction_failed():
+	# The second command is never run
+	ok, db, native = transaction([ (255, [ ]), (0, [ ]) ])
+
+	assert not ok
+	assert stack.api.ReturnCode() == 255
+	assert native.call_count == 1
+	db.rollback.assert_called_once_with()
+	db.commit.assert_not_called()
+
+	# A command that cannot run in-process fails the transaction
+	ok, db, native = transaction([ (0, [ ]), None ])
+
+	assert not ok
+	db.rollback.assert_called_once_with()
+	db.commit.assert_not_called()
@@ -4,7 +4,7 @@
 # https://github.com/Teradata/stacki/blob/master/LICENSE.txt
 # @copyright@
 
-from stack.cond import EvalCondExpr
+from stack.cond import EvalCondExpr, CompileCondExpr, CreateCondEnv
 
 attrs = {
 	'a'  : 'foo',
@@ -27,3 +27,23 @@ def test_dot():
 
 	assert(EvalCondExpr("'bb.aa' in p.a", attrs))
 
+
+def test_compiled():
+
+	code = CompileCondExpr("a.b == 'bar' and 'bb' in p")
+	env  = CreateCondEnv(attrs)
+
+	assert(EvalCondExpr(code, env))
+	assert(EvalCondExpr(code, attrs))
+	assert(not EvalCondExpr(code, CreateCondEnv({ 'a.b': 'foo' })))
+
+
+def test_whitespace():
+
+	assert(EvalCondExpr("  a == 'foo'", attrs))
+	assert(EvalCondExpr(CompileCondExpr("  a == 'foo'"), attrs))
+
+
+def test_syntax_error():
+
+	assert(not EvalCondExpr("a ==", attrs))
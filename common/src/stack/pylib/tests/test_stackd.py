@@ -0,0 +1,96 @@
+# @copyright@
+# Copyright (c) 2006 - 2019 Teradata
+# All rights reserved. Stacki(r) v5.x stacki.com
+# https://github.com/Teradata/stacki/blob/master/LICENSE.txt
+# @copyright@
+
+import os
+import sys
+import time
+import subprocess
+import pytest
+
+# Stands in for the stack script, it reports where it ran
+SCRIPT = """
+import os
+import sys
+import stack.stackd
+
+stack.stackd.SOCKET = os.environ['STACKD_SOCKET']
+rc = stack.stackd.Call(sys.argv)
+if rc is not None:
+	sys.exit(rc)
+
+where = 'server' if stack.stackd.serving else 'local'
+print(where, os.getcwd(), sys.argv[1:], os.environ.get('FOO'))
+sys.stderr.write('read %s' % sys.stdin.read())
+sys.exit(int(sys.argv[1]))
+"""
+
+SERVER = """
+import sys
+import stack.stackd
+
+stack.stackd.SCRIPT = sys.argv[1]
+
+class Server(stack.stackd.Server):
+	def preload(self):
+		with open(stack.stackd.SCRIPT) as fin:
+			self.code = compile(fin.read(), stack.stackd.SCRIPT, 'exec')
+
+Server(sys.argv[2]).serve_forever()
+"""
+
+
+@pytest.fixture
+def stackd(tmp_path):
+	script = tmp_path / 'stack'
+	script.write_text(SCRIPT)
+	server = tmp_path / 'server'
+	server.write_text(SERVER)
+	sock = tmp_path / 'run' / 'stackd.sock'
+
+	env = dict(os.environ)
+	env['PYTHONPATH'] = os.pathsep.join(sys.path)
+	env['STACKD_SOCKET'] = str(sock)
+	env.pop('STACKD', None)
+
+	p = subprocess.Popen([ sys.executable, str(server), str(script), str(sock) ], env=env)
+	for i in range(100):
+		if sock.exists():
+			break
+		time.sleep(0.1)
+
+	def run(*args, **kwargs):
+		e = dict(env)
+		e.update(kwargs.pop('env', {}))
+		return subprocess.run([ sys.executable, str(script) ] + list(args),
+				      env=e, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+				      encoding='utf-8', **kwargs)
+
+	yield run
+
+	p.kill()
+	p.wait()
+
+
+def test_served(stackd, tmp_path):
+	result = stackd('3', cwd=str(tmp_path), env={ 'FOO': 'bar' }, input='hello')
+
+	assert result.returncode == 3
+	assert result.stdout == "server %s ['3'] bar\n" % tmp_path
+	assert result.stderr == 'read hello'
+
+
+def test_bypass(stackd, tmp_path):
+	result = stackd('0', cwd=str(tmp_path), env={ 'STACKD': 'no' }, input='')
+
+	assert result.returncode == 0
+	assert result.stdout.startswith('local ')
+
+
+def test_no_server(stackd, tmp_path):
+	result = stackd('0', env={ 'STACKD_SOCKET': str(tmp_path / 'missing.sock') }, input='')
+
+	assert result.returncode == 0
+	assert result.stdout.startswith('local ')
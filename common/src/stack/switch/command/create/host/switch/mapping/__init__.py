@@ -5,15 +5,21 @@
 # @copyright@
 
 import stack.commands
-from stack.exception import ArgRequired
+from stack.exception import ParamType
 
-class command(stack.commands.HostArgumentProcessor, stack.commands.create.command):
+class command(stack.commands.SwitchArgumentProcessor,
+	      stack.commands.HostArgumentProcessor,
+	      stack.commands.create.command):
 	pass
 
 class Command(command):
 	"""
 	This command dynamically maps the interfaces of hosts to ports of a switch.
 
+	The ports come from the mac address tables cached by "list switch mac",
+	only switches whose cache is older than maxage are read again, and only
+	interfaces that are new or moved to another port are updated.
+
 	<arg name="host">
 	The hosts to map. If no hosts are supplied, map all hosts.
 	</arg>
@@ -21,15 +27,101 @@ class Command(command):
 	<param type='string' name='switch'>
 	The switch to map. If no switches are supplied, then map all switches.
 	</param>
+
+	<param type='int' name='maxage'>
+	Seconds a cached mac address table is used before the switch is
+	asked again.
+	Default: 300
+	</param>
 	"""
 
+	def mapSwitchPorts(self, switch, ports):
+		"""
+		Connects host interfaces to switch ports, interfaces already
+		on the given port are left alone.  An interface that was
+		connected to another switch is removed from that switch.
+
+		:param switch: switch name
+		:param ports: dictionary of (*host*, *interface*) to port
+		"""
+		if not ports:
+			return
+
+		rows = self.db.select("""
+			id from nodes where name=%s
+			""", (switch,))
+		switch_id = rows[0][0]
+
+		hosts = sorted({ host for host, interface in ports })
+		interfaces = {}
+		for id, host, interface in self.db.select("""
+			net.id, n.name, net.device from networks net
+			join nodes n on net.node=n.id
+			where n.name in (%s)
+			""" % ', '.join([ '%s' ] * len(hosts)), hosts):
+			interfaces[(host, interface)] = id
+
+		current = {}
+		for interface, port in self.db.select("""
+			interface, port from switchports where switch=%s
+			""", (switch_id,)):
+			current[interface] = port
+
+		new   = []
+		moved = []
+		for key, port in ports.items():
+			interface = interfaces.get(key)
+			if interface is None:
+				continue
+			if interface not in current:
+				new.append((interface, switch_id, port))
+			elif str(current[interface]) != str(port):
+				moved.append((port, interface, switch_id))
+
+		# An interface is only plugged into one switch, drop the
+		# ports it had on any other switch.
+
+		found = sorted(interfaces[key] for key in ports if key in interfaces)
+		if found:
+			self.db.execute("""
+				delete from switchports
+				where switch!=%%s and interface in (%s)
+				""" % ', '.join([ '%s' ] * len(found)), [ switch_id ] + found)
+
+		if new:
+			self.db.execute("""
+				insert into switchports (interface, switch, port)
+				values (%s, %s, %s)
+				""", new, many=True)
+		if moved:
+			self.db.execute("""
+				update switchports set port=%s
+				where interface=%s and switch=%s
+				""", moved, many=True)
+
 	def run(self, params, args):
-		switch, = self.fillParams([ ('switch', None) ])
+		switch, maxage = self.fillParams([
+			('switch', None),
+			('maxage', 300)
+		])
+		try:
+			maxage = int(maxage)
+		except ValueError:
+			raise ParamType(self, 'maxage', 'integer')
 
-		switches = self.getHostnames(switch)
+		switches = self.getSwitchNames([ switch ] if switch else None)
 		hosts = self.getHostnames(args)
+		if not switches:
+			return
 
-		for s in switches:
-			model = self.getHostAttr(s, 'component.model')
-			self.runImplementation(model, (s, hosts))
+		# One call reads (or refreshes) the tables of all the
+		# switches at once.
+
+		macs = {}
+		for m in self.call('list.switch.mac', switches + [ 'maxage=%d' % maxage ]):
+			macs.setdefault(m['switch'], []).append(m)
 
+		attrs = self.getHostAttrDict(switches)
+		for s in switches:
+			model = attrs[s].get('component.model')
+			self.runImplementation(model, (s, hosts, macs.get(s, [])))
@@ -10,19 +10,13 @@ import stack.commands
 
 class Implementation(stack.commands.Implementation):
 	def run(self, args):
-		(switch, hosts) = args
+		(switch, hosts, list_switch_mac) = args
+		hosts = set(hosts)
 
-		list_switch_mac = self.owner.call('list.switch.mac', [ switch ])
-
-		for h in self.owner.call('list.host.interface', hosts):
-			if h['interface'] == 'ipmi':
+		ports = {}
+		for m in list_switch_mac:
+			if m['host'] not in hosts or m['interface'] == 'ipmi':
 				continue
+			ports.setdefault((m['host'], m['interface']), m['port'])
 
-			for m in list_switch_mac:
-				if h['host'] == m['host'] and h['interface'] == m['interface']:
-					params = [ switch, 'host=%s' % h['host'],
-						'interface=%s' % m['interface'],
-						'port=%s' % m['port'] ]
-					self.owner.call('add.switch.host', params)
-					break
-
+		self.owner.mapSwitchPorts(switch, ports)
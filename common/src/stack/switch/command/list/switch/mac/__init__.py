@@ -6,7 +6,8 @@
 
 import stack.commands
 import stack.util
-from stack.exception import CommandError
+from stack.exception import CommandError, ParamType
+from stack.switch.pool import SwitchPool
 
 class command(stack.commands.SwitchArgumentProcessor,
 	      stack.commands.list.command,
@@ -17,6 +18,12 @@ class Command(command):
 	"""
 	List mac address table on switch.
 
+	The mac address tables are cached in the database, a switch is
+	only asked for its table when its cache is older than maxage
+	seconds (or refresh is set).  Stale switches are crawled at the
+	same time.  A MAC that is no longer in the table of a switch
+	is dropped from its cache when the switch is read again.
+
 	<arg optional='1' type='string' name='switch' repeat='1'>
 	Zero, one or more switch names. If no switch names are supplies, info about
 	all the known switches is listed.
@@ -24,7 +31,24 @@ class Command(command):
 
 	<param optional='1' type='bool' name='pinghosts'>
 	Send a ping to each host connected to the switch. Hosts do not show up in the
-	mac address table if there is no traffic.
+	mac address table if there is no traffic. Implies refresh.
+	</param>
+
+	<param optional='1' type='bool' name='refresh'>
+	Read the mac address table from every switch even if the cache
+	is current.
+	Default: no
+	</param>
+
+	<param optional='1' type='int' name='maxage'>
+	Seconds a cached mac address table is used before the switch is
+	asked again.
+	Default: 300
+	</param>
+
+	<param optional='1' type='int' name='threads'>
+	The number of switches to read at the same time.
+	Default: 16
 	</param>
 
 	<example cmd='list host mac switch-0-0'>
@@ -34,21 +58,169 @@ class Command(command):
 	<example cmd='list switch mac'>
 	List mac table for all known switches/
 	</example>
+
+	<example cmd='list switch mac refresh=true'>
+	Read the mac table from all known switches and list it.
+	</example>
 	"""
+
+	def getCacheAge(self, ids):
+		"""
+		Returns a dictionary of switch id to the age in seconds of
+		its cached mac address table.  Switches with nothing cached
+		are left out.
+		"""
+		if not ids:
+			return {}
+
+		rows = self.db.select("""
+			switch, timestampdiff(second, max(seen), now())
+			from switchmacs where switch in (%s)
+			group by switch
+			""" % ', '.join([ '%s' ] * len(ids)), list(ids))
+
+		return { switch: age for switch, age in rows }
+
+	def storeMacs(self, switch, macs):
+		"""
+		Replaces the cached mac address table of a switch.  Only MACs
+		that are new, on a different port (or vlan) or gone are
+		written, the rest just have their timestamp refreshed.
+
+		:param switch: switch id
+		:param macs: dictionary of mac to (*port*, *vlan*)
+		"""
+		cached = {}
+		for mac, port, vlan in self.db.select("""
+			mac, port, vlan from switchmacs where switch=%s
+			""", (switch,)):
+			cached[mac] = (port, vlan)
+
+		new   = []
+		moved = []
+		for mac, (port, vlan) in macs.items():
+			if mac not in cached:
+				new.append((switch, mac, port, vlan))
+			elif cached[mac] != (port, vlan):
+				moved.append((port, vlan, switch, mac))
+
+		if new:
+			self.db.execute("""
+				insert into switchmacs (switch, mac, port, vlan, seen)
+				values (%s, %s, %s, %s, now())
+				""", new, many=True)
+		if moved:
+			self.db.execute("""
+				update switchmacs set port=%s, vlan=%s, seen=now()
+				where switch=%s and mac=%s
+				""", moved, many=True)
+
+		gone = [ mac for mac in cached if mac not in macs ]
+		if gone:
+			self.db.execute("""
+				delete from switchmacs
+				where switch=%%s and mac in (%s)
+				""" % ', '.join([ '%s' ] * len(gone)), [ switch ] + gone)
+
+		seen = [ mac for mac in macs if mac in cached ]
+		if seen:
+			self.db.execute("""
+				update switchmacs set seen=now()
+				where switch=%%s and mac in (%s)
+				""" % ', '.join([ '%s' ] * len(seen)), [ switch ] + seen)
+
 	def run(self, params, args):
 
-		(pinghosts,) = self.fillParams([
-		('pinghosts', False),
+		(pinghosts, refresh, maxage, threads) = self.fillParams([
+			('pinghosts', False),
+			('refresh', False),
+			('maxage', 300),
+			('threads', 16),
 		])
 
 		self.pinghosts = self.str2bool(pinghosts)
+		refresh = self.str2bool(refresh) or self.pinghosts
+		try:
+			maxage = int(maxage)
+		except ValueError:
+			raise ParamType(self, 'maxage', 'integer')
+		try:
+			threads = int(threads)
+		except ValueError:
+			raise ParamType(self, 'threads', 'integer')
 
 		_switches = self.getSwitchNames(args)
+		if not _switches:
+			return
+
+		ids = dict(self.db.select("""
+			name, id from nodes where name in (%s)
+			""" % ', '.join([ '%s' ] * len(_switches)), _switches))
+
+		# Only the switches with a missing or stale cache are asked
+		# for their tables.
+
+		ages  = self.getCacheAge(ids.values())
+		stale = [ switch for switch in _switches
+			  if refresh or ages.get(ids[switch]) is None or ages[ids[switch]] > maxage ]
+
+		if stale:
+			self.attrs    = self.getHostAttrDict(stale)
+			self.frontend = self.call('list.host.interface', [ 'localhost' ])
+			if self.pinghosts:
+				self.hosts = self.call('list.host.interface')
+
+			interfaces = {}
+			for switch in self.call('list.host.interface', stale):
+				interfaces.setdefault(switch['host'], []).append(switch)
+
+			for switch_name in interfaces:
+				model = self.attrs[switch_name].get('component.model')
+				if model not in self.impl_list:
+					self.loadImplementation(model)
+
+			def crawl(switch_name):
+				model = self.attrs[switch_name].get('component.model')
+				macs  = None
+				for switch in interfaces[switch_name]:
+					found = self.runImplementation(model, [switch])
+					if found is not None:
+						macs = macs or {}
+						macs.update(found)
+				return macs
+
+			self.pool = SwitchPool(threads)
+			with self.pool:
+				results = self.pool.map(crawl, interfaces)
+
+			# Errors are raised only after the tables that were read
+			# have been saved.
+
+			errors = []
+			for switch_name, macs, error in results:
+				if error:
+					errors.append((switch_name, error))
+				elif macs is not None:
+					self.storeMacs(ids[switch_name], macs)
+
+			if len(errors) == 1:
+				raise errors[0][1]
+			if errors:
+				raise CommandError(self, '\n'.join([ '%s: %s' % (switch_name, error.msg if isinstance(error, CommandError) else error)
+								     for switch_name, error in errors ]))
+
 		self.beginOutput()
-		for switch in self.call('list.host.interface', _switches):
+		for switch, port, mac, host, interface, vlan in self.db.select("""
+			s.name, m.port, m.mac, n.name, net.device, m.vlan
+			from switchmacs m
+			join nodes s on m.switch=s.id
+			join networks net on net.mac=m.mac
+			join nodes n on net.node=n.id
+			where m.switch in (%s)
+			order by s.rack, s.rank, s.name, m.port, m.mac
+			""" % ', '.join([ '%s' ] * len(ids)), list(ids.values())):
 
-			switch_name = switch['host']
-			model = self.getHostAttr(switch_name, 'component.model')
-			self.runImplementation(model, [switch])
+			self.addOutput(switch, [ str(port), mac, host, interface,
+						 None if vlan is None else str(vlan) ])
 
 		self.endOutput(header=['switch', 'port',  'mac', 'host', 'interface', 'vlan'])
@@ -12,20 +12,25 @@ from stack.switch.x1052 import SwitchDellX1052
 
 
 class Implementation(stack.commands.Implementation):
+	"""
+	Reads the mac address table of an x1052 and returns a dictionary
+	of mac to (port, vlan) for the hosts learned on its ports.
+	"""
+
 	def run(self, args):
 
 		switch = args[0]
 
 		# Get frontend ip for tftp address
 		try:
-			(_frontend, *args) = [host for host in self.owner.call('list.host.interface', ['localhost'])
+			(_frontend, *args) = [host for host in self.owner.frontend
 					if host['network'] == switch['network']]
 		except:
 			raise CommandError(self, '"%s" and the frontend do not share a network' % switch['host'])
 
 		# Send traffic through the switch first before requesting mac table
 		if self.owner.pinghosts:
-			_host_interfaces = [host for host in self.owner.call('list.host.interface')
+			_host_interfaces = [host for host in self.owner.hosts
 					if host['network'] == switch['network']]
 			for host in _host_interfaces:
 				x = subprocess.Popen(['ping', '-c', '1', host['ip']], stdout=subprocess.PIPE)
@@ -33,29 +38,32 @@ class Implementation(stack.commands.Implementation):
 		frontend_tftp_address = _frontend['ip']
 		switch_address = switch['ip']
 		switch_name = switch['host']
-		switch_username = self.owner.getHostAttr(switch_name, 'switch_username')
-		switch_password = self.owner.getHostAttr(switch_name, 'switch_password')
+		switch_username = self.owner.attrs[switch_name].get('switch_username')
+		switch_password = self.owner.attrs[switch_name].get('switch_password')
 
 		# Connect to the switch
-		with SwitchDellX1052(switch_address, switch_name, switch_username, switch_password) as switch:
-			try:
-				switch.set_tftp_ip(frontend_tftp_address)
-				switch.connect()
-				switch.get_mac_address_table()
-
-				hosts = switch.parse_mac_address_table()
-				for _vlan, _mac, _port, _ in hosts:
-					row = self.owner.db.select("""
-						nodes.name, networks.device FROM nodes, networks
-						WHERE networks.node=nodes.id AND networks.mac=%s
-					""", (_mac,))
-
-					if row:
-						_hostname, _interface = row[0]
-						self.owner.addOutput(switch_name,
-							[_port, _mac, _hostname, _interface, _vlan])
-
-			except SwitchException as switch_error:
-				raise CommandError(self, switch_error)
-			except:
-				raise CommandError(self, "There was an error getting the mac address table")
+		_switch = None
+		try:
+			_switch = self.owner.pool.session(SwitchDellX1052, switch_address, switch_name,
+							  switch_username, switch_password)
+			_switch.set_tftp_ip(frontend_tftp_address)
+			_switch.get_mac_address_table()
+
+			macs = {}
+			for _vlan, _mac, _port, _ in _switch.parse_mac_address_table():
+				# Port channels and the like can't be mapped
+				# to a host
+				if not _port.isdigit():
+					continue
+				macs[_mac] = (int(_port), int(_vlan) if _vlan.isdigit() else None)
+
+			return macs
+
+		except SwitchException as switch_error:
+			if _switch:
+				self.owner.pool.discard(_switch)
+			raise CommandError(self, switch_error)
+		except:
+			if _switch:
+				self.owner.pool.discard(_switch)
+			raise CommandError(self, "There was an error getting the mac address table")
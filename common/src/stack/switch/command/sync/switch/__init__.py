@@ -7,7 +7,8 @@
 import stack.commands
 import stack.util
 import subprocess
-from stack.exception import CommandError
+from stack.exception import CommandError, ParamType
+from stack.switch.pool import SwitchPool
 
 class command(stack.commands.SwitchArgumentProcessor,
 	stack.commands.sync.command):
@@ -34,6 +35,11 @@ class Command(command):
 	Default: no
 	</param>
 
+	<param type='int' name='threads' optional='1'>
+	The number of switches to sync at the same time.
+	Default: 16
+	</param>
+
 	<example cmd="sync switch switch-0-0">
 	Reconfigure and set startup configuration on switch-0-0.
 	</example>
@@ -49,19 +55,50 @@ class Command(command):
 
 	def run(self, params, args):
 
-		persistent, nukeswitch = self.fillParams([
+		persistent, nukeswitch, threads = self.fillParams([
 			('persistent', 'yes'),
 			('nukeswitch', 'no'),
+			('threads', 16),
 		])
 		self.persistent = self.str2bool(persistent)
 		self.nukeswitch = self.str2bool(nukeswitch)
+		try:
+			threads = int(threads)
+		except ValueError:
+			raise ParamType(self, 'threads', 'integer')
 
 		switches = self.getSwitchNames(args)
 
+		# Everything that needs the database is gathered up front,
+		# the workers only talk to the switches.
+
+		self.attrs    = self.getHostAttrDict(switches)
+		self.frontend = self.call('list.host.interface', [ 'localhost' ])
+
+		interfaces = {}
 		for switch in self.call('list.host.interface', switches):
-			switch_name = switch['host']
+			interfaces.setdefault(switch['host'], []).append(switch)
 
+		for switch_name in interfaces:
 			self.report('report.switch', [ switch_name ])
-			model = self.getHostAttr(switch_name, 'component.model')
-			self.runImplementation(model, [switch])
+			model = self.attrs[switch_name].get('component.model')
+			if model not in self.impl_list:
+				self.loadImplementation(model)
+
+		def sync(switch_name):
+			model = self.attrs[switch_name].get('component.model')
+			for switch in interfaces[switch_name]:
+				self.runImplementation(model, [switch])
+
+		errors = []
+		self.pool = SwitchPool(threads)
+		with self.pool:
+			for switch_name, result, error in self.pool.map(sync, interfaces):
+				if error:
+					errors.append((switch_name, error))
 
+		if len(errors) == 1:
+			raise errors[0][1]
+		if errors:
+			raise CommandError(self, '\n'.join([ '%s: %s' % (switch_name, error.msg if isinstance(error, CommandError) else error)
+							     for switch_name, error in errors ]))
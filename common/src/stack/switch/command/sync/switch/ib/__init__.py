@@ -71,6 +71,5 @@ class Command(command):
 		for switch in self.call('list.host.interface', switches):
 			switch_name = switch['host']
 
-			model = self.getHostAttr(switch_name, 'component.model')
 			self.runImplementation(switch_attrs[switch_name]['component.model'], [switch_name])
 
@@ -17,7 +17,7 @@ class Implementation(stack.commands.Implementation):
 
 		# Get frontend ip for tftp address
 		try:
-			(frontend, *args) = [host for host in self.owner.call('list.host.interface', ['localhost']) 
+			(frontend, *args) = [host for host in self.owner.frontend
 				if host['network'] == switch['network']]	
 		except:
 			raise CommandError(self, '"%s" and the frontend do not share a network' % switch['host'])	
@@ -25,18 +25,23 @@ class Implementation(stack.commands.Implementation):
 		frontend_tftp_address = frontend['ip']
 		switch_address = switch['ip']
 		switch_name = switch['host']
-		switch_username = self.owner.getHostAttr(switch_name, 'switch_username')
-		switch_password = self.owner.getHostAttr(switch_name, 'switch_password')
+		switch_username = self.owner.attrs[switch_name].get('switch_username')
+		switch_password = self.owner.attrs[switch_name].get('switch_password')
 
 		# Connect to the switch
-		with SwitchDellX1052(switch_address, switch_name, switch_username, switch_password) as _switch:
+		_switch = None
+		try:
+			_switch = self.owner.pool.session(SwitchDellX1052, switch_address, switch_name,
+							  switch_username, switch_password)
 			_switch.set_tftp_ip(frontend_tftp_address)
-			try:
-				_switch.connect()
-				_switch.upload()
-				if self.owner.persistent:
-					_switch.apply_configuration()
-			except SwitchException as switch_error:
-				raise CommandError(self, switch_error)
-			except Exception as found_error:
-				raise CommandError(self, "There was an error syncing the switch")
+			_switch.upload()
+			if self.owner.persistent:
+				_switch.apply_configuration()
+		except SwitchException as switch_error:
+			if _switch:
+				self.owner.pool.discard(_switch)
+			raise CommandError(self, switch_error)
+		except Exception as found_error:
+			if _switch:
+				self.owner.pool.discard(_switch)
+			raise CommandError(self, "There was an error syncing the switch")
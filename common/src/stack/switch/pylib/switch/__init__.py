@@ -46,6 +46,14 @@ class Switch():
 		self.current_config = '%s/current_config' % self.switchname
 		self.new_config = '%s/new_config' % self.switchname
 
+	def prompt(self, timeout=3):
+		"""
+		Checks an idle session still answers, send a newline and wait
+		TIMEOUT seconds for the prompt.  Raises SwitchException if the
+		prompt doesn't come back.
+		"""
+		raise NotImplementedError("prompt() should do a round trip to the switch prompt")
+
 	def __enter__(self):
 		# Entry point of the context manager
 		return self
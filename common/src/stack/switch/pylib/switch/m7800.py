@@ -93,6 +93,18 @@ class SwitchMellanoxM7800(Switch):
 			pass
 
 
+	def isalive(self):
+		return self.proc.isalive()
+
+	def prompt(self, timeout=3):
+		"""
+		Check the session still answers with a prompt
+		"""
+		try:
+			self.proc.ask('', timeout=timeout)
+		except ExpectMoreException:
+			raise SwitchException(f'Connection to switch at "{self.switch_ip_address}" stopped answering')
+
 	def disconnect(self):
 		if self.proc.isalive():
 			self.proc.end('quit')
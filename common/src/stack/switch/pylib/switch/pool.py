@@ -0,0 +1,117 @@
+# @copyright@
+# Copyright (c) 2006 - 2019 Teradata
+# All rights reserved. Stacki(r) v5.x stacki.com
+# https://github.com/Teradata/stacki/blob/master/LICENSE.txt
+# @copyright@
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SwitchPool():
+	"""
+	Keeps one logged in session per switch and runs switch operations
+	on many switches at once.
+
+	Sessions are reused for as long as they answer, so something
+	that talks to the same switches over and over (e.g. the health
+	producer) only pays for the SSH login once.  A session must only
+	be used by one thread at a time, map() hands every switch to a
+	single worker.
+	"""
+
+	def __init__(self, workers=16):
+		self.workers  = max(1, workers)
+		self.lock     = threading.Lock()
+		self.sessions = {}
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def session(self, cls, address, switchname=None, username=None, password=None):
+		"""
+		Returns a connected CLS (e.g. SwitchDellX1052) for the switch
+		at ADDRESS, reusing the existing session if it still answers.
+		"""
+		key = (cls, address, username)
+
+		with self.lock:
+			switch = self.sessions.pop(key, None)
+		if switch and self.answers(switch):
+			with self.lock:
+				self.sessions[key] = switch
+			return switch
+		if switch:
+			self.disconnect(switch)
+
+		# Leave out anything not given so the class defaults apply.
+
+		kwargs = { 'username': username, 'password': password }
+		kwargs = { k: v for k, v in kwargs.items() if v is not None }
+
+		switch = cls(address, switchname or 'switch', **kwargs)
+		switch.connect()
+
+		with self.lock:
+			self.sessions[key] = switch
+		return switch
+
+	def answers(self, switch):
+		"""
+		True if an idle session is still logged in.  The process being
+		alive isn't enough, the switch may have dropped the SSH session
+		without closing it, so do a round trip to the prompt.
+		"""
+		if not switch.isalive():
+			return False
+		try:
+			switch.prompt()
+		except Exception:
+			return False
+		return True
+
+	def discard(self, switch):
+		"""
+		Drops (and disconnects) a session, e.g. after an error left
+		it in an unknown state.
+		"""
+		with self.lock:
+			for key, value in list(self.sessions.items()):
+				if value is switch:
+					del self.sessions[key]
+		self.disconnect(switch)
+
+	def disconnect(self, switch):
+		try:
+			switch.disconnect()
+		except Exception:
+			pass
+
+	def close(self):
+		with self.lock:
+			sessions, self.sessions = self.sessions, {}
+		for switch in sessions.values():
+			self.disconnect(switch)
+
+	def map(self, func, items):
+		"""
+		Calls FUNC(item) for every item using at most *workers*
+		threads.  Returns a list of (item, result, exception) tuples
+		in the order of ITEMS, where exception is None on success.
+		"""
+
+		def call(item):
+			try:
+				return (item, func(item), None)
+			except Exception as e:
+				return (item, None, e)
+
+		items = list(items)
+		if len(items) < 2 or self.workers == 1:
+			return [ call(item) for item in items ]
+
+		with ThreadPoolExecutor(max_workers=min(self.workers, len(items))) as executor:
+			return list(executor.map(call, items))
@@ -4,16 +4,23 @@
 # @copyright@
 
 from . import Switch, SwitchException
+from stack.expectmore import remove_control_characters
 import os
-import time
 import pexpect
 
 
 class SwitchDellX1052(Switch):
 	"""
 	Class for interfacing with a Dell x1052 switch.
+
+	Every command waits for the console prompt rather than sleeping,
+	and table output is kept in memory.  The session is left at the
+	prompt after each call so it can be reused (see SwitchPool).
 	"""
 
+	PROMPT = 'console#'
+	MORE   = r'More: <space>|--More--'
+
 	def supported(*cls):
 		return [
 			('Dell', 'x1052'),
@@ -23,117 +30,107 @@ class SwitchDellX1052(Switch):
 		"""Connect to the switch"""
 		try:
 			self.child = pexpect.spawn('ssh -o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -tt ' +
-									   self.switch_ip_address)
+									   self.switch_ip_address,
+						   encoding='utf-8', codec_errors='replace')
 			self._expect('User Name:', 10)
 			self.child.sendline(self.username)
 			self._expect('Password:')
 			self.child.sendline(self.password)
+			self._expect(self.PROMPT)
 		except:
 			raise SwitchException("Couldn't connect to the switch")
 
-	def disconnect(self):
-		# q will exit out of an existing scrollable more/less type of prompt
-		# Probably not necessary, but a bit safer
+		# Turn off paging, the More prompt is still handled in
+		# case the switch ignores this.
+
+		self._command('terminal datadump')
+
+	def isalive(self):
+		return hasattr(self, 'child') and self.child.isalive()
 
+	def prompt(self, timeout=3):
+		"""Check the session still answers with a prompt"""
+		self.child.sendline('')
+		self._expect(self.PROMPT, timeout)
+
+	def disconnect(self):
 		# if there isn't an exit status
 		# close the connection
 		if not self.child.exitstatus:
-			self.child.sendline("\nq\n")
 			# exit should cleanly exit the ssh
-			self.child.sendline("\nexit\n")
+			self.child.sendline("exit")
 			# Just give it a few seconds to exit gracefully before terminate.
-			time.sleep(3)
-			self.child.terminate()
+			try:
+				self.child.expect(pexpect.EOF, timeout=3)
+			except pexpect.exceptions.ExceptionPexpect:
+				pass
+			self.child.terminate(force=True)
 		
 
 	def _expect(self, look_for, custom_timeout=15):
 		try:
-			self.child.expect(look_for, timeout=custom_timeout)
+			return self.child.expect(look_for, timeout=custom_timeout)
 		except pexpect.exceptions.TIMEOUT:
-			# print "Giving SSH time to close gracefully...",
-			for _ in range(9, -1, -1):
-				if not self.child.isalive():
-					break
-				time.sleep(1)
 			debug_info = str(str(self.child.before) + str(self.child.buffer) + str(self.child.after))
 			self.__exit__()
-			raise SwitchException(self.switch_ip_address + " expected output '" + look_for +
+			raise SwitchException(self.switch_ip_address + " expected output '" + str(look_for) +
 							"' from SSH connection timed out after " +
 							str(custom_timeout) + " seconds.\nBuffer: " + debug_info)
 		except pexpect.exceptions.EOF:
 			self.__exit__()
 			raise SwitchException("SSH connection to " + self.switch_ip_address + " not available.")
 
+	def _command(self, command, timeout=60):
+		"""
+		Run the command and return its output lines, paging
+		through any More prompts.
+		"""
+		self.child.sendline(command)
+		output = ''
+		while self._expect([self.PROMPT, self.MORE], timeout):
+			output += self.child.before
+			self.child.send(' ')
+		output += self.child.before
+
+		# The first line is the echo of the command
+
+		return [ remove_control_characters(line) for line in output.splitlines()[1:] ]
+
 	def get_mac_address_table(self):
 		"""Download the mac address table"""
-		time.sleep(1)
-		command = 'show mac address-table'
-		self.child.expect('console#', timeout=60)
-		with open('/tmp/%s_mac_address_table' % self.switchname, 'wb') as macout:
-			self.child.logfile = macout
-			self.child.sendline(command)
-			time.sleep(1)
-			self.send_spacebar(4)
-			self.child.expect('console#', timeout=60)
-		self.child.logfile = None
+		self.mac_address_table = self._command('show mac address-table')
 	
 	def parse_mac_address_table(self):
 		"""Parse the mac address table and return list of connected macs"""
 		_hosts = []
-		with open('/tmp/%s_mac_address_table' % self.switchname, 'r') as f:
-			for line in f.readlines():
-				if 'dynamic' in line:
-					# appends line to list
-					# map just splits out the port 
-					#   from the interface
-					_hosts.append(list(
-					  map(lambda x: x.split('/')[-1],
-					  line.split())
-					))
+		for line in self.mac_address_table:
+			if 'dynamic' in line:
+				# appends line to list
+				# map just splits out the port 
+				#   from the interface
+				_hosts.append([ x.split('/')[-1] for x in line.split() ])
 
 		return sorted(_hosts, key=lambda x: x[2])
 
 	def get_interface_status_table(self):
 		"""Download the interface status table"""
-		time.sleep(1)
-		command = 'show interface status'
-		self.child.expect('console#', timeout=60)
-		with open('/tmp/%s_interface_status_table' % self.switchname, 'wb') as macout:
-			self.child.logfile = macout
-			self.child.sendline(command)
-			time.sleep(1)
-			self.send_spacebar(4)
-			self.child.expect('console#', timeout=60)
-		self.child.logfile = None
+		self.interface_status_table = self._command('show interface status')
 	
 	def parse_interface_status_table(self):
 		"""Parse the interface status and return list of port information"""
 		_hosts = []
-		with open('/tmp/%s_interface_status_table' % self.switchname, 'r') as f:
-			for line in f.readlines():
-				if 'gi1/0/' in line:
-					# appends line to list
-					# map just splits out the port 
-					#   from the interface
-					_hosts.append(list(
-					  map(lambda x: x.split('/')[-1],
-					  line.split())
-					))
+		for line in self.interface_status_table:
+			if 'gi1/0/' in line:
+				# appends line to list
+				# map just splits out the port 
+				#   from the interface
+				_hosts.append([ x.split('/')[-1] for x in line.split() ])
 
 		return _hosts
 
-	def send_spacebar(self, times=1):
-		"""Send Spacebar; Used to read more of the output"""
-		command = "\x20"
-		for i in range(times):
-			self.child.send(command)
-			time.sleep(1)
-
 	def download(self):
 		"""Download the running-config from the switch to the server"""
 
-		self.child.expect('console#', timeout=60)
-
 		#
 		# tftp requires the destination file to already exist and to be writable by all
 		#
@@ -146,33 +143,36 @@ class SwitchDellX1052(Switch):
 			self.current_config)
 		self.child.sendline(cmd)
 		self._expect('The copy operation was completed successfully')
+		self._expect(self.PROMPT)
 
 	def upload(self):
 		"""Upload the file from the switch to the server"""
 
-		self.child.expect('console#', timeout=60)
-
 		cmd = "copy tftp://%s/%s temp" % (self.stacki_server_ip, self.new_config)
 		self.child.sendline(cmd)
 
-		time.sleep(2)
-		self.child.sendline('Y')  # A quick Y will fix the overwrite prompt if it exists.
-		self._expect('The copy operation was completed successfully')
+		# Answer the overwrite prompt if there is one.
+
+		if self._expect([ 'Overwrite file', 'The copy operation was completed successfully' ]) == 0:
+			self.child.sendline('Y')
+			self._expect('The copy operation was completed successfully')
+		self._expect(self.PROMPT)
 
 		#
 		# we remove all VLANs (2-4094) which is time consuming, so up the timeout to 30
 		#
 		self.child.sendline("copy temp running-config")
 		self._expect('The copy operation was completed successfully', custom_timeout=30)
+		self._expect(self.PROMPT)
 
 	def apply_configuration(self):
 		"""Apply running-config to startup-config"""
 		try:
-			self.child.expect('console#')
 			self.child.sendline('write')
 			self.child.expect('Overwrite file .startup-config.*\?')
 			self.child.sendline('Y')
 			self._expect('The copy operation was completed successfully')
+			self._expect(self.PROMPT)
 		except:
 			raise SwitchException('Could not apply configuration to startup-config')
 
@@ -0,0 +1,24 @@
+from unittest.mock import patch
+
+
+# Intercept pexpect calls
+mock_pexpect = patch('stack.switch.x1052.pexpect').start()
+
+# Switch data to mock MAC address table, the first MAC is gone and
+# a second one showed up
+SWITCH_DATA = """
+show mac address-table
+    show mac address-table
+Flags: I - Internal usage VLAN
+Aging time is 300 sec
+
+    Vlan          Mac Address         Port       Type
+------------ --------------------- ---------- ----------
+     1         00:00:00:00:00:01    gi1/0/11   dynamic
+     1         f4:8e:38:44:10:15       0         self
+"""
+
+# Every expect finds the console prompt, and the output of every
+# command is our SWITCH_DATA
+mock_pexpect.spawn.return_value.expect.return_value = 0
+mock_pexpect.spawn.return_value.before = SWITCH_DATA
@@ -1,11 +1,8 @@
-from unittest.mock import Mock, patch, mock_open
+from unittest.mock import patch
 
 
 # Intercept pexpect calls
-patch('stack.switch.x1052.pexpect').start()
-
-# We also don't need to sleep
-patch('stack.switch.x1052.time').start()
+mock_pexpect = patch('stack.switch.x1052.pexpect').start()
 
 # Switch data to mock MAC address table
 SWITCH_DATA = """
@@ -18,5 +15,7 @@ gi1/0/3  1G-Copper    Full    1000  Enabled  Off  Up          Disabled On
 te1/0/1  10G-Fiber      --      --     --     --  Down           --     --
 """
 
-# Return our SWITCH_DATA during a read
-patch('stack.switch.x1052.open', mock_open(read_data=SWITCH_DATA)).start()
+# Every expect finds the console prompt, and the output of every
+# command is our SWITCH_DATA
+mock_pexpect.spawn.return_value.expect.return_value = 0
+mock_pexpect.spawn.return_value.before = SWITCH_DATA
@@ -1,11 +1,9 @@
-from unittest.mock import Mock, patch, mock_open
+from unittest.mock import Mock, patch
 
 # Intercept pexpect calls
-patch('stack.switch.x1052.pexpect').start()
+mock_pexpect = patch('stack.switch.x1052.pexpect').start()
+mock_pexpect.spawn.return_value.expect.return_value = 0
 
-# We also don't need to sleep
-patch('stack.switch.x1052.time').start()
-
-# Throw an exception when we try to write the switch mac address file
-mock_open = patch('stack.switch.x1052.open').start()
-mock_open.return_value = Mock(side_effect=Exception)
+# Log in fine, then throw an exception when we send the command
+# to read the table (user name, password, terminal datadump, show)
+mock_pexpect.spawn.return_value.sendline = Mock(side_effect=[None, None, None, Exception])
@@ -0,0 +1,33 @@
+import json
+
+
+class TestCreateHostSwitchMapping:
+	def test_x1052_moved(self, host, add_host, add_switch, inject_code, test_file):
+		# Add an interface with a known MAC to our backend
+		result = host.run('stack add host interface backend-0-0 mac=00:00:00:00:00:00 ip=127.0.0.2 interface=eth0 network=private')
+		assert result.rc == 0
+
+		# Our x1052 switch, and another switch the backend used to be plugged into
+		add_switch('switch-0-1', '0', '1', 'switch', 'Dell', 'x1052')
+
+		result = host.run('stack add host interface switch-0-1 interface=eth0 network=private ip=127.0.0.1')
+		assert result.rc == 0
+
+		result = host.run('stack add host interface switch-0-0 interface=eth0 network=private')
+		assert result.rc == 0
+
+		result = host.run('stack add switch host switch-0-0 host=backend-0-0 interface=eth0 port=1')
+		assert result.rc == 0
+
+		# Inject our Mock code to replace the communication with actual hardware
+		with inject_code(test_file('list/mock_switch_mac_test_x1052.py')):
+			result = host.run('stack create host switch mapping backend-0-0 switch=switch-0-1')
+		assert result.rc == 0
+
+		# The interface is only on the switch it was found on
+		result = host.run('stack list switch host output-format=json')
+		assert result.rc == 0
+		assert [
+			(port['switch'], port['host'], port['interface'], port['port'])
+			for port in json.loads(result.stdout)
+		] == [('switch-0-1', 'backend-0-0', 'eth0', 10)]
@@ -242,14 +242,14 @@ class TestEnableDiscovery:
 			"INFO: discovery daemon started",
 			"INFO: detected a dhcp request: 52:54:00:00:00:03 eth1",
 			"INFO: found a new node: 52:54:00:00:00:03 eth1",
-			"INFO: successfully added host backend-0-0",
 			"INFO: detected a dhcp request: 52:54:00:00:00:03 eth1",
 			"INFO: detected a dhcp request: 52:54:00:00:00:04 eth1",
 			"INFO: found a new node: 52:54:00:00:00:04 eth1",
-			"INFO: successfully added host backend-0-1",
 			"INFO: detected a dhcp request: 52:54:00:00:00:04 eth1",
 			"INFO: detected a dhcp request: 52:54:00:00:00:03 eth1",
 			"INFO: detected a dhcp request: 52:54:00:00:00:04 eth1",
+			"INFO: successfully added host backend-0-0",
+			"INFO: successfully added host backend-0-1",
 			"INFO: discovery daemon stopped"
 		]
 
@@ -74,3 +74,23 @@ class TestListHost:
 			'rack': '0',
 			'rank': '1'
 		}]
+
+	def test_lookup_by_scope(self, host, add_host):
+		result = host.run('stack list host a:backend output-format=col:host')
+		assert result.rc == 0
+		assert result.stdout == 'backend-0-0\n'
+
+		# Scoped names are case sensitive
+		result = host.run('stack list host a:BACKEND output-format=col:host')
+		assert result.rc == 0
+		assert result.stdout == ''
+
+	def test_lookup_by_bad_where(self, host, add_host):
+		# An expression that doesn't parse doesn't match any host
+		result = host.run('stack list host "where appliance ==" output-format=col:host')
+		assert result.rc == 0
+		assert result.stdout == ''
+
+		result = host.run('stack list host "where appliance == \'backend\'" output-format=col:host')
+		assert result.rc == 0
+		assert result.stdout == 'backend-0-0\n'
@@ -33,6 +33,44 @@ class TestListSwitchMac:
 			'vlan': '1'
 		}]
 
+	def test_x1052_gone(self, host, add_host, inject_code, test_file):
+		# Add two interfaces with known MACs to our backend
+		result = host.run('stack add host interface backend-0-0 mac=00:00:00:00:00:00 ip=127.0.0.2 interface=eth0 network=private')
+		assert result.rc == 0
+
+		result = host.run('stack add host interface backend-0-0 mac=00:00:00:00:00:01 interface=eth1')
+		assert result.rc == 0
+
+		# Add our x1052 switch
+		result = host.run('stack add host switch-0-0')
+		assert result.rc == 0
+
+		result = host.run('stack set host attr switch-0-0 attr=component.model value=x1052')
+		assert result.rc == 0
+
+		result = host.run('stack add host interface switch-0-0 interface=eth0 network=private ip=127.0.0.1')
+		assert result.rc == 0
+
+		# Cache the table with the first MAC
+		with inject_code(test_file('list/mock_switch_mac_test_x1052.py')):
+			result = host.run('stack list switch mac output-format=json')
+		assert result.rc == 0
+
+		# Now the switch only knows the second MAC, the first one
+		# should be dropped from the cache
+		with inject_code(test_file('list/mock_switch_mac_gone_test_x1052.py')):
+			result = host.run('stack list switch mac refresh=true output-format=json')
+
+		assert result.rc == 0
+		assert json.loads(result.stdout) == [{
+			'host': 'backend-0-0',
+			'interface': 'eth1',
+			'mac': '00:00:00:00:00:01',
+			'port': '11',
+			'switch': 'switch-0-0',
+			'vlan': '1'
+		}]
+
 	def test_x1052_not_same_network(self, host, add_network):
 		# Add our x1052 switch on the wrong network
 		result = host.run('stack add host switch-0-0')
@@ -0,0 +1,41 @@
+import json
+
+
+class TestLoad:
+	def load(self, host, tmp_path, document):
+		path = tmp_path / 'document.json'
+		path.write_text(json.dumps(document))
+
+		return host.run(f'stack load {path} exec=true')
+
+	def attr(self, host, *args):
+		result = host.run(f'stack list attr {" ".join(args)} output-format=json')
+		assert result.rc == 0
+
+		return [(row['value'], row['type']) for row in json.loads(result.stdout)]
+
+	def test_exec_plain_attr_over_shadow(self, host, tmp_path):
+		"""Test a plain attr loaded over a shadow attr replaces it."""
+		result = host.run('stack set attr attr=test value=secret shadow=true')
+		assert result.rc == 0
+		assert self.attr(host, 'attr=test') == [('secret', 'shadow')]
+
+		result = self.load(host, tmp_path, {
+			'attr': [{'name': 'test', 'value': 'plain'}]
+		})
+		assert result.rc == 0
+
+		assert self.attr(host, 'attr=test') == [('plain', 'var')]
+
+	def test_exec_new_appliance_attr(self, host, tmp_path):
+		"""Test attrs of an object added by the same section are set."""
+		result = self.load(host, tmp_path, {
+			'appliance': [{
+				'name': 'test',
+				'public': 'no',
+				'attr': [{'name': 'test', 'value': 'plain'}]
+			}]
+		})
+		assert result.rc == 0
+
+		assert self.attr(host, 'scope=appliance', 'test', 'attr=test') == [('plain', 'var')]
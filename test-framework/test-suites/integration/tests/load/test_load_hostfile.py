@@ -47,18 +47,9 @@ class TestLoadHostfile:
 
 		return input_tmp_file, output_tmp_file
 
-	@pytest.mark.parametrize("csvfile", HOSTFILE_SPREADHSEETS)
-	def test_load_hostfile(self, host, csvfile, revert_etc, test_file):
-		"""Goes through and loads each individual csv then compares report matches expected output."""
-		# get filename
-		input_tmp_file, output_tmp_file = self.update_csv_variables(host, csvfile, test_file)
-
-		# Add a network address with 2 hosts
-		result = host.run('stack add network autoip address=10.1.1.4 mask=255.255.255.252')
-
-		host.run('stack load hostfile')
-		# Load the hostfile input
-		host.run('stack load hostfile file=%s' % input_tmp_file.name)
+	@staticmethod
+	def compare_report(host, output_tmp_file):
+		"""Checks stack report hostfile matches the expected output."""
 		# Get the new stack hostfile back out
 		stack_output_file = tempfile.NamedTemporaryFile(delete=True)
 		host.run('stack report hostfile > %s' % stack_output_file.name)
@@ -72,6 +63,41 @@ class TestLoadHostfile:
 		for i in range(len(test_lines)):
 			assert test_lines[i].strip() == stack_lines[i].strip()
 
+	@pytest.mark.parametrize("batch", [False, True])
+	@pytest.mark.parametrize("csvfile", HOSTFILE_SPREADHSEETS)
+	def test_load_hostfile(self, host, csvfile, batch, revert_etc, test_file):
+		"""Goes through and loads each individual csv then compares report matches expected output."""
+		# get filename
+		input_tmp_file, output_tmp_file = self.update_csv_variables(host, csvfile, test_file)
+
+		# Add a network address with 2 hosts
+		result = host.run('stack add network autoip address=10.1.1.4 mask=255.255.255.252')
+
+		host.run('stack load hostfile')
+		# Load the hostfile input
+		host.run('stack load hostfile file=%s batch=%s' % (input_tmp_file.name, batch))
+
+		self.compare_report(host, output_tmp_file)
+
+	@pytest.mark.parametrize("csvfile", HOSTFILE_SPREADHSEETS)
+	def test_load_hostfile_batch_reload(self, host, csvfile, revert_etc, test_file):
+		"""Reloads each csv in batch mode on top of a normal load, nothing should change."""
+		input_tmp_file, output_tmp_file = self.update_csv_variables(host, csvfile, test_file)
+
+		host.run('stack add network autoip address=10.1.1.4 mask=255.255.255.252')
+
+		# Some of the files are rejected, then neither load changes anything
+		host.run('stack load hostfile file=%s' % input_tmp_file.name)
+		before = host.run('stack list host interface output-format=json')
+		assert before.rc == 0
+
+		host.run('stack load hostfile file=%s batch=true' % input_tmp_file.name)
+		after = host.run('stack list host interface output-format=json')
+		assert after.rc == 0
+
+		assert json.loads(after.stdout) == json.loads(before.stdout)
+		self.compare_report(host, output_tmp_file)
+
 	def test_load_hostfile_ip_no_network(self, host, test_file):
 		# load hostfile containing an interface with an IP but no network (invalid)
 		result = host.run(f'stack load hostfile file={test_file("load/load_hostfile_ip_no_network.csv")}')
@@ -0,0 +1,117 @@
+import io
+import json
+from collections import OrderedDict
+from unittest.mock import patch
+
+import stack.commands.dump
+
+
+class CommandUnderTest(stack.commands.dump.Command):
+	"""A subclass of the dump command that replaces __init__ to remove the database dependency."""
+
+	def __init__(self):
+		self.text = []
+		self.stream = None
+
+	def addText(self, text):
+		self.text.append(text)
+
+
+HOST = OrderedDict(
+	name = 'backend-0-0',
+	metadata = None,
+	comment = 'a "quoted"\nmultiline comment',
+	group = [],
+	interface = [OrderedDict(interface = 'eth0', alias = ['one', 'two'])],
+	attr = [OrderedDict(name = 'a', value = 1, shadow = True)],
+	partition = [],
+)
+
+
+class TestDumpDocument:
+	def test_add_document(self):
+		"""Test the text is the same as json.dumps gives the document, a generator section included."""
+		command = CommandUnderTest()
+		command.add_document([
+			('version', '5.0'),
+			('host', (host for host in [HOST, HOST])),
+			('empty', (host for host in [])),
+			('attr', [])
+		])
+
+		assert command.text == [json.dumps(OrderedDict(
+			version = '5.0',
+			host = [HOST, HOST],
+			empty = [],
+			attr = []
+		), indent = 8)]
+
+	def test_add_document_streamed(self):
+		"""Test a streamed document is written out as it is encoded, a host at a time."""
+		command = CommandUnderTest()
+		command.stream = io.StringIO()
+		built = []
+
+		def hosts():
+			for host in [HOST, HOST]:
+				# the previous host was already written
+				assert command.stream.getvalue().count('backend-0-0') == len(built)
+				built.append(host)
+				yield host
+
+		command.add_document([('version', '5.0'), ('host', hosts())])
+
+		assert command.text == []
+		assert command.stream.getvalue() == json.dumps(OrderedDict(version = '5.0', host = [HOST, HOST]), indent = 8) + '\n'
+
+	def test_command_sections(self):
+		"""Test the sections of a sub-command come back undecoded, or decoded from its text."""
+		command = CommandUnderTest()
+		hosts = (host for host in [HOST])
+
+		def run(o, name, args):
+			if name == 'dump.host':
+				o.add_document([('version', '5.0'), ('host', hosts)])
+			else:
+				o.text = '{"version": "5.0", "os": []}'
+
+		sub = CommandUnderTest()
+		sub.getText = lambda: ''.join(sub.text)
+		command.loadCommand = lambda name: sub
+		command.runCommand = run
+
+		assert command.command_sections('dump.host') == [('version', '5.0'), ('host', hosts)]
+
+		sub = CommandUnderTest()
+		sub.getText = lambda: sub.text
+		assert list(command.command_sections('dump.os')) == [('version', '5.0'), ('os', [])]
+
+	@patch('stack.commands.dump.stack.version', '5.0')
+	def test_plugins_merged(self):
+		"""Test the plugin documents are merged in, a repeated key keeps its place and the last value."""
+		command = CommandUnderTest()
+		for name in ['access', 'attr', 'controller', 'partition', 'firewall', 'route']:
+			setattr(command, f'dump_{name}', lambda: [])
+
+		plugins = [
+			OrderedDict(version = '5.0', host = [HOST]),
+			OrderedDict(version = '5.1', attr = [OrderedDict(name = 'a', value = 'b')], os = [])
+		]
+		# Any JSON layout, or the sections themselves
+		command.runPlugins = lambda: [
+			(None, list(plugins[0].items())),
+			(None, json.dumps(plugins[1], separators = (',', ':'))),
+		]
+		command.run({}, [])
+
+		assert command.text == [json.dumps(OrderedDict(
+			version = '5.1',
+			access = [],
+			attr = [OrderedDict(name = 'a', value = 'b')],
+			controller = [],
+			partition = [],
+			firewall = [],
+			route = [],
+			host = [HOST],
+			os = []
+		), indent = 8)]
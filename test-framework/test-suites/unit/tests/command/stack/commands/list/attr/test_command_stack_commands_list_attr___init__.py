@@ -0,0 +1,173 @@
+from unittest.mock import MagicMock
+
+from stack.commands.list.attr import AttrResolver
+
+
+class FakeDatabase:
+	"""
+	Answers the selects AttrResolver.load() makes from a dictionary of
+	{(scope, target, attr): value} for the cluster database and one for
+	the shadow database.
+	"""
+
+	def __init__(self, names, attrs, shadow):
+		self.names = names
+		self.attrs = attrs
+		self.shadow = shadow
+
+	def select(self, query, args=None):
+		query = ' '.join(query.split())
+
+		if query.startswith('name from '):
+			return [(name,) for name in self.names[query.split()[-1]]]
+
+		scope = args[0] if isinstance(args, tuple) else args
+		rows = []
+		for shadow, attrs in ((True, self.shadow), (False, self.attrs)):
+			if shadow and 'union' not in query:
+				continue
+
+			for (s, target, attr), value in attrs.items():
+				if s != scope:
+					continue
+				if s == 'global':
+					rows.append((shadow, attr, value))
+				else:
+					rows.append((target, shadow, attr, value))
+
+		return rows
+
+
+class TestAttrResolver:
+	names = {
+		'oses': ['redhat', 'sles'],
+		'appliances': ['backend', 'frontend'],
+		'environments': ['lab'],
+		'nodes': ['backend-0-0', 'backend-0-1']
+	}
+
+	scopes = {
+		'backend-0-0': ('redhat', 'backend', 'lab'),
+		'backend-0-1': ('sles', 'backend', None)
+	}
+
+	def resolver(self, attrs, shadow_attrs = {}, **kwargs):
+		owner = MagicMock()
+		owner.db = FakeDatabase(self.names, attrs, shadow_attrs)
+
+		resolver = AttrResolver(owner, const = False, **kwargs)
+		resolver.hosts = self.scopes
+
+		return resolver
+
+	def test_resolve_precedence(self):
+		"""Test each scope overrides the ones before it, global -> os -> appliance -> environment -> host."""
+		resolver = self.resolver({
+			('global', 'global', 'a'): 'global',
+			('global', 'global', 'b'): 'global',
+			('os', 'redhat', 'b'): 'os',
+			('os', 'redhat', 'c'): 'os',
+			('appliance', 'backend', 'c'): 'appliance',
+			('appliance', 'backend', 'd'): 'appliance',
+			('environment', 'lab', 'd'): 'environment',
+			('environment', 'lab', 'e'): 'environment',
+			('host', 'backend-0-0', 'e'): 'host',
+		})
+
+		attrs = resolver.resolve(['backend-0-0', 'backend-0-1'])
+
+		assert attrs['backend-0-0'] == {
+			'a': ('global', 'var', 'global'),
+			'b': ('os', 'var', 'os'),
+			'c': ('appliance', 'var', 'appliance'),
+			'd': ('environment', 'var', 'environment'),
+			'e': ('host', 'var', 'host'),
+		}
+
+		# Different os and no environment, so only global and appliance apply
+		assert attrs['backend-0-1'] == {
+			'a': ('global', 'var', 'global'),
+			'b': ('global', 'var', 'global'),
+			'c': ('appliance', 'var', 'appliance'),
+			'd': ('appliance', 'var', 'appliance'),
+		}
+
+	def test_resolve_glob(self):
+		"""Test only the attributes matching the glob are returned."""
+		resolver = self.resolver({
+			('global', 'global', 'os.name'): 'redhat',
+			('global', 'global', 'rank'): '0',
+			('host', 'backend-0-0', 'os.version'): '7.x',
+		})
+
+		assert resolver.resolve(['backend-0-0'], glob = 'os.*') == {
+			'backend-0-0': {
+				'os.name': ('redhat', 'var', 'global'),
+				'os.version': ('7.x', 'var', 'host'),
+			}
+		}
+
+	def test_shadow_overrides_var(self):
+		"""Test a shadow attribute hides the plain attribute in the same scope."""
+		attrs = {
+			('global', 'global', 'password'): 'plain',
+			('host', 'backend-0-0', 'password'): 'plain',
+		}
+		shadow = {
+			('global', 'global', 'password'): 'secret',
+			('host', 'backend-0-0', 'password'): 'hostsecret',
+		}
+
+		resolver = self.resolver(attrs, shadow)
+		assert resolver.resolve(['backend-0-0', 'backend-0-1']) == {
+			'backend-0-0': {'password': ('hostsecret', 'shadow', 'host')},
+			'backend-0-1': {'password': ('secret', 'shadow', 'global')},
+		}
+
+		# Without shadow attributes the plain values show through
+		resolver = self.resolver(attrs, shadow, shadow = False)
+		assert resolver.resolve(['backend-0-0', 'backend-0-1']) == {
+			'backend-0-0': {'password': ('plain', 'var', 'host')},
+			'backend-0-1': {'password': ('plain', 'var', 'global')},
+		}
+
+	def test_host_consts(self):
+		"""Test host consts replace any host attributes with the same name."""
+		owner = MagicMock()
+		owner.call.return_value = []
+		owner.db.select.side_effect = lambda query, args = None: (
+			[('backend-0-0', 'lab', 0, 0, None), ('backend-0-1', None, 0, 1, None)]
+			if 'n.metadata' in query else []
+		)
+
+		resolver = AttrResolver(owner)
+		resolver.hosts = self.scopes
+
+		attributes = resolver.addHostAttrs({
+			'backend-0-0': {
+				'rack': ('9', 'var', 'host'),
+			},
+			'backend-0-1': {
+				'rank': ('9', 'var', 'host'),
+			}
+		})
+
+		assert attributes['backend-0-0']['rack'] == (0, 'const', 'host')
+		assert attributes['backend-0-0']['environment'] == ('lab', 'const', 'host')
+		assert attributes['backend-0-0']['os'] == ('redhat', 'const', 'host')
+
+		assert attributes['backend-0-1']['rank'] == (1, 'const', 'host')
+		assert attributes['backend-0-1']['hostname'] == ('backend-0-1', 'const', 'host')
+		assert 'environment' not in attributes['backend-0-1']
+
+	def test_load_is_cached(self):
+		"""Test the attributes are only loaded from the database once."""
+		resolver = self.resolver({('global', 'global', 'a'): '1'})
+		resolver.owner.db = MagicMock(wraps = resolver.db)
+		resolver.db = resolver.owner.db
+
+		first = resolver.load()
+		calls = resolver.db.select.call_count
+
+		assert resolver.load() is first
+		assert resolver.db.select.call_count == calls
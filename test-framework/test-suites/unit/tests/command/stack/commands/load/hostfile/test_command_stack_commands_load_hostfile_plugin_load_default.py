@@ -0,0 +1,174 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from stack.commands.load.hostfile.plugin_load_default import Plugin
+from stack.exception import CommandError
+
+
+class FakeDatabase:
+	"""Answers the selects the batch mode makes from canned rows and records the writes."""
+
+	def __init__(self, rows):
+		self.rows = rows
+		self.statements = []
+
+	def select(self, query, args = None):
+		query = ' '.join(query.split())
+		for key, rows in self.rows.items():
+			if query.startswith(key):
+				return rows
+
+		return []
+
+	def execute(self, query, args = None, many = False):
+		query = ' '.join(query.split())
+		self.statements.append((query, args))
+
+		# New groups are looked up again once they are added
+		if query.startswith('insert into groups'):
+			groups = self.rows['id, name from groups']
+			groups.extend((len(groups) + 1, name) for (name, ) in args)
+
+
+def plugin(rows):
+	owner = MagicMock()
+	owner.db = FakeDatabase(rows)
+
+	plugin = Plugin(owner)
+	plugin.appliances = {'backend': 1, 'frontend': 2}
+	plugin.boxes = {'default': 1}
+	plugin.subnets = {'private': 1}
+	plugin.bootnames = {('default', 'install'): 1, ('default', 'os'): 2, ('console', 'install'): 3}
+	plugin.bootactions = {('default', 'install', None), ('default', 'os', None), ('console', 'install', 'sles')}
+	plugin.boxoses = {'default': 'redhat'}
+
+	return plugin
+
+
+class TestBatch:
+	NODES = [
+		('backend-0-0', 'backend', 'default', '0', '0', None, 'default', 'default'),
+		('backend-0-1', 'backend', 'default', '0', '1', None, 'default', 'default'),
+	]
+
+	def test_hosts_unchanged(self):
+		"""Test nothing is written when the spreadsheet matches the database."""
+		batch = plugin({'n.name, a.name': self.NODES})
+
+		count = batch.batchHosts({
+			'backend-0-0': {'appliance': 'backend', 'rack': '0', 'rank': '0'},
+			'backend-0-1': {'appliance': 'backend', 'rack': '0', 'rank': '1'},
+		})
+
+		assert count == 0
+		assert batch.db.statements == []
+
+	def test_hosts_changed(self):
+		"""Test changed hosts are updated grouped by value and new hosts inserted."""
+		batch = plugin({'n.name, a.name': self.NODES})
+
+		count = batch.batchHosts({
+			'backend-0-0': {'appliance': 'backend', 'rack': '1', 'rank': '0'},
+			'backend-0-1': {'appliance': 'backend', 'rack': '1', 'rank': '1'},
+			'backend-0-2': {'appliance': 'backend', 'rack': '0', 'rank': '2'},
+			'backend-0-3': {'appliance': 'backend'},
+		})
+
+		assert count == 4
+		insert, update = batch.db.statements
+		assert insert[0].startswith('insert into nodes')
+		assert insert[1] == [('backend-0-2', 1, 1, '0', '2', 1, 2, None)]
+		assert update == ('update nodes set rack=%s where name in (%s, %s)', ['1', 'backend-0-0', 'backend-0-1'])
+
+		# Without a rack and rank add host picks the name
+		batch.owner.call.assert_called_once_with('add.host', ['backend-0-3', 'appliance=backend'])
+
+	def test_groups(self):
+		"""Test only the memberships that differ are added or removed."""
+		batch = plugin({
+			'id, name from groups': [(1, 'old'), (2, 'kept')],
+			'nodeid, groupid from memberships': [(10, 1), (10, 2), (99, 1)],
+		})
+		batch.nodes = {'backend-0-0': 10}
+
+		count = batch.batchGroups({'backend-0-0': {'groups': ['kept', 'new']}})
+
+		assert count == 2
+		assert batch.db.statements == [
+			('insert into groups (name) values (%s)', [('new',)]),
+			('delete from memberships where nodeid=%s and groupid=%s', [(10, 1)]),
+			('insert into memberships (nodeid, groupid) values (%s, %s)', [(10, 3)]),
+		]
+
+	def test_interfaces(self):
+		"""Test only the hosts whose interfaces differ are replaced, ip=auto matches any address."""
+		batch = plugin({
+			'node, id, device': [
+				(10, 100, 'eth0', '00:00:00:00:00:01', '10.0.0.1', 'backend-0-0', 1, None, None, None, None, 1),
+				(11, 101, 'eth0', '00:00:00:00:00:02', '10.0.0.2', 'backend-0-1', 1, None, None, None, None, 1),
+			]
+		})
+		batch.nodes = {'backend-0-0': 10, 'backend-0-1': 11}
+
+		count = batch.batchInterfaces({
+			'backend-0-0': {
+				'eth0': {'mac': '00:00:00:00:00:01', 'ip': 'auto', 'network': 'private', 'default': 'true'}
+			},
+			'backend-0-1': {
+				'eth0': {'mac': '00:00:00:00:00:02', 'ip': '10.0.0.3', 'network': 'private', 'default': 'true'}
+			},
+		})
+
+		assert count == 1
+		insert, = batch.db.statements
+		assert insert[1] == [(11, 'eth0', '00:00:00:00:00:02', '10.0.0.3', 'backend-0-1', 1, None, None, None, None, True)]
+
+		# The old interfaces are removed with their aliases and anything else that refers to them
+		batch.owner.call.assert_called_once_with('remove.host.interface', ['backend-0-1', 'all=true'])
+
+	def test_interfaces_one_default(self):
+		"""Test only the last default interface add host interface would add stays the default."""
+		batch = plugin({})
+		batch.nodes = {'backend-0-0': 10}
+
+		batch.batchInterfaces({
+			'backend-0-0': {
+				'eth0': {'ip': '10.0.0.1', 'network': 'private', 'default': 'true'},
+				'eth1': {'ip': '10.0.0.2', 'network': 'private', 'default': 'true'},
+				'eth2': {'ip': '10.0.0.3', 'network': 'private'},
+			},
+		})
+
+		insert, = batch.db.statements
+		assert [(row[1], row[-1]) for row in insert[1]] == [('eth0', False), ('eth1', True), ('eth2', False)]
+		batch.owner.call.assert_not_called()
+
+	def test_hosts_lowercase(self):
+		"""Test host names and boot actions are stored in lowercase like add host does."""
+		batch = plugin({
+			'id, name from appliances': [(1, 'backend')],
+			'id, name from boxes': [(1, 'default')],
+			'id, name from subnets': [(1, 'private')],
+			'id, name from nodes': [(12, 'backend-0-2')],
+			'id, name, type from bootnames': [(1, 'default', 'install'), (2, 'default', 'os')],
+			'bn.name, bn.type, o.name': [('default', 'install', None), ('default', 'os', None)],
+			'b.name, o.name': [('default', 'redhat')],
+		})
+
+		batch.runBatch({'Backend-0-2': {'appliance': 'backend', 'rack': '0', 'rank': '2', 'osaction': 'Default'}}, {})
+
+		insert = batch.db.statements[0]
+		assert insert[1] == [('backend-0-2', 1, 1, '0', '2', 1, 2, None)]
+
+	def test_bootaction_os(self):
+		"""Test a boot action must be defined for the OS of the box of the host."""
+		batch = plugin({'n.name, a.name': self.NODES})
+
+		with pytest.raises(CommandError, match = '"console" install boot action for "redhat" is missing'):
+			batch.batchHosts({'backend-0-2': {'appliance': 'backend', 'rack': '0', 'rank': '2', 'installaction': 'console'}})
+
+		with pytest.raises(CommandError, match = '"console" install boot action for "redhat" is missing'):
+			batch.batchHosts({'backend-0-0': {'installaction': 'console'}})
+
+		assert batch.db.statements == []
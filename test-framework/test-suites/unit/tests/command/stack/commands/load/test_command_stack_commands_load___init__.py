@@ -0,0 +1,100 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+import stack.commands.load
+from stack.exception import ArgNotFound, CommandError
+
+
+class CommandUnderTest(stack.commands.load.Command):
+	"""A subclass of the load command that replaces __init__ to remove the database dependency."""
+
+	def __init__(self, hosts):
+		self.hosts = hosts
+		self.statements = []
+		self.plan = []
+
+		self.db = MagicMock()
+		self.db.execute.side_effect = self.execute_sql
+
+	def execute_sql(self, query, args = None, many = False):
+		query = ' '.join(query.split())
+		self.statements.append((query.split()[0], query.split()[2], args))
+
+	def getHostnames(self, names = []):
+		hosts = [host for host in self.hosts if any(host.startswith(name.rstrip('*')) for name in names)]
+		if not hosts:
+			raise ArgNotFound(self, names[0], 'host')
+
+		return hosts
+
+	def command(self, command, args = []):
+		self.statements.append(('command', command, args))
+
+	def beginOutput(self):
+		pass
+
+	def addOutput(self, owner, vals):
+		pass
+
+	def endOutput(self, header = [], padChar = '-', trimOwner = True):
+		pass
+
+
+class TestLoadExec:
+	def test_plain_attr_replaces_shadow(self):
+		"""Test a plain attr removes the shadow value as well as the old one."""
+		command = CommandUnderTest([])
+		command.plan = [('global', 'set.attr', [], {'scope': 'global', 'attr': 'a', 'value': '1'})]
+		command.execute()
+
+		assert command.statements == [
+			('delete', 'shadow.attributes', [('global', 'a')]),
+			('delete', 'attributes', [('global', 'a')]),
+			('insert', 'attributes', [('global', 'a', '1')]),
+		]
+
+	def test_attrs_flushed_before_commands(self):
+		"""Test the attrs queued so far are written before the next command runs."""
+		command = CommandUnderTest(['backend-0-0'])
+		command.plan = [
+			('host', 'set.attr', ['backend-0-0'], {'scope': 'host', 'attr': 'a', 'value': '1'}),
+			('host', 'set.attr', ['backend-0-0'], {'scope': 'host', 'attr': 'b', 'value': '2'}),
+			('host', 'remove.host.attr', ['backend-0-0'], {'attr': 'a'}),
+			('host', 'set.attr', ['backend-0-0'], {'scope': 'host', 'attr': 'c', 'value': '3'}),
+		]
+		command.execute()
+
+		assert [statement[:2] for statement in command.statements] == [
+			('delete', 'shadow.attributes'),
+			('delete', 'attributes'),
+			('insert', 'attributes'),
+			('command', 'remove.host.attr'),
+			('delete', 'shadow.attributes'),
+			('delete', 'attributes'),
+			('insert', 'attributes'),
+		]
+		assert command.statements[2][2] == [('host', 'a', '1', 'backend-0-0'), ('host', 'b', '2', 'backend-0-0')]
+		assert command.statements[6][2] == [('host', 'c', '3', 'backend-0-0')]
+
+	def test_attr_targets_resolved(self):
+		"""Test attr targets are looked up like set attr does, so host selectors match several hosts."""
+		command = CommandUnderTest(['backend-0-0', 'backend-0-1', 'frontend-0-0'])
+		command.plan = [('host', 'set.attr', ['backend*'], {'scope': 'host', 'attr': 'a', 'value': '1'})]
+		command.execute()
+
+		assert command.statements[-1] == (
+			'insert', 'attributes', [('host', 'a', '1', 'backend-0-0'), ('host', 'a', '1', 'backend-0-1')]
+		)
+
+	def test_unknown_attr_target(self):
+		"""Test an attr for an unknown host fails the load and rolls it back."""
+		command = CommandUnderTest(['backend-0-0'])
+		command.plan = [('host', 'set.attr', ['backend-0-9'], {'scope': 'host', 'attr': 'a', 'value': '1'})]
+
+		with pytest.raises(CommandError, match = 'host section: cannot set attr "a"'):
+			command.execute()
+
+		assert command.statements == []
+		command.db.database.rollback.assert_called_once_with()
+		command.db.database.commit.assert_not_called()
@@ -0,0 +1,73 @@
+from unittest.mock import patch
+
+import stack.commands.sync
+
+
+class CommandUnderTest(stack.commands.sync.command):
+	"""A subclass of the sync command that replaces __init__ to remove the database dependency."""
+
+	def __init__(self, rows):
+		self.rows = rows
+
+	def call(self, command, args = []):
+		return [{'col-1': row} for row in self.rows]
+
+
+def report(tmp_path, rows, incremental = False):
+	"""Runs report() and returns the files it wrote and the text fed to report script."""
+	command = CommandUnderTest(rows)
+	command.syncState = str(tmp_path / 'sync.json')
+	command.incremental = incremental
+
+	with patch('stack.commands.sync.subprocess.Popen') as mock_popen:
+		mock_popen.return_value.communicate.return_value = (b'', b'')
+		written = command.report('report.test')
+
+	text = b''.join(
+		call[0][0] for call in mock_popen.return_value.stdin.write.call_args_list
+	).decode()
+
+	return written, text
+
+
+class TestSyncReport:
+	def test_several_files_in_a_row(self, tmp_path):
+		"""Test a single row carrying several lines and files is split up."""
+		first = tmp_path / 'first'
+		second = tmp_path / 'second'
+		row = (
+			f'<stack:file stack:name="{first}">\none\n</stack:file>\n'
+			f'<stack:file stack:name="{second}">\ntwo\n</stack:file>'
+		)
+
+		written, text = report(tmp_path, [row])
+
+		assert written == [str(first), str(second)]
+		assert text == row + '\n'
+
+	def test_unchanged_files_written_by_default(self, tmp_path):
+		"""Test only an incremental report skips the files that didn't change."""
+		name = tmp_path / 'file'
+		rows = [f'<stack:file stack:name="{name}">', 'text', '</stack:file>']
+
+		# report script doesn't run in the test, so the file is
+		# already there with what it would write
+		name.write_text('text\n')
+
+		assert report(tmp_path, rows)[0] == [str(name)]
+		assert report(tmp_path, rows)[0] == [str(name)]
+		assert report(tmp_path, rows, incremental = True) == ([], '')
+
+		# a file changed on disk is written again
+		name.write_text('edited\n')
+		assert report(tmp_path, rows, incremental = True)[0] == [str(name)]
+
+	def test_append_never_skipped(self, tmp_path):
+		"""Test appending to a file happens on every incremental report."""
+		name = tmp_path / 'file'
+		rows = [f'<stack:file stack:name="{name}" stack:mode="append">', 'text', '</stack:file>']
+
+		for i in range(2):
+			written, text = report(tmp_path, rows, incremental = True)
+			assert written == [str(name)]
+			assert 'text' in text
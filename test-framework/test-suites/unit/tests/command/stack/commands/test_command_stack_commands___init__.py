@@ -1,4 +1,4 @@
-from stack.commands import Command, Implementation
+from stack.commands import Command, Implementation, QueryCache, DatabaseConnection
 from unittest.mock import patch, create_autospec, ANY
 from concurrent.futures import Future
 from collections import namedtuple
@@ -260,3 +260,119 @@ class TestCommand:
 			)
 			for key in test_implementation_mapping
 		}
+
+	def test_end_output_native(self):
+		"""Test that commands run by call() keep their rows and print nothing."""
+		test_command = CommandUnderTest()
+		test_command.text = ''
+		test_command.output = [['backend-0-0', 'os']]
+		test_command._params = {}
+		test_command._native = True
+		test_command._rows = None
+
+		test_command.endOutput(header = ['host', 'action'])
+
+		assert test_command._rows == [{'host': 'backend-0-0', 'action': 'os'}]
+		assert test_command.text == ''
+
+	def test_end_output_native_not_a_format(self):
+		"""Test that output-format=native from the command line isn't special."""
+		test_command = CommandUnderTest()
+		test_command.text = ''
+		test_command.output = [['backend-0-0', 'os']]
+		test_command._params = {'output-format': 'native'}
+		test_command._native = False
+		test_command._rows = None
+		test_command.width = 0
+		test_command.colors = {'bold': {'code': ''}, 'reset': {'code': ''}}
+
+		test_command.endOutput(header = ['host', 'action'])
+
+		assert test_command._rows is None
+		assert 'backend-0-0' in test_command.text
+
+
+class TestQueryCache:
+
+	def test_get_put(self):
+		"""Test that a cached value comes back and that misses return None."""
+		cache = QueryCache(10)
+
+		assert cache.get('foo') is None
+		cache.put('foo', ('bar',), {'nodes'})
+		assert cache.get('foo') == ('bar',)
+		assert cache.stats['hits'] == 1
+		assert cache.stats['misses'] == 1
+
+	def test_invalidate_by_table(self):
+		"""Test that only the entries that read the written table are dropped."""
+		cache = QueryCache(10)
+		cache.put('hosts', ('a',), {'nodes'})
+		cache.put('networks', ('b',), {'networks', 'subnets'})
+		cache.put('unknown', ('c',), set())
+
+		assert cache.invalidate({'subnets'}) == 2
+		assert cache.get('hosts') == ('a',)
+		assert cache.get('networks') is None
+
+		# entries without any known table are dropped on every write
+		assert cache.get('unknown') is None
+
+	def test_lru_eviction(self):
+		"""Test that the least recently used entry is evicted when the cache is full."""
+		cache = QueryCache(2)
+		cache.put('foo', 1, {'nodes'})
+		cache.put('bar', 2, {'nodes'})
+
+		# touch foo so bar becomes the oldest entry
+		cache.get('foo')
+		cache.put('baz', 3, {'nodes'})
+
+		assert len(cache) == 2
+		assert cache.get('bar') is None
+		assert cache.get('foo') == 1
+		assert cache.stats['evictions'] == 1
+
+		# evicted keys shouldn't be left behind in the table index
+		assert cache.invalidate({'nodes'}) == 2
+		assert cache.readers == {}
+
+	@patch.dict(DatabaseConnection.tables, {'cascade': {'nodes', 'networks', 'scope_map', 'routes', 'subnets'}})
+	@patch.dict(DatabaseConnection.cache, {'cascade': QueryCache(10)})
+	def test_invalidate_cascade(self):
+		"""Test a delete drops the selects of the tables it cascades to."""
+		db = DatabaseConnection(None)
+		db.name = 'cascade'
+		cache = DatabaseConnection.cache['cascade']
+
+		cache.put('routes', ('a',), {'routes'})
+		cache.put('networks', ('b',), {'networks'})
+		cache.put('subnets', ('c',), {'subnets'})
+
+		# an update doesn't cascade
+		db.invalidate('update nodes set rack=0 where id=1')
+		assert len(cache) == 3
+
+		# nodes -> scope_map -> routes and nodes -> networks
+		db.invalidate('delete from nodes where id=1')
+		assert cache.get('routes') is None
+		assert cache.get('networks') is None
+		assert cache.get('subnets') == ('c',)
+
+	@patch.dict(DatabaseConnection.tables, {'shadowed': {'nodes', 'networks'}})
+	@patch.dict(DatabaseConnection.cache, {'shadowed': QueryCache(10)})
+	def test_set_and_list_commands_imported(self):
+		"""Test the cache still works once the set and list command packages shadow the builtins."""
+		import stack.commands.set.host.attr
+		import stack.commands.list.host
+
+		db = DatabaseConnection(None)
+		db.name = 'shadowed'
+		cache = DatabaseConnection.cache['shadowed']
+
+		cache.put('hosts', ('a',), {'nodes'})
+		assert db.getTables('select name from nodes') == {'nodes'}
+		assert db.getReferences({'networks'}) >= {'networks'}
+
+		db.invalidate('update nodes set rack=0 where id=1')
+		assert cache.get('hosts') is None
@@ -0,0 +1,170 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import ipaddress
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from stack.discovery import Discovery
+from stack.exception import CommandError
+
+
+class FakeCommand:
+	"""Answers the commands the daemon calls from a list of hosts, and records the calls."""
+
+	def __init__(self, interfaces):
+		self.interfaces = interfaces
+		self.calls = []
+		self.fail = {}
+		self.conflicts = []
+		self.db = MagicMock()
+		self.db.select.side_effect = lambda query, args: self.conflicts
+
+	def call(self, cmd, args = None):
+		self.calls.append((cmd, args))
+
+		if cmd in self.fail and args[0] in self.fail[cmd]:
+			raise CommandError(self, f'{cmd} failed')
+		if cmd == 'list.host.interface':
+			return [{'host': host, 'interface': 'eth0', 'mac': mac, 'ip': ip} for host, mac, ip in self.interfaces]
+		if cmd == 'list.host':
+			return [{'host': host} for host, mac, ip in self.interfaces]
+
+		return []
+
+	def called(self, cmd):
+		return [args for name, args in self.calls if name == cmd]
+
+
+@pytest.fixture
+def discovery(tmp_path):
+	with patch.object(Discovery, '_LOGFILE', str(tmp_path / 'discovery.log')), \
+	     patch.dict(Discovery._get_next_ip_address_cache, clear = True), \
+	     patch.dict(Discovery._get_network_for_interface_cache, clear = True), \
+	     patch('stack.discovery.subprocess') as mock_subprocess:
+		mock_subprocess.run.return_value.returncode = 0
+
+		discovery = Discovery()
+		discovery._command = FakeCommand([('backend-0-0', '00:00:00:00:00:00', '10.1.1.1')])
+		discovery._db_lock = threading.Lock()
+		discovery._socket = MagicMock()
+		discovery._appliance_name = 'backend'
+		discovery._base_name = 'backend'
+		discovery._rack = 0
+		discovery._rank = 1
+		discovery._box = 'default'
+		discovery._install_action = 'default'
+		discovery._install = True
+
+		discovery._claims = {}
+		discovery._build_index()
+
+		discovery._loop = asyncio.new_event_loop()
+		discovery._executor = ThreadPoolExecutor(max_workers = 1)
+		discovery._pending = []
+		discovery._flush_handle = None
+		discovery._refresh_handle = None
+		discovery._batches = set()
+		discovery._done = False
+
+		# Every address of the network is found on eth1
+		discovery._get_network_for_interface_cache['eth1'] = 'private'
+		discovery._get_hosts_for_interface = lambda interface: ipaddress.ip_network('10.1.1.0/29').hosts()
+
+		yield discovery
+
+		discovery._executor.shutdown()
+		discovery._loop.close()
+
+
+def dhcp(discovery, *macs):
+	"""Feeds a DHCPDISCOVER line for each MAC and waits for the batches to be added."""
+	for mac in macs:
+		discovery._process_dhcp_line(f'dhcpd: DHCPDISCOVER from {mac} via eth1: network 10.1.1.0/29')
+
+	discovery._loop.run_until_complete(discovery._wait_for_batches())
+
+
+class TestDiscovery:
+	def test_batch(self, discovery):
+		"""Test the nodes found together are added with one boot action and one sync."""
+		dhcp(discovery, '00:00:00:00:00:01', '00:00:00:00:00:02', '00:00:00:00:00:03')
+
+		assert [args[0] for args in discovery._command.called('add.host')] == ['backend-0-1', 'backend-0-2', 'backend-0-3']
+		assert [args[5] for args in discovery._command.called('add.host.interface')] == ['ip=10.1.1.2', 'ip=10.1.1.3', 'ip=10.1.1.4']
+		assert discovery._command.called('set.host.boot') == [['backend-0-1', 'backend-0-2', 'backend-0-3', 'action=install']]
+		assert discovery._command.db.select.call_count == 1
+		assert discovery._socket.sendto.call_count == 3
+		assert discovery._claims == {}
+
+	def test_batch_size(self, discovery):
+		"""Test a full batch is handed off without waiting for the batch window."""
+		with patch.object(Discovery, '_BATCH_SIZE', 2):
+			dhcp(discovery, '00:00:00:00:00:01', '00:00:00:00:00:02', '00:00:00:00:00:03')
+
+		assert discovery._command.called('set.host.boot') == [
+			['backend-0-1', 'backend-0-2', 'action=install'],
+			['backend-0-3', 'action=install'],
+		]
+
+	def test_known_mac(self, discovery):
+		"""Test a MAC in the database or already found isn't added again."""
+		dhcp(discovery, '00:00:00:00:00:00', '00:00:00:00:00:01', '00:00:00:00:00:01')
+
+		assert [args[0] for args in discovery._command.called('add.host')] == ['backend-0-1']
+
+	def test_failed_add_released(self, discovery):
+		"""Test a node that couldn't be added gives up its MAC, IP, and name for the next request."""
+		discovery._command.fail['add.host'] = ['backend-0-1']
+		dhcp(discovery, '00:00:00:00:00:01')
+
+		assert '00:00:00:00:00:01' not in discovery._mac_addresses
+		assert '10.1.1.2' not in discovery._ip_addresses
+		assert 'backend-0-1' not in discovery._hostnames
+		assert discovery._command.called('set.host.boot') == []
+
+		discovery._command.fail.clear()
+		dhcp(discovery, '00:00:00:00:00:01')
+
+		assert discovery._command.called('add.host.interface') == [[
+			'backend-0-1', 'interface=NULL', 'default=true', 'mac=00:00:00:00:00:01',
+			'name=backend-0-1', 'ip=10.1.1.2', 'network=private'
+		]]
+
+	def test_failed_interface_removes_host(self, discovery):
+		"""Test a host whose interface couldn't be added is taken out again."""
+		discovery._command.fail['add.host.interface'] = ['backend-0-1']
+		dhcp(discovery, '00:00:00:00:00:01', '00:00:00:00:00:02')
+
+		assert discovery._command.called('remove.host') == [['backend-0-1']]
+		assert discovery._command.called('set.host.boot') == [['backend-0-2', 'action=install']]
+		assert 'backend-0-1' not in discovery._hostnames
+		assert discovery._rank == 1
+
+	def test_conflict_keeps_taken(self, discovery):
+		"""Test only the parts of a node someone else added are kept in the index."""
+		discovery._command.conflicts = [('00:00:00:00:00:09', '10.1.1.2', 'other-0-0')]
+		dhcp(discovery, '00:00:00:00:00:01')
+
+		assert discovery._command.called('add.host') == []
+		assert '00:00:00:00:00:01' not in discovery._mac_addresses
+		assert '10.1.1.2' in discovery._ip_addresses
+		assert 'backend-0-1' not in discovery._hostnames
+
+	def test_refresh_index(self, discovery):
+		"""Test a removed host is forgotten when the index is read again, but a waiting node isn't."""
+		discovery._command.interfaces = []
+		discovery._process_dhcp_line('dhcpd: DHCPDISCOVER from 00:00:00:00:00:01 via eth1')
+
+		discovery._refresh_index()
+		discovery._loop.run_until_complete(asyncio.wait(discovery._batches))
+
+		assert discovery._mac_addresses == {'00:00:00:00:00:01'}
+		assert discovery._hostnames == {'backend-0-1'}
+		assert discovery._refresh_handle is not None
+
+		# The removed host can be found again
+		dhcp(discovery, '00:00:00:00:00:00')
+
+		assert [args[0] for args in discovery._command.called('add.host')] == ['backend-0-1', 'backend-0-2']
@@ -0,0 +1,212 @@
+import asyncio
+import os
+import time
+from unittest.mock import patch
+
+from stack.logtail import LogTail
+
+
+class Collector:
+	"Collects the lines from a LogTail along with when they showed up."
+
+	def __init__(self):
+		self.lines = []
+		self.times = []
+
+	def __call__(self, line):
+		self.lines.append(line)
+		self.times.append(time.monotonic())
+
+	async def wait(self, count, timeout=5):
+		deadline = time.monotonic() + timeout
+		while len(self.lines) < count and time.monotonic() < deadline:
+			await asyncio.sleep(0.01)
+
+		return self.lines
+
+
+def write(path, text, mode="a"):
+	with open(path, mode) as f:
+		f.write(text)
+
+
+def run(coroutine):
+	loop = asyncio.new_event_loop()
+	try:
+		return loop.run_until_complete(coroutine(loop))
+	finally:
+		loop.close()
+
+
+class TestLogTail:
+	def test_new_lines(self, tmp_path):
+		"Test only the lines written after we start following are seen."
+
+		log = tmp_path / "messages"
+		write(log, "old line\n")
+
+		async def inner(loop):
+			tail = LogTail(loop)
+			collector = Collector()
+			tail.follow(str(log), collector)
+
+			write(log, "DHCPDISCOVER from 52:54:00:00:00:01 via eth1\n")
+			write(log, "DHCPDISCOVER from 52:54:00:00:00:02 via eth1\n")
+
+			lines = await collector.wait(2)
+			tail.close()
+
+			return lines
+
+		assert run(inner) == [
+			"DHCPDISCOVER from 52:54:00:00:00:01 via eth1\n",
+			"DHCPDISCOVER from 52:54:00:00:00:02 via eth1\n"
+		]
+
+	def test_partial_line(self, tmp_path):
+		"Test a line written in pieces is only handed out once it is complete."
+
+		log = tmp_path / "messages"
+		write(log, "")
+
+		async def inner(loop):
+			tail = LogTail(loop)
+			collector = Collector()
+			tail.follow(str(log), collector)
+
+			write(log, "DHCPDISCOVER from ")
+			await asyncio.sleep(0.1)
+			partial = list(collector.lines)
+
+			write(log, "52:54:00:00:00:01 via eth1\n")
+			lines = await collector.wait(1)
+			tail.close()
+
+			return partial, lines
+
+		partial, lines = run(inner)
+		assert partial == []
+		assert lines == ["DHCPDISCOVER from 52:54:00:00:00:01 via eth1\n"]
+
+	def test_truncate(self, tmp_path):
+		"Test a log truncated in place (logrotate copytruncate) is read from the top."
+
+		log = tmp_path / "messages"
+		write(log, "")
+
+		async def inner(loop):
+			tail = LogTail(loop)
+			collector = Collector()
+			tail.follow(str(log), collector)
+
+			write(log, "first line before the truncate\n")
+			await collector.wait(1)
+
+			write(log, "", mode="w")
+			write(log, "second\n")
+			lines = await collector.wait(2)
+			tail.close()
+
+			return lines
+
+		assert run(inner) == ["first line before the truncate\n", "second\n"]
+
+	def test_rotate(self, tmp_path):
+		"Test a log renamed and recreated (logrotate create) without losing lines."
+
+		log = tmp_path / "messages"
+		write(log, "")
+
+		async def inner(loop):
+			tail = LogTail(loop)
+			collector = Collector()
+			tail.follow(str(log), collector)
+
+			write(log, "one\n")
+			await collector.wait(1)
+
+			# The writer still has the old file until it is told to reopen
+			os.rename(log, tmp_path / "messages.1")
+			write(tmp_path / "messages.1", "two\n")
+			write(log, "three\n")
+			write(log, "four\n")
+
+			lines = await collector.wait(4)
+			tail.close()
+
+			return lines
+
+		assert run(inner) == ["one\n", "two\n", "three\n", "four\n"]
+
+	def test_created_later(self, tmp_path):
+		"Test following a log that doesn't exist yet."
+
+		log = tmp_path / "messages"
+
+		async def inner(loop):
+			tail = LogTail(loop)
+			collector = Collector()
+			tail.follow(str(log), collector)
+
+			write(log, "one\n")
+			lines = await collector.wait(1)
+			tail.close()
+
+			return lines
+
+		assert run(inner) == ["one\n"]
+
+	@patch("stack.logtail.Inotify", side_effect=OSError)
+	def test_polling(self, mock_inotify, tmp_path):
+		"Test the polling fallback when inotify isn't available."
+
+		log = tmp_path / "messages"
+		write(log, "")
+
+		async def inner(loop):
+			tail = LogTail(loop, interval=0.05)
+			collector = Collector()
+			tail.follow(str(log), collector)
+			assert not tail.inotify
+
+			write(log, "one\n")
+			lines = await collector.wait(1)
+			tail.close()
+
+			return lines
+
+		assert run(inner) == ["one\n"]
+
+	def test_latency(self, tmp_path):
+		"""
+		Measure how long a synthetic DHCP line takes to reach the callback,
+		the old readline loop slept a second whenever it was idle.
+		"""
+
+		log = tmp_path / "messages"
+		write(log, "")
+		count = 100
+
+		async def inner(loop):
+			tail = LogTail(loop)
+			collector = Collector()
+			tail.follow(str(log), collector)
+
+			written = []
+			for i in range(count):
+				written.append(time.monotonic())
+				write(log, f"DHCPDISCOVER from 52:54:00:00:{i // 256:02x}:{i % 256:02x} via eth1\n")
+				await asyncio.sleep(0.005)
+
+			lines = await collector.wait(count)
+			tail.close()
+
+			return lines, [seen - sent for sent, seen in zip(written, collector.times)]
+
+		lines, latency = run(inner)
+
+		assert len(lines) == count
+		assert lines[-1] == f"DHCPDISCOVER from 52:54:00:00:00:{count - 1:02x} via eth1\n"
+
+		print(f"latency: mean {sum(latency) / count * 1000:.2f}ms max {max(latency) * 1000:.2f}ms")
+		assert max(latency) < 0.5
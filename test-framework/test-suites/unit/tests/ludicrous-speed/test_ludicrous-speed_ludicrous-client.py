@@ -0,0 +1,94 @@
+import hashlib
+import importlib.util
+import os
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+# The client is a script, it isn't part of a package
+spec = importlib.util.spec_from_file_location('ludicrous_client', '/opt/stack/bin/ludicrous-client.py')
+client = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(client)
+
+BODY = b'package body' * 1000
+
+REPOMD = """<?xml version="1.0" encoding="UTF-8"?>
+<repomd xmlns="http://linux.duke.edu/metadata/repo">
+  <data type="primary">
+    <location href="repodata/primary.xml"/>
+  </data>
+</repomd>
+"""
+
+PRIMARY = """<?xml version="1.0" encoding="UTF-8"?>
+<metadata xmlns="http://linux.duke.edu/metadata/common" packages="1">
+  <package type="rpm">
+    <checksum type="sha256" pkgid="YES">%s</checksum>
+    <size package="%d"/>
+    <location href="RPMS/foo.rpm"/>
+  </package>
+</metadata>
+""" % (hashlib.sha256(BODY).hexdigest(), len(BODY))
+
+
+def response(body):
+	res = MagicMock()
+	res.iter_content.return_value = [body[i:i + 4096] for i in range(0, len(body), 4096)]
+	return res
+
+
+class TestSaveFile:
+	def test_save(self, tmp_path):
+		"""Test a file that matches the repodata is put in place."""
+		expected = ('sha256', hashlib.sha256(BODY).hexdigest(), len(BODY))
+
+		assert client.save_file(response(BODY), '%s/' % tmp_path, 'foo.rpm', expected)
+		assert (tmp_path / 'foo.rpm').read_bytes() == BODY
+		assert os.listdir(tmp_path) == ['foo.rpm']
+
+	def test_save_unchecked(self, tmp_path):
+		"""Test a file that isn't in the repodata is saved as is."""
+		assert client.save_file(response(BODY), '%s/' % tmp_path, 'repomd.xml')
+		assert (tmp_path / 'repomd.xml').read_bytes() == BODY
+
+	@pytest.mark.parametrize('body', [BODY[:-1], BODY[:-1] + b'X'])
+	def test_save_mismatch(self, tmp_path, body):
+		"""Test a file that doesn't match the repodata leaves nothing behind to be served."""
+		expected = ('sha256', hashlib.sha256(BODY).hexdigest(), len(BODY))
+
+		assert not client.save_file(response(body), '%s/' % tmp_path, 'foo.rpm', expected)
+		assert os.listdir(tmp_path) == []
+
+
+class TestRepodataChecksum:
+	@pytest.fixture
+	def repo(self, tmp_path):
+		repodata = tmp_path / 'install' / 'repo' / 'repodata'
+		repodata.mkdir(parents = True)
+		(repodata / 'repomd.xml').write_text(REPOMD)
+
+		with patch.dict(client.client_settings, LOCAL_SAVE_LOCATION = str(tmp_path)), \
+		     patch.dict(client.repodata, clear = True):
+			yield repodata
+
+	def test_checksum(self, repo):
+		"""Test a package is looked up in the repodata of its repository."""
+		(repo / 'primary.xml').write_text(PRIMARY)
+
+		assert client.repodata_checksum('/install/repo/RPMS/foo.rpm') == (
+			'sha256', hashlib.sha256(BODY).hexdigest(), len(BODY)
+		)
+		assert client.repodata_checksum('/install/repo/RPMS/bar.rpm') is None
+
+	def test_not_a_repository(self, repo):
+		"""Test a file outside of any repository has no checksum."""
+		assert client.repodata_checksum('/install/other/foo.rpm') is None
+
+	def test_failed_read_not_cached(self, repo):
+		"""Test repodata that can't be read yet is read again on the next lookup."""
+		assert client.repodata_checksum('/install/repo/RPMS/foo.rpm') is None
+		assert client.repodata == {}
+
+		(repo / 'primary.xml').write_text(PRIMARY)
+
+		assert client.repodata_checksum('/install/repo/RPMS/foo.rpm') is not None
@@ -0,0 +1,84 @@
+import json
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import stack.mq
+from stack.mq.processors.health import Processor
+
+
+def message(payload, ttl = -1, source = '10.1.1.1'):
+	msg = stack.mq.Message(payload, channel = 'health', source = source)
+	msg.ttl = ttl
+	return msg
+
+
+@pytest.fixture
+def processor():
+	with patch('redis.StrictRedis') as mock_redis, \
+	     patch('stack.api.Select') as mock_select:
+		mock_select.return_value = [('10.1.1.1', 'backend-0-0', 1, 0, 0, 'backend')]
+
+		processor = Processor(MagicMock(), MagicMock())
+		processor.select = mock_select
+		processor.pipe = mock_redis.return_value.pipeline.return_value
+		yield processor
+
+
+def stored(pipe):
+	"""Returns the health keys written to the pipeline as key -> (state, ttl)."""
+	status = {}
+	for call in pipe.mset.call_args_list:
+		status.update({key: (state, None) for key, state in call[0][0].items()})
+	for call in pipe.set.call_args_list:
+		if ':status:' in call[0][0]:
+			status[call[0][0]] = (call[0][1], call[1]['ex'])
+	return status
+
+
+class TestProcessor:
+	def test_process_batch(self, processor):
+		"""Test the latest state of every component is stored with its TTL."""
+		processor.processBatch([
+			message(json.dumps({'state': 'online', 'ssh': 'up'})),
+			message(json.dumps({'ssh': 'down'}), ttl = 300),
+		])
+
+		assert stored(processor.pipe) == {
+			'host:1:status:state': ('online', None),
+			'host:1:status:ssh': ('down', 300),
+		}
+		processor.pipe.hset.assert_any_call('smq:processor:health', 'messages', 2)
+
+	def test_bad_values(self, processor):
+		"""Test values Redis would refuse are dealt with one message at a time."""
+		processor.processBatch([
+			message(json.dumps({'ssh': True, 'disks': {'sda': 'ok'}, 'db': None, 'load': 0.5})),
+			message(json.dumps({'expired': 'down'}), ttl = 0),
+			message(json.dumps({'broken': 'down'}), ttl = 'never'),
+			message('online', ttl = '300'),
+		])
+
+		assert stored(processor.pipe) == {
+			'host:1:status:ssh': ('true', None),
+			'host:1:status:disks': ('{"sda": "ok"}', None),
+			'host:1:status:db': ('null', None),
+			'host:1:status:load': (0.5, None),
+			'host:1:status:state': ('online', 300),
+		}
+
+	def test_unknown_pruned(self, processor):
+		"""Test unknown sources are looked up once per timeout and forgotten after it."""
+		processor.select.return_value = []
+		processor.processBatch([message('online', source = '10.1.1.2')])
+		processor.processBatch([message('online', source = '10.1.1.2')])
+
+		assert processor.select.call_count == 1
+		assert list(processor.unknown) == ['10.1.1.2']
+
+		processor.unknown['10.1.1.2'] = time.time() - 1
+		processor.processBatch([message('online', source = '10.1.1.3')])
+
+		assert processor.select.call_count == 2
+		assert list(processor.unknown) == ['10.1.1.3']
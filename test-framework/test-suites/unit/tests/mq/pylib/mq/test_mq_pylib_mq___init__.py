@@ -0,0 +1,71 @@
+import pytest
+
+from stack.mq import Frame, Message
+
+
+class TestFrame:
+	def test_round_trip(self):
+		"""Test the records come back out of a packed frame exactly as they went in."""
+		first = str(Message('one', channel = 'health', ttl = 10)).encode()
+		second = str(Message({'state': 'up'}, source = '10.1.1.1')).encode()
+
+		frame = Frame('10.1.1.2')
+		frame.add(b'health', first)
+		frame.add(b'status', second, hops = 2)
+		frame.add(b'empty', b'')
+
+		assert frame.count == 3
+		assert Frame.unpack(frame.pack()) == ('10.1.1.2', [
+			(b'health', first, 0),
+			(b'status', second, 2),
+			(b'empty', b'', 0),
+		])
+
+		frame.clear()
+		assert Frame.unpack(frame.pack()) == ('10.1.1.2', [])
+
+	def test_unpack_no_source(self):
+		"""Test a frame from a shipper that doesn't know its address."""
+		data = Frame().add(b'health', b'{}').pack()
+
+		assert Frame.unpack(data) == ('', [(b'health', b'{}', 0)])
+
+	@pytest.mark.parametrize('channel, body, cut', [
+		(b'health', b'{"payload": "one"}', 1),
+		(b'health', b'{"payload": "one"}', 20),
+		(b'', b'', 1),
+	])
+	def test_unpack_truncated(self, channel, body, cut):
+		"""Test a frame cut short in a body, a channel or a record header is rejected."""
+		data = Frame('10.1.1.2').add(channel, body).pack()
+
+		with pytest.raises(ValueError, match = 'truncated message frame'):
+			Frame.unpack(data[:-cut])
+
+	def test_unpack_not_a_frame(self):
+		"""Test data without the frame magic is rejected."""
+		with pytest.raises(ValueError, match = 'not a message frame'):
+			Frame.unpack(b'{"payload": "one"}')
+
+	def test_needs_decode(self):
+		"""Test only a message whose hops or source must change has to be decoded."""
+		unsourced = str(Message({'source': 'payload'}, time = 'now')).encode()
+		sourced = str(Message('one', source = '10.1.1.1', time = 'now')).encode()
+
+		assert not Frame.needsDecode(unsourced, 0, '')
+		assert Frame.needsDecode(unsourced, 0, '10.1.1.2')
+		assert not Frame.needsDecode(sourced, 0, '10.1.1.2')
+		assert Frame.needsDecode(sourced, 1, '10.1.1.2')
+
+	def test_decode(self):
+		"""Test a decoded record has the hops added and a missing source set."""
+		body = str(Message('one', hops = 1, time = 'now')).encode()
+
+		msg = Frame.decode(b'health', body, 2, '10.1.1.2')
+		assert msg.getChannel() == 'health'
+		assert msg.getPayload() == 'one'
+		assert msg.getHops() == 3
+		assert msg.getSource() == '10.1.1.2'
+
+		body = str(Message('one', source = '10.1.1.1')).encode()
+		assert Frame.decode(b'health', body, 0, '10.1.1.2').getSource() == '10.1.1.1'
@@ -0,0 +1,101 @@
+import importlib.util
+import threading
+from unittest.mock import patch
+
+import pytest
+
+# The wsgi script is installed under a name mod_wsgi can load, it isn't
+# part of a package
+spec = importlib.util.spec_from_file_location('setPxeboot', '/var/www/cgi-bin/setPxeboot.py')
+setPxeboot = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(setPxeboot)
+
+
+class FakeStack:
+	"""Stands in for stack.api, a transaction fails if it names a bad host."""
+
+	def __init__(self, bad = ()):
+		self.bad = set(bad)
+		self.transactions = []
+		self.synced = []
+
+	def Transaction(self, calls):
+		self.transactions.append(calls)
+		return not any(self.bad & set(args) for cmd, args in calls)
+
+	def Call(self, cmd, args = None):
+		assert cmd == 'sync host boot'
+		self.synced.append(args)
+
+	def ReturnCode(self):
+		return 0
+
+
+@pytest.fixture
+def stack_api():
+	with patch.object(setPxeboot.stack, 'api') as mock_api:
+		fake = FakeStack()
+		mock_api.Transaction.side_effect = fake.Transaction
+		mock_api.Call.side_effect = fake.Call
+		mock_api.ReturnCode.side_effect = fake.ReturnCode
+
+		yield fake
+
+
+def submit(batch, hosts):
+	"""Submits the hosts from a thread each, like concurrent requests, and returns what they were answered."""
+	answers = {}
+
+	def request(host):
+		answers[host] = batch.submit(host)
+
+	threads = [threading.Thread(target = request, args = (host,)) for host in hosts]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+
+	return answers
+
+
+class TestBatch:
+	def test_reset_is_one_transaction(self, stack_api):
+		"""Test the boot action and the attrs are reset in a single transaction and then synced."""
+		assert setPxeboot.Batch.reset(None, ['10.1.1.1', '10.1.1.2'])
+
+		assert stack_api.transactions == [[
+			('set host boot', ['10.1.1.1', '10.1.1.2', 'action=os', 'sync=false']),
+			('set host attr', ['10.1.1.1', '10.1.1.2', 'attr=nukedisks', 'value=false']),
+			('set host attr', ['10.1.1.1', '10.1.1.2', 'attr=nukecontroller', 'value=false']),
+			('set host attr', ['10.1.1.1', '10.1.1.2', 'attr=secureerase', 'value=false']),
+		]]
+		assert stack_api.synced == [['10.1.1.1', '10.1.1.2']]
+
+	def test_failed_reset_not_synced(self, stack_api):
+		"""Test nothing is synced when the transaction fails."""
+		stack_api.bad.add('10.1.1.1')
+
+		assert not setPxeboot.Batch.reset(None, ['10.1.1.1'])
+		assert stack_api.synced == []
+
+	def test_requests_batched(self, stack_api):
+		"""Test requests that arrive together are reset at once and each is answered."""
+		batch = setPxeboot.Batch()
+		hosts = ['10.1.1.%d' % i for i in range(1, 11)]
+
+		assert submit(batch, hosts) == {host: True for host in hosts}
+
+		assert len(stack_api.transactions) == 1
+		assert stack_api.synced == [sorted(hosts)]
+
+	def test_failed_batch_retried(self, stack_api):
+		"""Test a batch that fails is retried one host at a time, so only the bad host isn't reset."""
+		stack_api.bad.add('10.1.1.2')
+		batch = setPxeboot.Batch()
+		hosts = ['10.1.1.1', '10.1.1.2', '10.1.1.3']
+
+		# The bad host is answered too, it doesn't wait for the timeout
+		assert submit(batch, hosts) == {host: True for host in hosts}
+
+		assert len(stack_api.transactions) == 4
+		assert stack_api.synced == [['10.1.1.1'], ['10.1.1.3']]
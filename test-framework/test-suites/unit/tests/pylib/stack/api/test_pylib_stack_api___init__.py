@@ -0,0 +1,70 @@
+import sys
+import types
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import stack.api
+import stack.commands.list
+
+
+class Inner(stack.commands.list.command):
+	"""Lists two rows."""
+
+	def run(self, params, args):
+		self.beginOutput()
+		self.addOutput('a', ['1'])
+		self.addOutput('b', ['2'])
+		self.endOutput(header = ['host', 'value'])
+
+
+class Parse(stack.commands.list.command):
+	"""Parses the text of list apitest inner, like list host profile does with list host xml."""
+
+	def run(self, params, args):
+		self.beginOutput()
+		for line in self.command('list.apitest.inner').splitlines()[1:]:
+			host, value = line.split()
+			self.addOutput(host, [int(value) * 10])
+		self.endOutput(header = ['host', 'value'])
+
+
+class Pass(stack.commands.list.command):
+	"""Hands back the output of list apitest inner as its own, like list host attr does with list attr."""
+
+	def run(self, params, args):
+		self.addText(self.command('list.apitest.inner', self._argv, passthrough = True))
+
+
+@pytest.fixture
+def commands():
+	"""Installs the fake commands as list apitest inner, parse and pass."""
+	apitest = types.ModuleType('stack.commands.list.apitest')
+	modules = {apitest.__name__: apitest}
+	for name, cls in (('inner', Inner), ('parse', Parse), ('pass', Pass)):
+		module = types.ModuleType(f'{apitest.__name__}.{name}')
+		module.Command = cls
+		setattr(apitest, name, module)
+		modules[module.__name__] = module
+
+	with patch.dict(sys.modules, modules), \
+	     patch.object(stack.commands.list, 'apitest', apitest, create = True), \
+	     patch.object(stack.commands.Command, 'hasAccess', return_value = True), \
+	     patch.object(stack.api, '_database', return_value = MagicMock()):
+		yield
+
+
+class TestNative:
+	def test_parsed_subcommand(self, commands):
+		"""Test a sub-command whose text is parsed runs as text and its rows aren't handed back."""
+		assert stack.api._native(['list', 'apitest', 'parse'], [], 'json', True) == (0, [
+			{'host': 'a', 'value': 10},
+			{'host': 'b', 'value': 20},
+		])
+
+	def test_passthrough_subcommand(self, commands):
+		"""Test a pass-through command hands back the rows of its sub-command."""
+		assert stack.api._native(['list', 'apitest', 'pass'], [], 'json', True) == (0, [
+			{'host': 'a', 'value': '1'},
+			{'host': 'b', 'value': '2'},
+		])
@@ -0,0 +1,112 @@
+import pytest
+
+from stack.switch import SwitchException
+from stack.switch.pool import SwitchPool
+
+
+class FakeSwitch:
+	"""Stands in for a switch driver, counts the logins and prompt round trips."""
+
+	instances = []
+
+	def __init__(self, address, switchname, username = 'admin', password = ''):
+		self.address = address
+		self.username = username
+		self.alive = False
+		self.answering = True
+		self.prompts = 0
+		self.disconnects = 0
+		FakeSwitch.instances.append(self)
+
+	def connect(self):
+		self.alive = True
+
+	def isalive(self):
+		return self.alive
+
+	def prompt(self, timeout = 3):
+		self.prompts += 1
+		if not self.answering:
+			raise SwitchException('stopped answering')
+
+	def disconnect(self):
+		self.alive = False
+		self.disconnects += 1
+
+
+@pytest.fixture
+def pool():
+	FakeSwitch.instances = []
+	with SwitchPool(4) as pool:
+		yield pool
+
+
+class TestSwitchPool:
+	def test_session_reused(self, pool):
+		"""Test a session that answers the prompt is handed out again without logging in."""
+		first = pool.session(FakeSwitch, '10.1.1.1', username = 'admin')
+		assert first.prompts == 0
+
+		assert pool.session(FakeSwitch, '10.1.1.1', username = 'admin') is first
+		assert first.prompts == 1
+		assert len(FakeSwitch.instances) == 1
+
+	def test_session_per_user(self, pool):
+		"""Test each address and username gets its own session."""
+		first = pool.session(FakeSwitch, '10.1.1.1', username = 'admin')
+
+		assert pool.session(FakeSwitch, '10.1.1.2', username = 'admin') is not first
+		assert pool.session(FakeSwitch, '10.1.1.1', username = 'other') is not first
+		assert len(FakeSwitch.instances) == 3
+
+	def test_session_not_answering(self, pool):
+		"""Test a session whose process is alive but doesn't answer the prompt is replaced."""
+		first = pool.session(FakeSwitch, '10.1.1.1')
+		first.answering = False
+
+		second = pool.session(FakeSwitch, '10.1.1.1')
+		assert second is not first
+		assert second.isalive()
+		assert first.disconnects == 1
+		assert pool.session(FakeSwitch, '10.1.1.1') is second
+
+	def test_session_dead(self, pool):
+		"""Test a dead session is replaced without trying the prompt."""
+		first = pool.session(FakeSwitch, '10.1.1.1')
+		first.alive = False
+
+		assert pool.session(FakeSwitch, '10.1.1.1') is not first
+		assert first.prompts == 0
+
+	def test_discard(self, pool):
+		"""Test a discarded session is disconnected and not handed out again."""
+		first = pool.session(FakeSwitch, '10.1.1.1')
+		pool.discard(first)
+
+		assert first.disconnects == 1
+		assert pool.session(FakeSwitch, '10.1.1.1') is not first
+
+	def test_close(self, pool):
+		"""Test closing the pool disconnects every session."""
+		switches = [pool.session(FakeSwitch, address) for address in ('10.1.1.1', '10.1.1.2')]
+		pool.close()
+
+		assert [switch.disconnects for switch in switches] == [1, 1]
+		assert pool.sessions == {}
+
+	def test_map(self, pool):
+		"""Test the results come back in order and an exception is returned with its item."""
+		error = ValueError('odd')
+
+		def func(item):
+			if item % 2:
+				raise error
+			return item * 10
+
+		assert pool.map(func, range(5)) == [
+			(0, 0, None),
+			(1, None, error),
+			(2, 20, None),
+			(3, None, error),
+			(4, 40, None),
+		]